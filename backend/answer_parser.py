@@ -0,0 +1,207 @@
+"""
+Parsing of the individual expert answers produced by the convergence prompt (prompt 5).
+
+The prompt asks for a JSON object with one key per persona name. The parser works in
+a few linear passes over the response, with no backtracking patterns:
+  1. decode the outermost {...} span as JSON
+  2. if that fails, repair it in one scan (strip code fences and trailing commas,
+     close an unterminated string and any unclosed brackets) and decode again
+  3. for personas the JSON did not cover (or when the response is not JSON at all),
+     split the text into sections at lines that start with a persona name
+Personas still without an answer get a placeholder, and are reported as missing.
+"""
+import json
+from typing import List, NamedTuple
+
+DEFAULT_ANSWER = "This expert contributed their perspective to the final refinement."
+
+# Characters skipped before a persona name at the start of a section header line
+_HEADER_PREFIX = " \t#*-_>•0123456789.)"
+
+
+class ParsedAnswers(NamedTuple):
+    answers: List[dict]
+    # "json", "repaired_json", "sections" or "none"
+    method: str
+    missing: List[str]
+
+
+def format_instructions(persona_names):
+    """Prompt text asking for the answers as a JSON object keyed by persona name."""
+    example = json.dumps({name: "..." for name in persona_names})
+    return (
+        "Respond with only a JSON object, with no markdown or code fences. It must have exactly one key per "
+        f"expert, using these names verbatim: {', '.join(persona_names)}. Each value is that expert's best "
+        f"answer as a single string. For example: {example}"
+    )
+
+
+def _normalize(name):
+    return "".join(ch for ch in name.casefold() if ch.isalnum())
+
+
+def _repair_json(text):
+    """
+    Fix up a truncated or slightly malformed JSON value in one pass: drop trailing
+    commas, skip unmatched closing brackets, and close an unterminated string and any
+    open brackets. Also returns the index of the last comma outside a string, where a
+    value cut off mid-key can be dropped.
+    """
+    out = []
+    stack = []
+    in_string = escaped = False
+    last_comma = -1
+    for index, ch in enumerate(text):
+        if in_string:
+            out.append(ch)
+            if escaped:
+                escaped = False
+            elif ch == "\\":
+                escaped = True
+            elif ch == '"':
+                in_string = False
+            continue
+        if ch == '"':
+            in_string = True
+        elif ch == ",":
+            last_comma = index
+        elif ch in "{[":
+            stack.append("}" if ch == "{" else "]")
+        elif ch in "}]":
+            while out and out[-1] in " \t\r\n":
+                out.pop()
+            if out and out[-1] == ",":
+                out.pop()
+            if not stack or stack[-1] != ch:
+                continue
+            stack.pop()
+        out.append(ch)
+    if in_string:
+        if escaped:
+            out.pop()
+        out.append('"')
+    while out and out[-1] in " \t\r\n,":
+        out.pop()
+    out.extend(reversed(stack))
+    return "".join(out), last_comma
+
+
+def _decode(text):
+    try:
+        value = json.loads(text, strict=False)
+    except (ValueError, RecursionError):
+        return None
+    return value if isinstance(value, (dict, list)) else None
+
+
+def _load_json(text):
+    """Return (decoded object or None, method)."""
+    start = text.find("{")
+    list_start = text.find("[")
+    if list_start != -1 and (start == -1 or list_start < start):
+        start = list_start
+    if start == -1:
+        return None, "none"
+    closing = "}" if text[start] == "{" else "]"
+    end = text.rfind(closing)
+    if end > start:
+        value = _decode(text[start:end + 1])
+        if value is not None:
+            return value, "json"
+    # Code fences after the object would otherwise end up inside the repaired text
+    body = text[start:]
+    fence = body.rfind("```")
+    if fence != -1:
+        body = body[:fence]
+    repaired, last_comma = _repair_json(body)
+    value = _decode(repaired)
+    if value is None and last_comma != -1:
+        # Most likely cut off in the middle of a key; keep everything before it
+        value = _decode(_repair_json(body[:last_comma])[0])
+    return (value, "repaired_json") if value is not None else (None, "none")
+
+
+def _answer_text(value):
+    if isinstance(value, str):
+        return value.strip()
+    if isinstance(value, dict):
+        for key in ("answer", "best_answer", "bestAnswer", "text", "content"):
+            if isinstance(value.get(key), str):
+                return value[key].strip()
+        return " ".join(_answer_text(item) for item in value.values()).strip()
+    if isinstance(value, list):
+        return " ".join(_answer_text(item) for item in value).strip()
+    return "" if value is None else str(value)
+
+
+def _keyed_answers(value):
+    """Flatten the accepted JSON shapes into {key: answer text}."""
+    if isinstance(value, dict) and len(value) == 1 and isinstance(next(iter(value.values())), list):
+        value = next(iter(value.values()))
+    if isinstance(value, list):
+        keyed = {}
+        for item in value:
+            if not isinstance(item, dict):
+                continue
+            name = item.get("name") or item.get("persona")
+            # A number, list or object where the name should be cannot be matched to a persona
+            if isinstance(name, str):
+                keyed[name] = _answer_text(item)
+        return keyed
+    return {str(key): _answer_text(item) for key, item in value.items()}
+
+
+def _match(persona_names, keyed):
+    """Assign answers to personas by normalized name, then allow keys that add a title ("Dr. Z, Futurist")."""
+    normalized = [(_normalize(key), text) for key, text in keyed.items() if text]
+    exact = dict(normalized)
+    matched = {}
+    for name in persona_names:
+        target = _normalize(name)
+        if target in exact:
+            matched[name] = exact[target]
+            continue
+        for key, text in normalized:
+            if target and key.startswith(target):
+                matched[name] = text
+                break
+    return matched
+
+
+def _split_sections(text, persona_names):
+    """Split free text into answers at lines that start with a persona name (optionally after 'Name:')."""
+    targets = [(name, name.casefold()) for name in persona_names]
+    sections = {}
+    current = None
+    for line in text.splitlines():
+        header = line.lstrip(_HEADER_PREFIX)
+        if header[:5].casefold() == "name:":
+            header = header[5:].lstrip(_HEADER_PREFIX)
+        folded = header.casefold()
+        for name, target in targets:
+            if target and folded.startswith(target) and name not in sections:
+                current = name
+                rest = header[len(target):]
+                colon = rest.find(":")
+                sections[name] = [rest[colon + 1:].strip(" *")] if colon != -1 else []
+                break
+        else:
+            if current is not None:
+                sections[current].append(line)
+    return {name: "\n".join(lines).strip() for name, lines in sections.items()}
+
+
+def parse_individual_answers(text, persona_names):
+    """Extract each persona's answer from the convergence response, in persona order."""
+    text = text or ""
+    value, method = _load_json(text)
+    matched = _match(persona_names, _keyed_answers(value)) if value is not None else {}
+    if len(matched) < len(persona_names):
+        sections = _split_sections(text, [name for name in persona_names if name not in matched])
+        found = {name: answer for name, answer in sections.items() if answer}
+        if found and not matched:
+            method = "sections"
+        matched.update(found)
+    missing = [name for name in persona_names if name not in matched]
+    answers = [{"name": name, "answer": matched.get(name, DEFAULT_ANSWER)} for name in persona_names]
+    return ParsedAnswers(answers, method if matched else "none", missing)
@@ -0,0 +1,294 @@
+"""
+Batch question-improvement jobs.
+
+A job is a list of questions run through persona selection and the improvement
+pipeline. Jobs and their per-question results are persisted in a local SQLite file
+as each question finishes. A fixed pool of workers, shared by all jobs, bounds how
+many questions run at once. Questions that had not finished when the server stopped
+are queued again on the next start, so an interrupted job resumes where it left off
+without redoing completed questions.
+
+Progress can be polled (status and paged results) or followed as a stream of events
+through BatchJobManager.subscribe. The manager runs every SQLite call in a worker
+thread, so job bookkeeping never blocks the event loop.
+"""
+import asyncio
+import json
+import logging
+import os
+import time
+import uuid
+
+from llm_scheduler import bind_llm_context
+from sqlite_storage import connect, init_database
+from structured_logging import bind_request_id
+
+logger = logging.getLogger(__name__)
+
+BATCH_JOB_CONCURRENCY = int(os.getenv("BATCH_JOB_CONCURRENCY", "4"))
+BATCH_JOB_MAX_QUESTIONS = int(os.getenv("BATCH_JOB_MAX_QUESTIONS", "5000"))
+BATCH_JOB_DB_PATH = os.getenv("BATCH_JOB_DB_PATH", "batch_jobs.sqlite3")
+BATCH_JOB_RESUME_ON_STARTUP = os.getenv("BATCH_JOB_RESUME_ON_STARTUP", "true").lower() in ("1", "true", "yes")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id TEXT PRIMARY KEY,
+    status TEXT NOT NULL,
+    options TEXT NOT NULL,
+    total INTEGER NOT NULL,
+    created_at REAL NOT NULL,
+    updated_at REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS job_items (
+    job_id TEXT NOT NULL REFERENCES jobs (id),
+    idx INTEGER NOT NULL,
+    question TEXT NOT NULL,
+    status TEXT NOT NULL DEFAULT 'pending',
+    result TEXT,
+    error TEXT,
+    completed_at REAL,
+    PRIMARY KEY (job_id, idx)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS job_items_status ON job_items (job_id, status);
+"""
+
+# Item statuses: pending until processed, then done or failed
+ITEM_FINISHED = ("done", "failed")
+
+
+class JobNotFound(LookupError):
+    """Raised when a batch job id does not exist."""
+
+
+class JobStore:
+    """Jobs and per-question results in a local SQLite file. Its methods block; call them off the event loop."""
+
+    def __init__(self, path=BATCH_JOB_DB_PATH):
+        self.path = path
+        init_database(path, SCHEMA)
+
+    def _connect(self):
+        return connect(self.path)
+
+    def create_job(self, questions, options):
+        job_id = uuid.uuid4().hex
+        now = time.time()
+        with self._connect() as conn:
+            conn.execute(
+                "INSERT INTO jobs (id, status, options, total, created_at, updated_at) VALUES (?, 'queued', ?, ?, ?, ?)",
+                (job_id, json.dumps(options), len(questions), now, now),
+            )
+            conn.executemany(
+                "INSERT INTO job_items (job_id, idx, question) VALUES (?, ?, ?)",
+                [(job_id, idx, question) for idx, question in enumerate(questions)],
+            )
+        return job_id
+
+    def set_status(self, job_id, status):
+        with self._connect() as conn:
+            conn.execute("UPDATE jobs SET status = ?, updated_at = ? WHERE id = ?", (status, time.time(), job_id))
+
+    def complete_job(self, job_id):
+        """Mark a job completed; returns False if it already was, so only one caller announces it."""
+        with self._connect() as conn:
+            return conn.execute("UPDATE jobs SET status = 'completed', updated_at = ? WHERE id = ? "
+                                "AND status != 'completed'", (time.time(), job_id)).rowcount > 0
+
+    def finish_item(self, job_id, idx, result=None, error=None):
+        with self._connect() as conn:
+            conn.execute(
+                "UPDATE job_items SET status = ?, result = ?, error = ?, completed_at = ? WHERE job_id = ? AND idx = ?",
+                ("failed" if error is not None else "done", json.dumps(result) if result is not None else None,
+                 error, time.time(), job_id, idx),
+            )
+            conn.execute("UPDATE jobs SET updated_at = ? WHERE id = ?", (time.time(), job_id))
+
+    def retry_failed(self, job_id):
+        """Return failed items to pending; returns how many were reset."""
+        with self._connect() as conn:
+            return conn.execute(
+                "UPDATE job_items SET status = 'pending', error = NULL, completed_at = NULL "
+                "WHERE job_id = ? AND status = 'failed'",
+                (job_id,),
+            ).rowcount
+
+    def job(self, job_id):
+        """Return a job's status and progress counts, or raise JobNotFound."""
+        with self._connect() as conn:
+            row = conn.execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+            if row is None:
+                raise JobNotFound(job_id)
+            counts = dict(conn.execute(
+                "SELECT status, COUNT(*) FROM job_items WHERE job_id = ? GROUP BY status", (job_id,)
+            ).fetchall())
+        return {
+            "jobId": row["id"],
+            "status": row["status"],
+            "options": json.loads(row["options"]),
+            "total": row["total"],
+            "done": counts.get("done", 0),
+            "failed": counts.get("failed", 0),
+            "pending": counts.get("pending", 0),
+            "createdAt": row["created_at"],
+            "updatedAt": row["updated_at"],
+        }
+
+    def pending_items(self, job_id):
+        with self._connect() as conn:
+            return [(row["idx"], row["question"]) for row in conn.execute(
+                "SELECT idx, question FROM job_items WHERE job_id = ? AND status = 'pending' ORDER BY idx", (job_id,)
+            ).fetchall()]
+
+    def items(self, job_id, offset=0, limit=50, status=None):
+        """Return finished or pending items in question order, with their results."""
+        query = "SELECT * FROM job_items WHERE job_id = ?"
+        params = [job_id]
+        if status is not None:
+            query += " AND status = ?"
+            params.append(status)
+        query += " ORDER BY idx LIMIT ? OFFSET ?"
+        params.extend([limit, offset])
+        with self._connect() as conn:
+            rows = conn.execute(query, params).fetchall()
+        return [
+            {
+                "index": row["idx"],
+                "question": row["question"],
+                "status": row["status"],
+                "result": json.loads(row["result"]) if row["result"] is not None else None,
+                "error": row["error"],
+            }
+            for row in rows
+        ]
+
+    def unfinished_jobs(self):
+        with self._connect() as conn:
+            return [row["id"] for row in conn.execute(
+                "SELECT id FROM jobs WHERE status IN ('queued', 'running') ORDER BY created_at"
+            ).fetchall()]
+
+
+class BatchJobManager:
+    """Runs batch jobs on a bounded pool of workers shared by every job."""
+
+    def __init__(self, store, process, concurrency=BATCH_JOB_CONCURRENCY):
+        """`process(question, options)` is awaited for each question and returns its JSON-serializable result."""
+        self.store = store
+        self.process = process
+        self.concurrency = concurrency
+        self._queue = None
+        self._workers = []
+        # (job id, index) of items queued or running, so a resume never schedules one twice
+        self._scheduled = set()
+        self._options = {}
+        self._subscribers = {}
+
+    async def _store(self, method, *args, **kwargs):
+        """Run a blocking JobStore method in a worker thread."""
+        return await asyncio.to_thread(method, *args, **kwargs)
+
+    async def start(self, resume=BATCH_JOB_RESUME_ON_STARTUP):
+        self._queue = asyncio.Queue()
+        self._workers = [asyncio.create_task(self._worker()) for _ in range(self.concurrency)]
+        if resume:
+            for job_id in await self._store(self.store.unfinished_jobs):
+                scheduled = await self._schedule(job_id)
+                logger.info(f"Resuming batch job {job_id} with {scheduled} unfinished questions")
+
+    async def stop(self):
+        """Stop the workers. Questions in progress stay pending and are picked up again on resume."""
+        for worker in self._workers:
+            worker.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+        self._workers = []
+
+    async def submit(self, questions, options):
+        job_id = await self._store(self.store.create_job, questions, options)
+        await self._schedule(job_id)
+        logger.info(f"Created batch job {job_id} with {len(questions)} questions")
+        return await self._store(self.store.job, job_id)
+
+    async def resume(self, job_id, retry_failed=False):
+        """Queue a job's unfinished questions (and, optionally, its failed ones) again."""
+        await self._store(self.store.job, job_id)
+        if retry_failed:
+            await self._store(self.store.retry_failed, job_id)
+        scheduled = await self._schedule(job_id)
+        logger.info(f"Resumed batch job {job_id}: {scheduled} questions queued")
+        return await self._store(self.store.job, job_id)
+
+    async def status(self, job_id):
+        return await self._store(self.store.job, job_id)
+
+    async def results(self, job_id, offset=0, limit=50, status=None):
+        await self._store(self.store.job, job_id)
+        return await self._store(self.store.items, job_id, offset, limit, status)
+
+    def subscribe(self, job_id):
+        """Return a queue receiving (event, data) for each of the job's progress events."""
+        queue = asyncio.Queue()
+        self._subscribers.setdefault(job_id, set()).add(queue)
+        return queue
+
+    def unsubscribe(self, job_id, queue):
+        subscribers = self._subscribers.get(job_id)
+        if subscribers is not None:
+            subscribers.discard(queue)
+            if not subscribers:
+                del self._subscribers[job_id]
+
+    def _publish(self, job_id, event, data):
+        for queue in self._subscribers.get(job_id, ()):
+            queue.put_nowait((event, data))
+
+    async def _schedule(self, job_id):
+        job = await self._store(self.store.job, job_id)
+        self._options[job_id] = job["options"]
+        scheduled = 0
+        for idx, question in await self._store(self.store.pending_items, job_id):
+            if (job_id, idx) in self._scheduled:
+                continue
+            self._scheduled.add((job_id, idx))
+            self._queue.put_nowait((job_id, idx, question))
+            scheduled += 1
+        if scheduled == 0:
+            await self._finish_if_complete(job_id)
+        elif job["status"] != "running":
+            await self._store(self.store.set_status, job_id, "queued")
+        return scheduled
+
+    async def _finish_if_complete(self, job_id):
+        job = await self._store(self.store.job, job_id)
+        # Workers finishing a job's last questions together may both get here; complete_job lets one through
+        if job["pending"] == 0 and job["status"] != "completed" and await self._store(self.store.complete_job, job_id):
+            job["status"] = "completed"
+            logger.info(f"Batch job {job_id} completed: {job['done']} done, {job['failed']} failed")
+            self._publish(job_id, "done", job)
+        return job
+
+    async def _worker(self):
+        while True:
+            job_id, idx, question = await self._queue.get()
+            try:
+                await self._store(self.store.set_status, job_id, "running")
+                try:
+                    # Correlate the question's log records the way a request's are, and queue
+                    # its LLM calls behind interactive ones, taking turns with other jobs
+                    with bind_request_id(f"job-{job_id[:12]}-{idx}"), \
+                            bind_llm_context(client=f"job-{job_id}", priority="batch"):
+                        result = await self.process(question, self._options[job_id])
+                except asyncio.CancelledError:
+                    raise
+                except Exception as e:
+                    logger.error(f"Batch job {job_id} question {idx} failed: {str(e)}")
+                    await self._store(self.store.finish_item, job_id, idx, error=str(e))
+                    self._publish(job_id, "item", {"index": idx, "status": "failed", "error": str(e)})
+                else:
+                    await self._store(self.store.finish_item, job_id, idx, result=result)
+                    self._publish(job_id, "item", {"index": idx, "status": "done"})
+                self._scheduled.discard((job_id, idx))
+                job = await self._finish_if_complete(job_id)
+                if job["status"] != "completed":
+                    self._publish(job_id, "progress", job)
+            finally:
+                self._queue.task_done()
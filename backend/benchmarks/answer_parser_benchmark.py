@@ -0,0 +1,135 @@
+"""
+Fuzz and benchmark the individual-answer parser used for the convergence prompt.
+
+Fuzzing: valid JSON answers, and well-formed JSON of unexpected shapes (non-string
+names, nested objects where text belongs, deep nesting), are parsed as they are and
+mutated at random (truncated, characters deleted, inserted or swapped, code fences
+and prose wrapped around them). Every parse must return, without raising, one answer
+per persona in persona order.
+
+Benchmark: adversarial responses of growing size (a persona name repeated without a
+colon, deeply nested braces, an unterminated string, runs of blank lines, a long
+markdown answer) are timed with the parser and, up to --legacy-max-chars, with the
+per-persona regexes it replaced. Parse time per KB should stay flat as inputs grow;
+the legacy regexes grow superlinearly on the same inputs.
+
+Usage (from the backend directory):
+    python benchmarks/answer_parser_benchmark.py --fuzz 20000 --sizes 1000 10000 100000 1000000
+"""
+import argparse
+import json
+import os
+import random
+import re
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from answer_parser import parse_individual_answers
+
+PERSONAS = ["Dr. Sophia", "Ethan (Futurist)", "Olivia"]
+ANSWER = "A considered answer, with \"quotes\", commas: colons, and a newline\nin the middle."
+NOISE = ['{', '}', '[', ']', '"', ',', ':', '\\', '\n', '```', 'Dr. Sophia', 'Olivia:', ' ', 'x']
+# Valid JSON the model might produce instead of the object the prompt asks for
+SHAPES = [
+    '[{"name": "Dr. Sophia", "answer": "x"}, {"persona": "Olivia", "text": "y"}]',
+    '[{"name": 5, "answer": "x"}]',
+    '[{"name": ["A"], "answer": "x"}]',
+    '[{"name": {"first": "Olivia"}, "answer": "x"}, {"persona": null, "answer": 3}]',
+    '{"k": [{"persona": {"a": 1}}]}',
+    '{"answers": [1, "two", null, [{"name": "Olivia"}], {"name": true}]}',
+    '{"Dr. Sophia": {"answer": ["a", {"b": null}]}, "Olivia": 7, "1": false}',
+    '[' * 500 + ']' * 500,
+    '{"Olivia": ' * 300 + '"deep"' + '}' * 300,
+]
+
+
+def legacy_parse(text, persona_names):
+    """The regexes previously used for the convergence response, kept for comparison."""
+    answers = []
+    for persona_name in persona_names:
+        match = re.search(rf"{persona_name}(?:.*?):(.*?)(?:(?:\n\n.*?:)|$)", text, re.DOTALL)
+        if not match:
+            match = re.search(rf"{persona_name}[^\n]*\n(.*?)(?:\n\n|\n[A-Z]|\Z)", text, re.DOTALL)
+        answers.append(match.group(1).strip() if match else None)
+    return answers
+
+
+def mutate(rng, text):
+    for _ in range(rng.randint(1, 4)):
+        kind = rng.randrange(5)
+        position = rng.randint(0, len(text))
+        if kind == 0:
+            text = text[:position]
+        elif kind == 1:
+            text = text[:position] + text[position + rng.randint(1, 10):]
+        elif kind == 2:
+            text = text[:position] + rng.choice(NOISE) + text[position:]
+        elif kind == 3 and len(text) > 1:
+            other = rng.randrange(len(text))
+            chars = list(text)
+            chars[position % len(chars)], chars[other] = chars[other], chars[position % len(chars)]
+            text = "".join(chars)
+        else:
+            text = f"Here are the answers:\n```json\n{text}\n```\nHope this helps!"
+    return text
+
+
+def fuzz(iterations, seed):
+    rng = random.Random(seed)
+    valid = json.dumps({name: ANSWER for name in PERSONAS}, indent=rng.choice([None, 2]))
+    seeds = [valid] * len(SHAPES) + SHAPES
+    methods = {}
+    slowest = 0.0
+    for iteration in range(len(SHAPES) + iterations):
+        text = SHAPES[iteration] if iteration < len(SHAPES) else mutate(rng, rng.choice(seeds))
+        start = time.perf_counter()
+        parsed = parse_individual_answers(text, PERSONAS)
+        slowest = max(slowest, time.perf_counter() - start)
+        assert [answer["name"] for answer in parsed.answers] == PERSONAS, text
+        assert all(isinstance(answer["answer"], str) and answer["answer"] for answer in parsed.answers), text
+        methods[parsed.method] = methods.get(parsed.method, 0) + 1
+    print(f"Fuzzed {len(SHAPES)} unusual shapes and {iterations} mutated responses: no errors, slowest parse {slowest * 1000:.2f} ms")
+    print("  methods: " + ", ".join(f"{method}={count}" for method, count in sorted(methods.items())))
+
+
+ADVERSARIAL = {
+    "name without colon": lambda n: ("Dr. Sophia " * (n // 11 + 1))[:n],
+    "nested braces": lambda n: "{" * n,
+    "unterminated string": lambda n: '{"Dr. Sophia": "' + "a" * n,
+    "blank lines": lambda n: "Olivia" + "\n" * n + "x",
+    "markdown answer": lambda n: "**Dr. Sophia**: " + ("word " * (n // 5 + 1))[:n],
+}
+
+
+def best_time(func, repeat=3):
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        times.append(time.perf_counter() - start)
+    return min(times)
+
+
+def benchmark(sizes, legacy_max_chars):
+    print(f"\n{'input':<22}{'chars':>10}{'parser ms':>12}{'us/KB':>9}{'legacy ms':>12}")
+    for label, build in ADVERSARIAL.items():
+        for size in sizes:
+            text = build(size)
+            parsed = best_time(lambda: parse_individual_answers(text, PERSONAS))
+            legacy = (f"{best_time(lambda: legacy_parse(text, PERSONAS), 1) * 1000:12.2f}"
+                      if size <= legacy_max_chars else f"{'-':>12}")
+            print(f"{label:<22}{size:>10}{parsed * 1000:12.2f}{parsed * 1e6 / (size / 1000):9.1f}{legacy}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--fuzz", type=int, default=20000, help="Mutated responses to parse")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1000, 10000, 100000, 1000000])
+    parser.add_argument("--legacy-max-chars", type=int, default=20000,
+                        help="Largest input to also time with the legacy regexes (they are quadratic)")
+    parser.add_argument("--seed", type=int, default=7)
+    args = parser.parse_args()
+    fuzz(args.fuzz, args.seed)
+    benchmark(args.sizes, args.legacy_max_chars)
@@ -0,0 +1,133 @@
+"""
+Check that a client disconnect stops the improvement pipeline's LLM calls.
+
+Serves the app with uvicorn on a local port, with a synthetic provider that takes
+--latency seconds to stream each response and records when every call starts. For
+each endpoint (POST /improve-question and POST /improve-question/stream) and each
+point in the pipeline, a client starts an improvement and drops its connection while
+the given provider call is in flight, mid-stage. The run then waits --settle seconds
+and counts provider calls started after the disconnect, which must be zero.
+
+Reports the calls each run made against the 11 of a complete pipeline, and exits with
+status 1 if any call started after a disconnect.
+
+Usage (from the backend directory):
+    python benchmarks/client_disconnect_benchmark.py --latency 0.1
+"""
+import argparse
+import asyncio
+import logging
+import os
+import re
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import httpx
+import uvicorn
+from langchain_core.messages import AIMessageChunk, get_buffer_string
+from langchain_core.outputs import ChatGenerationChunk
+
+# Imported first: it points the app at scratch storage and turns off the selection cache and coalescing
+from load_test import QUESTIONS, SyntheticChatModel
+
+import main
+
+PIPELINE_CALLS = 11
+ENDPOINTS = ("/improve-question", "/improve-question/stream")
+
+
+class TimedChatModel(SyntheticChatModel):
+    """Synthetic responses streamed over --latency seconds, recording when each call starts."""
+
+    latency: float = 0.1
+    started: list = []
+
+    async def _agenerate(self, messages, stop=None, run_manager=None, **kwargs):
+        self.started.append(time.monotonic())
+        await asyncio.sleep(self.latency)
+        return self._generate(messages, stop, run_manager, **kwargs)
+
+    async def _astream(self, messages, stop=None, run_manager=None, **kwargs):
+        self.started.append(time.monotonic())
+        text = self._respond(get_buffer_string(messages))
+        chunks = [text[i:i + 64] for i in range(0, len(text), 64)]
+        for chunk in chunks:
+            await asyncio.sleep(self.latency / len(chunks))
+            yield ChatGenerationChunk(message=AIMessageChunk(content=chunk))
+
+
+async def request(client, endpoint, payload):
+    if endpoint.endswith("/stream"):
+        async with client.stream("POST", endpoint, json=payload) as response:
+            async for _ in response.aiter_lines():
+                pass
+    else:
+        await client.post(endpoint, json=payload)
+
+
+async def disconnect_during(client, model, endpoint, question, call, settle):
+    """Drop the connection while provider call number `call` is in flight; return calls made before and after."""
+    personas = main.fast_select_personas(question)["selectedPersonas"]
+    first = len(model.started)
+    task = asyncio.create_task(request(client, endpoint, {"text": question, "personas": personas}))
+    while len(model.started) - first < call and not task.done():
+        await asyncio.sleep(0.001)
+    # Part way into the call's response
+    await asyncio.sleep(model.latency / 2)
+    disconnected_at = time.monotonic()
+    task.cancel()
+    await asyncio.gather(task, return_exceptions=True)
+    await asyncio.sleep(settle)
+    calls = model.started[first:]
+    return sum(1 for t in calls if t < disconnected_at), sum(1 for t in calls if t >= disconnected_at)
+
+
+def metric_total(text, name):
+    return sum(float(value) for value in re.findall(rf"^{name}(?:{{[^}}]*}})? (\S+)$", text, re.MULTILINE))
+
+
+async def run(args):
+    logging.disable(logging.CRITICAL)
+    model = TimedChatModel(latency=args.latency)
+    main.llm_clients.get_chat_model = lambda *model_args, **model_kwargs: model
+    server = uvicorn.Server(uvicorn.Config(main.app, host="127.0.0.1", port=0, log_level="critical"))
+    serving = asyncio.create_task(server.serve())
+    while not server.started:
+        await asyncio.sleep(0.01)
+    port = server.servers[0].sockets[0].getsockname()[1]
+
+    late_calls = 0
+    try:
+        async with httpx.AsyncClient(base_url=f"http://127.0.0.1:{port}", timeout=None) as client:
+            for endpoint in ENDPOINTS:
+                print(endpoint)
+                for call in range(1, PIPELINE_CALLS + 1, args.step):
+                    question = f"{QUESTIONS[call % len(QUESTIONS)]} ({endpoint} #{call})"
+                    before, after = await disconnect_during(client, model, endpoint, question, call,
+                                                            args.settle or 3 * args.latency)
+                    late_calls += after
+                    print(f"  dropped during call {call:>2}: {before:>2} calls made, {after} after the disconnect, "
+                          f"{PIPELINE_CALLS - before - after:>2} saved")
+            metrics = (await client.get("/metrics")).text
+    finally:
+        server.should_exit = True
+        await serving
+
+    for name in ("questioncrafter_client_disconnects_total", "questioncrafter_pipelines_cancelled_total",
+                 "questioncrafter_llm_calls_cancelled_total"):
+        print(f"{name} {metric_total(metrics, name):g}")
+    if late_calls:
+        print(f"FAIL: {late_calls} provider calls started after a disconnect")
+        sys.exit(1)
+    print("OK: no provider call started after a disconnect")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--latency", type=float, default=0.1, help="Seconds each provider call takes")
+    parser.add_argument("--step", type=int, default=1, help="Drop the connection during every n-th call")
+    parser.add_argument("--settle", type=float, default=None,
+                        help="Seconds to watch for calls after a disconnect (default 3x --latency)")
+    asyncio.run(run(parser.parse_args()))
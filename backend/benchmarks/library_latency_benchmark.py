@@ -0,0 +1,147 @@
+"""
+Check that library reads stay fast while improvement pipelines are running.
+
+Serves the app with uvicorn on a local port, with a slow synthetic provider: each call
+takes --latency seconds, awaited on the async path and slept with a blocking time.sleep
+on the synchronous one. A pipeline that called the model synchronously from the event
+loop would therefore stall every other request for the whole call.
+
+Seeds the library with --entries synthetic entries and reads GET /api/library/entries
+from a separate thread, so time spent waiting on a stalled event loop counts towards
+the latency: first on an idle app, then while --improvements pipelines run
+concurrently. Reports p50/p95/max for both. Exits with status 1 if the p95 under load exceeds
+--max-p95-ms, or if any read or improvement failed.
+
+Usage (from the backend directory):
+    python benchmarks/library_latency_benchmark.py --improvements 4 --latency 0.2
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import random
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# Imported first: it points the app at scratch storage and turns off the selection cache and coalescing
+from load_test import QUESTIONS, SyntheticChatModel, percentiles
+
+import httpx
+import uvicorn
+
+import main
+from library_scale_benchmark import synthetic_entry
+
+LIBRARY_READ = "/api/library/entries?fields=summary&limit=24"
+
+
+class SlowChatModel(SyntheticChatModel):
+    """Synthetic responses that take --latency seconds, and block the thread when called synchronously."""
+
+    latency: float = 0.2
+
+    def _generate(self, messages, stop=None, run_manager=None, **kwargs):
+        time.sleep(self.latency)
+        return super()._generate(messages, stop, run_manager, **kwargs)
+
+    async def _agenerate(self, messages, stop=None, run_manager=None, **kwargs):
+        await asyncio.sleep(self.latency)
+        return super()._generate(messages, stop, run_manager, **kwargs)
+
+
+def read_library(base_url, stop, interval):
+    """GET the first library page every `interval` seconds until `stop` is set; return latencies and errors."""
+    samples, errors = [], 0
+    with httpx.Client(base_url=base_url, timeout=None) as client:
+        while not stop.is_set():
+            start = time.perf_counter()
+            response = client.get(LIBRARY_READ)
+            if response.status_code == 200:
+                samples.append(time.perf_counter() - start)
+            else:
+                errors += 1
+            stop.wait(interval)
+    return samples, errors
+
+
+async def improve(client, question):
+    personas = main.fast_select_personas(question)["selectedPersonas"]
+    response = await client.post("/improve-question", json={"text": question, "personas": personas})
+    return response.status_code
+
+
+def report(label, samples):
+    stats = percentiles(samples)
+    print(f"{label:<22} {len(samples):>5} reads  p50 {stats['p50_ms']:7.1f} ms  p95 {stats['p95_ms']:7.1f} ms  "
+          f"max {max(samples) * 1000:7.1f} ms")
+    return stats["p95_ms"]
+
+
+async def run(args):
+    logging.disable(logging.CRITICAL)
+    rng = random.Random(0)
+    with open(os.environ["LIBRARY_JSON_PATH"], "w") as f:
+        json.dump({"entries": [synthetic_entry(rng, i) for i in range(args.entries)]}, f)
+    model = SlowChatModel(latency=args.latency)
+    main.llm_clients.get_chat_model = lambda *model_args, **model_kwargs: model
+
+    server = uvicorn.Server(uvicorn.Config(main.app, host="127.0.0.1", port=0, log_level="critical"))
+    serving = asyncio.create_task(server.serve())
+    while not server.started:
+        await asyncio.sleep(0.01)
+    base_url = f"http://127.0.0.1:{server.servers[0].sockets[0].getsockname()[1]}"
+
+    try:
+        async with httpx.AsyncClient(base_url=base_url, timeout=None) as client:
+            stop = threading.Event()
+            reading = asyncio.create_task(asyncio.to_thread(read_library, base_url, stop, args.interval))
+            await asyncio.sleep(args.idle)
+            stop.set()
+            idle, idle_errors = await reading
+
+            stop = threading.Event()
+            reading = asyncio.create_task(asyncio.to_thread(read_library, base_url, stop, args.interval))
+            start = time.perf_counter()
+            statuses = await asyncio.gather(*[
+                improve(client, f"{QUESTIONS[i % len(QUESTIONS)]} (#{i})") for i in range(args.improvements)])
+            elapsed = time.perf_counter() - start
+            stop.set()
+            loaded, loaded_errors = await reading
+    finally:
+        server.should_exit = True
+        await serving
+
+    print(f"{args.improvements} improvements in {elapsed:.1f}s ({args.latency:g}s per provider call), "
+          f"statuses {sorted(set(statuses))}")
+    report("idle", idle)
+    p95 = report("during improvements", loaded)
+
+    failures = []
+    if any(status != 200 for status in statuses):
+        failures.append(f"{sum(status != 200 for status in statuses)} improvements failed")
+    if idle_errors or loaded_errors:
+        failures.append(f"{idle_errors + loaded_errors} library reads failed")
+    if len(loaded) < 2:
+        failures.append("improvements finished before the library could be read under load")
+    elif p95 > args.max_p95_ms:
+        failures.append(f"library read p95 {p95:.1f} ms during improvements exceeds {args.max_p95_ms:g} ms")
+    if failures:
+        print("FAIL: " + "; ".join(failures))
+        sys.exit(1)
+    print(f"OK: library read p95 stayed under {args.max_p95_ms:g} ms while improvements ran")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--improvements", type=int, default=4, help="Improvement pipelines to run concurrently")
+    parser.add_argument("--latency", type=float, default=0.2, help="Seconds each provider call takes")
+    parser.add_argument("--entries", type=int, default=1000, help="Synthetic library entries to seed")
+    parser.add_argument("--idle", type=float, default=1.0, help="Seconds to measure reads before improvements start")
+    parser.add_argument("--interval", type=float, default=0.01, help="Seconds between library reads")
+    parser.add_argument("--max-p95-ms", type=float, default=100.0,
+                        help="Fail if the p95 read latency during improvements exceeds this")
+    asyncio.run(run(parser.parse_args()))
@@ -0,0 +1,282 @@
+"""
+Benchmark the library endpoints as the library grows.
+
+For each library size (1k, 10k and 100k entries by default) a synthetic
+library_entries.json is generated: realistic question, refined question, best answer
+and three expert answers drawn from a Zipf-like vocabulary, plus comment lists of
+varying length. The app starts on it in a fresh process, migrating the file into its
+SQLite store, and each endpoint is then driven in-process through the ASGI app, by a
+single sequential client and by a pool of concurrent clients:
+  * GET  /api/library/entries      (first page, and a filtered page sorted by votes)
+  * GET  /api/library/entry/{id}
+  * POST /api/library/upvote
+  * POST /api/library/comment
+  * POST /api/library/submit
+
+Per endpoint and mode it reports p50/p95/p99 latency, throughput and peak RSS (sampled
+while the phase runs). Results are written as JSON; pass --compare with an earlier
+results file to flag endpoints whose p95 latency or throughput regressed.
+
+Usage (from the backend directory):
+    python benchmarks/library_scale_benchmark.py --sizes 1000 10000 100000 --output results.json
+    python benchmarks/library_scale_benchmark.py --sizes 10000 --compare results.json
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import platform
+import random
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# The app reads its storage paths at import time, so the per-size worker process
+# points them at a scratch directory before anything imports the library modules
+WORKDIR = None
+if "--single-size" in sys.argv:
+    WORKDIR = tempfile.mkdtemp(prefix="library-bench-")
+    os.environ["LIBRARY_JSON_PATH"] = os.path.join(WORKDIR, "library_entries.json")
+    os.environ["LIBRARY_DB_PATH"] = os.path.join(WORKDIR, "library.sqlite3")
+    os.environ["BATCH_JOB_DB_PATH"] = os.path.join(WORKDIR, "batch_jobs.sqlite3")
+    os.environ.setdefault("openai_api_key", "benchmark")
+
+from library_search_benchmark import CATEGORIES, WORDS, sentence
+
+PERSONAS = ["Samantha", "David", "Dr. Sophia", "Ethan", "Olivia", "Simon", "Paula", "Dr. Z"]
+
+
+def synthetic_comment(rng, i):
+    return {"id": i, "comment": sentence(rng, rng.randint(8, 40)) + ".", "author": rng.choice(["Anonymous", "Reader"]),
+            "date": f"2025-{i % 12 + 1:02d}-{i % 28 + 1:02d}T12:00:00"}
+
+
+def synthetic_entry(rng, i):
+    personas = rng.sample(PERSONAS, 3)
+    comments = [synthetic_comment(rng, i * 100 + c) for c in range(int(min(rng.expovariate(0.5), 25)))]
+    return {
+        "id": i + 1,
+        "originalQuestion": sentence(rng, 12) + "?",
+        "refinedQuestion": sentence(rng, 28) + "?",
+        "expertPersonas": personas,
+        "category": rng.choice(CATEGORIES),
+        "tags": rng.sample(WORDS[:20], 2),
+        "impact": "User-contributed transformation",
+        "author": "Anonymous",
+        "individualAnswers": [{"name": name, "answer": sentence(rng, 80)} for name in personas],
+        "bestAnswer": sentence(rng, 150),
+        "date": f"2025-{i % 12 + 1:02d}-{i % 28 + 1:02d}T{i % 24:02d}:{i % 60:02d}:00",
+        "votes": rng.randint(0, 200),
+        "views": rng.randint(0, 5000),
+        "comments": len(comments),
+        "commentList": comments,
+        "status": "user_contributed",
+    }
+
+
+def current_rss():
+    """Resident set size in bytes, from /proc where available."""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError):
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak if sys.platform == "darwin" else peak * 1024
+
+
+class RSSSampler:
+    """Tracks the peak RSS seen while a phase runs by sampling on a background thread."""
+
+    def __init__(self, interval=0.005):
+        self.interval = interval
+        self.peak = 0
+        self._stop = threading.Event()
+
+    def __enter__(self):
+        self.peak = current_rss()
+        self._thread = threading.Thread(target=self._sample, daemon=True)
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+        self.peak = max(self.peak, current_rss())
+
+    def _sample(self):
+        while not self._stop.wait(self.interval):
+            self.peak = max(self.peak, current_rss())
+
+
+def summarize(samples, elapsed, errors, peak_rss):
+    ordered = sorted(samples)
+    pick = lambda p: round(ordered[min(len(ordered) - 1, int(p * len(ordered)))] * 1000, 3) if ordered else None
+    return {
+        "requests": len(samples) + errors,
+        "errors": errors,
+        "p50_ms": pick(0.50),
+        "p95_ms": pick(0.95),
+        "p99_ms": pick(0.99),
+        "throughput_rps": round(len(samples) / elapsed, 1) if elapsed else None,
+        "peak_rss_mb": round(peak_rss / 1e6, 1),
+    }
+
+
+async def measure(client, make_request, requests, concurrency):
+    samples = []
+    errors = 0
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def one(i):
+        nonlocal errors
+        async with semaphore:
+            method, url, body = make_request(i)
+            start = time.perf_counter()
+            response = await client.request(method, url, json=body)
+            if response.status_code >= 400:
+                errors += 1
+            else:
+                samples.append(time.perf_counter() - start)
+
+    with RSSSampler() as rss:
+        start = time.perf_counter()
+        await asyncio.gather(*[one(i) for i in range(requests)])
+        elapsed = time.perf_counter() - start
+    return summarize(samples, elapsed, errors, rss.peak)
+
+
+async def run_size(size, requests, concurrency, seed):
+    """Benchmark one library size in this process and return its results."""
+    rng = random.Random(seed)
+    json_path = os.environ["LIBRARY_JSON_PATH"]
+    with open(json_path, "w") as f:
+        json.dump({"entries": [synthetic_entry(rng, i) for i in range(size)]}, f)
+
+    import httpx
+    import main
+
+    logging.disable(logging.WARNING)
+    result = {"entries": size, "json_mb": round(os.path.getsize(json_path) / 1e6, 1), "endpoints": {}}
+    with RSSSampler() as rss:
+        start = time.perf_counter()
+        await main.startup_event()
+        result["startup_s"] = round(time.perf_counter() - start, 3)
+    result["startup_peak_rss_mb"] = round(rss.peak / 1e6, 1)
+
+    entry_ids = list(range(1, size + 1))
+    workloads = {
+        "GET /api/library/entries": lambda i: ("GET", "/api/library/entries?fields=summary&limit=24", None),
+        "GET /api/library/entries?category&sort=votes": lambda i: (
+            "GET", f"/api/library/entries?category={CATEGORIES[i % len(CATEGORIES)]}&sort=votes&limit=24", None),
+        "GET /api/library/entry/{id}": lambda i: ("GET", f"/api/library/entry/{rng.choice(entry_ids)}", None),
+        "POST /api/library/upvote": lambda i: ("POST", "/api/library/upvote", {"entryId": rng.choice(entry_ids)}),
+        "POST /api/library/comment": lambda i: ("POST", "/api/library/comment", {
+            "entryId": rng.choice(entry_ids), "comment": sentence(rng, 20) + ".", "author": "Benchmark"}),
+        "POST /api/library/submit": lambda i: ("POST", "/api/library/submit", {
+            key: value for key, value in synthetic_entry(rng, size + i).items()
+            if key in ("originalQuestion", "refinedQuestion", "expertPersonas", "category", "tags",
+                       "individualAnswers", "bestAnswer")}),
+    }
+    try:
+        transport = httpx.ASGITransport(app=main.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=None) as client:
+            for endpoint, make_request in workloads.items():
+                result["endpoints"][endpoint] = {
+                    "sequential": await measure(client, make_request, requests, 1),
+                    "concurrent": await measure(client, make_request, requests, concurrency),
+                }
+    finally:
+        await main.shutdown_event()
+        shutil.rmtree(WORKDIR, ignore_errors=True)
+    return result
+
+
+def print_result(result):
+    print(f"\n{result['entries']} entries ({result['json_mb']} MB JSON): startup/migration {result['startup_s']}s, "
+          f"peak RSS {result['startup_peak_rss_mb']} MB")
+    for endpoint, modes in result["endpoints"].items():
+        for mode, stats in modes.items():
+            print(f"  {endpoint:<47} {mode:<10} p50 {stats['p50_ms']:8.2f} ms  p95 {stats['p95_ms']:8.2f} ms  "
+                  f"p99 {stats['p99_ms']:8.2f} ms  {stats['throughput_rps']:8.1f} req/s  "
+                  f"RSS {stats['peak_rss_mb']:7.1f} MB  errors {stats['errors']}")
+
+
+def compare(current, previous, tolerance):
+    """Print endpoints whose p95 latency or throughput regressed by more than `tolerance` (a fraction)."""
+    baseline = {run["entries"]: run for run in previous["runs"]}
+    regressions = 0
+    for run in current["runs"]:
+        before = baseline.get(run["entries"])
+        if before is None:
+            continue
+        for endpoint, modes in run["endpoints"].items():
+            for mode, stats in modes.items():
+                old = before["endpoints"].get(endpoint, {}).get(mode)
+                if not old:
+                    continue
+                if stats["p95_ms"] > old["p95_ms"] * (1 + tolerance):
+                    regressions += 1
+                    print(f"REGRESSION {run['entries']} entries {endpoint} {mode}: "
+                          f"p95 {old['p95_ms']} -> {stats['p95_ms']} ms")
+                if stats["throughput_rps"] < old["throughput_rps"] * (1 - tolerance):
+                    regressions += 1
+                    print(f"REGRESSION {run['entries']} entries {endpoint} {mode}: "
+                          f"throughput {old['throughput_rps']} -> {stats['throughput_rps']} req/s")
+    print(f"{regressions} regressions beyond {tolerance:.0%} against the previous results")
+    return regressions
+
+
+def main(args):
+    runs = []
+    for size in args.sizes:
+        # A fresh interpreter per size so RSS and caches from one size do not leak into the next
+        output = subprocess.run(
+            [sys.executable, os.path.abspath(__file__), "--single-size", str(size), "--requests", str(args.requests),
+             "--concurrency", str(args.concurrency), "--seed", str(args.seed)],
+            check=True, capture_output=True, text=True,
+        ).stdout
+        result = json.loads(output.strip().splitlines()[-1])
+        print_result(result)
+        runs.append(result)
+
+    report = {
+        "benchmark": "library_scale",
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "requests": args.requests,
+        "concurrency": args.concurrency,
+        "runs": runs,
+    }
+    with open(args.output, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"\nWrote {args.output}")
+
+    if args.compare:
+        with open(args.compare) as f:
+            if compare(report, json.load(f), args.tolerance):
+                sys.exit(1)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1000, 10000, 100000])
+    parser.add_argument("--requests", type=int, default=500, help="Requests per endpoint and mode")
+    parser.add_argument("--concurrency", type=int, default=32, help="Clients in the concurrent mode")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--output", default="library_scale_benchmark.json")
+    parser.add_argument("--compare", help="Earlier results file to check for regressions")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="Allowed slowdown before flagging a regression")
+    parser.add_argument("--single-size", type=int, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.single_size is not None:
+        print(json.dumps(asyncio.run(run_size(args.single_size, args.requests, args.concurrency, args.seed))))
+    else:
+        main(args)
@@ -0,0 +1,119 @@
+"""
+Measure library full-text search latency on a large synthetic library.
+
+Fills a throwaway database with synthetic entries (question, refined question, best
+answer, three expert answers and tags drawn from a Zipf-like vocabulary), then times:
+  * the bulk load, which writes the search index alongside the entries
+  * searches for common, mid-frequency, rare and multi-word queries
+  * single add_entry calls, which update the index incrementally
+
+Usage (from the backend directory):
+    python benchmarks/library_search_benchmark.py --entries 100000 --queries 200
+"""
+import argparse
+import itertools
+import os
+import random
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from library_search import build_match_query
+from library_store import LibraryRepository
+
+WORDS = (
+    "question answer learning growth team trust leadership decision change value purpose risk "
+    "future memory habit creativity conflict meaning community health climate energy market "
+    "technology privacy education curiosity failure success ethics balance attention language "
+    "culture evidence system feedback incentive identity resilience strategy uncertainty wisdom "
+    "motivation empathy innovation tradition justice freedom happiness patience ambition grief "
+    "navigation migration photosynthesis entropy algorithm metaphor paradox hypothesis"
+).split()
+CATEGORIES = ["General", "Technology", "Science", "Philosophy", "Business"]
+# Pad the vocabulary with pronounceable made-up words to give it a realistic long tail
+_SYLLABLES = ["ka", "lo", "mi", "ren", "tas", "vo", "quil", "dor", "pen", "sha", "tri", "ux"]
+WORDS += sorted({"".join(random.Random(n).choices(_SYLLABLES, k=4)) for n in range(20000)} - set(WORDS))
+# Zipf-like weights so a few words are very common and the tail is rare
+CUMULATIVE_WEIGHTS = list(itertools.accumulate(1.0 / (rank + 1) for rank in range(len(WORDS))))
+
+
+def sentence(rng, length):
+    return " ".join(rng.choices(WORDS, cum_weights=CUMULATIVE_WEIGHTS, k=length)).capitalize()
+
+
+def synthetic_entry(rng, i):
+    return {
+        "originalQuestion": sentence(rng, 10) + "?",
+        "refinedQuestion": sentence(rng, 16) + "?",
+        "expertPersonas": ["Samantha", "David", "Dr. Sophia"],
+        "category": rng.choice(CATEGORIES),
+        "tags": rng.sample(WORDS[:20], 2),
+        "individualAnswers": [{"name": name, "answer": sentence(rng, 60)} for name in ("Samantha", "David", "Dr. Sophia")],
+        "bestAnswer": sentence(rng, 120),
+        "date": f"2025-{i % 12 + 1:02d}-{i % 28 + 1:02d}T00:00:00",
+        "status": "user",
+    }
+
+
+def percentiles(samples):
+    ordered = sorted(samples)
+    pick = lambda p: ordered[min(len(ordered) - 1, int(p * len(ordered)))] * 1000
+    return f"p50 {pick(0.50):7.2f} ms  p95 {pick(0.95):7.2f} ms  p99 {pick(0.99):7.2f} ms"
+
+
+def main(entries, queries, batch):
+    rng = random.Random(42)
+    with tempfile.TemporaryDirectory() as workdir:
+        library = LibraryRepository(os.path.join(workdir, "library.sqlite3"))
+
+        start = time.perf_counter()
+        for offset in range(0, entries, batch):
+            library.add_entries([synthetic_entry(rng, i) for i in range(offset, min(entries, offset + batch))])
+        load_time = time.perf_counter() - start
+        size_mb = os.path.getsize(os.path.join(workdir, "library.sqlite3")) / 1e6
+        print(f"Loaded {entries} entries with search index in {load_time:.1f}s ({size_mb:.0f} MB before WAL checkpoint)")
+
+        workloads = {
+            "common term": lambda: WORDS[rng.randrange(3)],
+            "mid-frequency term": lambda: WORDS[rng.randrange(10, 25)],
+            "rare term": lambda: WORDS[rng.randrange(len(WORDS) - 8, len(WORDS))],
+            "two terms": lambda: " ".join(rng.sample(WORDS[:30], 2)),
+            "three terms": lambda: " ".join(rng.sample(WORDS, 3)),
+        }
+        for label, make_query in workloads.items():
+            samples = []
+            for _ in range(queries):
+                match_query = build_match_query(make_query())
+                query_start = time.perf_counter()
+                library.search(match_query, limit=20)
+                samples.append(time.perf_counter() - query_start)
+            print(f"search {label:<20} {percentiles(samples)}")
+
+        samples = []
+        for _ in range(queries):
+            match_query = build_match_query(" ".join(rng.sample(WORDS[:30], 2)))
+            query_start = time.perf_counter()
+            library.search(match_query, category=rng.choice(CATEGORIES), limit=20)
+            samples.append(time.perf_counter() - query_start)
+        print(f"search {'two terms + category':<20} {percentiles(samples)}")
+
+        samples = []
+        for i in range(queries):
+            entry = synthetic_entry(rng, entries + i)
+            insert_start = time.perf_counter()
+            library.add_entry(entry)
+            samples.append(time.perf_counter() - insert_start)
+        print(f"{'incremental add_entry':<27} {percentiles(samples)}")
+
+        library.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--entries", type=int, default=100000)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--batch", type=int, default=5000, help="Entries per bulk-load transaction")
+    args = parser.parse_args()
+    main(args.entries, args.queries, args.batch)
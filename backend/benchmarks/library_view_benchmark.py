@@ -0,0 +1,86 @@
+"""
+Benchmark GET /api/library/entry/{id} throughput with and without write-behind counters.
+
+Builds a throwaway library database with synthetic entries, then drives the
+endpoint in-process through the ASGI app twice: once writing every view count
+straight through to the store (the behaviour before write-behind batching), and
+once with the CounterAggregator buffering increments.
+
+Usage (from the backend directory):
+    python benchmarks/library_view_benchmark.py --entries 1000 --requests 5000 --concurrency 16
+"""
+import argparse
+import asyncio
+import os
+import random
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("openai_api_key", "benchmark")
+
+import httpx
+import logging
+
+import main
+from library_counters import CounterAggregator
+from library_store import LibraryRepository
+from library_writer import LibraryWriter
+
+
+def synthetic_entry(i):
+    return {
+        "originalQuestion": f"Synthetic question {i}?",
+        "refinedQuestion": f"A deeper version of synthetic question {i}?",
+        "expertPersonas": ["Samantha", "David", "Dr. Sophia"],
+        "category": random.choice(["General", "Technology", "Science", "Philosophy"]),
+        "tags": ["synthetic"],
+        "individualAnswers": [{"name": "Samantha", "answer": "An answer. " * 40}],
+        "bestAnswer": "A synthesized answer. " * 60,
+        "date": f"2025-01-01T00:00:{i % 60:02d}",
+        "status": "user",
+    }
+
+
+async def drive(entry_ids, requests, concurrency):
+    transport = httpx.ASGITransport(app=main.app)
+    semaphore = asyncio.Semaphore(concurrency)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+        async def one():
+            async with semaphore:
+                response = await client.get(f"/api/library/entry/{random.choice(entry_ids)}")
+                response.raise_for_status()
+
+        start = time.perf_counter()
+        await asyncio.gather(*[one() for _ in range(requests)])
+        return time.perf_counter() - start
+
+
+async def run(entries, requests, concurrency):
+    logging.disable(logging.INFO)
+    with tempfile.TemporaryDirectory() as workdir:
+        main.library = LibraryRepository(os.path.join(workdir, "library.sqlite3"))
+        entry_ids = main.library.add_entries([synthetic_entry(i) for i in range(entries)])
+        main.library_writer = LibraryWriter(main.library)
+        main.library_writer.start()
+
+        for label, flush_interval in (("write-through", 0), ("write-behind", 2.0)):
+            main.library_counters = CounterAggregator(main.library_writer, flush_interval=flush_interval)
+            main.library_counters.start()
+            elapsed = await drive(entry_ids, requests, concurrency)
+            await main.library_counters.stop()
+            print(f"{label:<14} {requests / elapsed:>8.0f} req/s  ({elapsed:.2f}s for {requests} requests, "
+                  f"{main.library_counters.flushes} batched flushes)")
+
+        await main.library_writer.stop()
+        main.library.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--entries", type=int, default=1000)
+    parser.add_argument("--requests", type=int, default=5000)
+    parser.add_argument("--concurrency", type=int, default=16)
+    args = parser.parse_args()
+    asyncio.run(run(args.entries, args.requests, args.concurrency))
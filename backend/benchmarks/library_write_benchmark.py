@@ -0,0 +1,90 @@
+"""
+Benchmark library write throughput: one transaction per mutation vs. the group-committing writer.
+
+Runs the same mix of concurrent mutations (new comments and new entries) twice
+against a throwaway database:
+  * per-mutation: each mutation commits its own transaction from the event loop,
+    the way the handlers wrote before the single writer existed
+  * writer: every mutation goes through LibraryWriter, which batches whatever arrives
+    within its window into one synced commit
+Afterwards it checks that every mutation is present, i.e. that nothing was lost.
+
+Usage (from the backend directory):
+    python benchmarks/library_write_benchmark.py --mutations 2000 --concurrency 64
+"""
+import argparse
+import asyncio
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from library_store import LibraryRepository
+from library_writer import LibraryWriter
+
+
+def synthetic_entry(i):
+    return {"originalQuestion": f"Synthetic question {i}?", "bestAnswer": "An answer. " * 50, "tags": ["synthetic"]}
+
+
+def synthetic_comment(i):
+    return {"comment": f"Comment {i}", "author": "Benchmark", "date": "2025-01-01T00:00:00"}
+
+
+async def drive(mutations, concurrency, add_entry, add_comment, entry_id):
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def one(i):
+        async with semaphore:
+            if i % 4 == 0:
+                await add_entry(synthetic_entry(i))
+            else:
+                await add_comment(entry_id, synthetic_comment(i))
+
+    start = time.perf_counter()
+    await asyncio.gather(*[one(i) for i in range(mutations)])
+    return time.perf_counter() - start
+
+
+async def run(mutations, concurrency, batch_window):
+    for label in ("per-mutation", "writer"):
+        with tempfile.TemporaryDirectory() as workdir:
+            library = LibraryRepository(os.path.join(workdir, "library.sqlite3"))
+            entry_id = library.add_entry(synthetic_entry(-1))
+            writer = None
+
+            if label == "per-mutation":
+                async def add_entry(entry):
+                    library.add_entry(entry)
+
+                async def add_comment(target, comment):
+                    library.add_comment(target, comment)
+            else:
+                writer = LibraryWriter(library, batch_window=batch_window)
+                writer.start()
+                add_entry, add_comment = writer.add_entry, writer.add_comment
+
+            elapsed = await drive(mutations, concurrency, add_entry, add_comment, entry_id)
+            commits = mutations
+            if writer is not None:
+                commits = writer.commits
+                await writer.stop()
+
+            expected_comments = sum(1 for i in range(mutations) if i % 4)
+            stored_comments = library.get_entry(entry_id)["comments"]
+            stored_entries = library.count() - 1
+            lost = (expected_comments - stored_comments) + (mutations - expected_comments - stored_entries)
+            print(f"{label:<13} {mutations / elapsed:>8.0f} mutations/s  ({elapsed:.2f}s, {commits} commits, "
+                  f"{lost} lost updates)")
+            library.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--mutations", type=int, default=2000)
+    parser.add_argument("--concurrency", type=int, default=64)
+    parser.add_argument("--batch-window", type=float, default=0.0, help="Writer batching window in seconds")
+    args = parser.parse_args()
+    asyncio.run(run(args.mutations, args.concurrency, args.batch_window))
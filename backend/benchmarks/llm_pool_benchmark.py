@@ -0,0 +1,141 @@
+"""
+Benchmark connection reuse of the pooled LLM client registry.
+
+Starts a local stub of the OpenAI chat completions API that counts accepted TCP
+connections, then issues the same number of calls two ways:
+
+  * per-request: a fresh ChatOpenAI and HTTP client for every call (the old
+                 behaviour; recent langchain-openai releases cache a default client
+                 per base URL, so the baseline passes its own client explicitly)
+  * pooled:      the shared model returned by LLMClientRegistry
+
+Usage (from the backend directory):
+    python benchmarks/llm_pool_benchmark.py --calls 200 --concurrency 20
+"""
+import argparse
+import asyncio
+import json
+import os
+import sys
+import time
+
+import httpx
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from langchain_openai import ChatOpenAI
+from llm_clients import LLMClientRegistry
+
+STUB_COMPLETION = {
+    "id": "chatcmpl-stub",
+    "object": "chat.completion",
+    "created": 0,
+    "model": "o3-mini",
+    "choices": [{"index": 0, "message": {"role": "assistant", "content": "stub answer"}, "finish_reason": "stop"}],
+    "usage": {"prompt_tokens": 10, "completion_tokens": 2, "total_tokens": 12},
+}
+
+
+class StubProvider:
+    """Minimal keep-alive HTTP/1.1 server answering every request with a fixed completion."""
+
+    def __init__(self, latency=0.005):
+        self.latency = latency
+        self.connections = 0
+        self.requests = 0
+        self.server = None
+
+    async def start(self):
+        self.server = await asyncio.start_server(self._handle, "127.0.0.1", 0)
+        return self.server.sockets[0].getsockname()[1]
+
+    async def stop(self):
+        self.server.close()
+        await self.server.wait_closed()
+
+    async def _handle(self, reader, writer):
+        self.connections += 1
+        body = json.dumps(STUB_COMPLETION).encode()
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line:
+                    break
+                content_length = 0
+                while True:
+                    header = await reader.readline()
+                    if header in (b"\r\n", b"\n", b""):
+                        break
+                    name, _, value = header.decode().partition(":")
+                    if name.strip().lower() == "content-length":
+                        content_length = int(value.strip())
+                if content_length:
+                    await reader.readexactly(content_length)
+                self.requests += 1
+                await asyncio.sleep(self.latency)
+                writer.write(
+                    b"HTTP/1.1 200 OK\r\nContent-Type: application/json\r\nConnection: keep-alive\r\n"
+                    + f"Content-Length: {len(body)}\r\n\r\n".encode() + body
+                )
+                await writer.drain()
+        except (ConnectionResetError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+
+async def run_calls(call, calls, concurrency):
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies = []
+
+    async def one():
+        async with semaphore:
+            start = time.perf_counter()
+            await call()
+            latencies.append(time.perf_counter() - start)
+
+    start = time.perf_counter()
+    await asyncio.gather(*[one() for _ in range(calls)])
+    return time.perf_counter() - start, sorted(latencies)
+
+
+def report(label, stub, connections_before, elapsed, latencies):
+    p50 = latencies[len(latencies) // 2] * 1000
+    p95 = latencies[int(len(latencies) * 0.95) - 1] * 1000
+    print(f"{label:<12} calls={len(latencies):<5} connections={stub.connections - connections_before:<5} "
+          f"total={elapsed:.2f}s p50={p50:.1f}ms p95={p95:.1f}ms")
+
+
+async def main(calls, concurrency, latency):
+    stub = StubProvider(latency=latency)
+    port = await stub.start()
+    base_url = f"http://127.0.0.1:{port}/v1"
+
+    async def per_request_call():
+        async with httpx.AsyncClient() as http_client:
+            chat = ChatOpenAI(model="o3-mini", temperature=1, openai_api_key="stub",
+                              base_url=base_url, http_async_client=http_client)
+            await chat.ainvoke("ping")
+
+    before = stub.connections
+    elapsed, latencies = await run_calls(per_request_call, calls, concurrency)
+    report("per-request", stub, before, elapsed, latencies)
+
+    registry = LLMClientRegistry("stub", base_url=base_url, max_connections=concurrency,
+                                 max_keepalive_connections=concurrency)
+    registry.start()
+    before = stub.connections
+    elapsed, latencies = await run_calls(lambda: registry.get_chat_model().ainvoke("ping"), calls, concurrency)
+    report("pooled", stub, before, elapsed, latencies)
+    await registry.close()
+
+    await stub.stop()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--calls", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, default=20)
+    parser.add_argument("--latency", type=float, default=0.005, help="stub response latency in seconds")
+    args = parser.parse_args()
+    asyncio.run(main(args.calls, args.concurrency, args.latency))
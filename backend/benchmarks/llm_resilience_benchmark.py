@@ -0,0 +1,153 @@
+"""
+Tail latency and failure rate of the improvement pipeline against a flaky provider.
+
+The pipeline runs in-process against a fault-injecting stand-in for the provider that
+answers like the load test's synthetic model. Most calls take --latency seconds to
+their first token; a --slow-rate share take --slow-latency instead (a heavy tail); and
+an --error-rate share fail with a transient 503. Sessions run under three policies:
+
+  * single:  one attempt per call and no hedging, so any failure fails the session
+  * retry:   jittered retries (LLM_RETRY_ATTEMPTS)
+  * hedge:   retries, plus a duplicate call once a stage's first token is later than
+             the LLM_HEDGE_PERCENTILE of recent calls
+
+For each policy it reports completed sessions, pipeline p50/p95/p99 latency, and LLM
+attempts per completed session (the cost of retries and hedges).
+
+Usage (from the backend directory):
+    python benchmarks/llm_resilience_benchmark.py --sessions 200 --concurrency 20 --error-rate 0.02
+"""
+import argparse
+import asyncio
+import logging
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import AIMessage, AIMessageChunk, get_buffer_string
+from langchain_core.outputs import ChatGeneration, ChatGenerationChunk, ChatResult
+
+# Imported first: it points the app at scratch storage
+from load_test import QUESTIONS, SyntheticChatModel, percentiles
+
+import llm_resilience
+import main
+
+
+class ProviderUnavailable(Exception):
+    status_code = 503
+
+
+class FlakyChatModel(BaseChatModel):
+    """Synthetic responses with heavy-tailed time to first token and injected transient errors."""
+
+    latency: float = 0.05
+    slow_latency: float = 2.0
+    slow_rate: float = 0.03
+    error_rate: float = 0.02
+    attempts: int = 0
+
+    @property
+    def _llm_type(self):
+        return "flaky"
+
+    async def _delay_or_fail(self):
+        self.attempts += 1
+        await asyncio.sleep(self.slow_latency if random.random() < self.slow_rate else self.latency)
+        if random.random() < self.error_rate:
+            raise ProviderUnavailable("Injected 503")
+
+    def _generate(self, messages, stop=None, run_manager=None, **kwargs):
+        raise NotImplementedError("The pipeline only makes async calls")
+
+    async def _agenerate(self, messages, stop=None, run_manager=None, **kwargs):
+        await self._delay_or_fail()
+        text = SyntheticChatModel()._respond(get_buffer_string(messages))
+        return ChatResult(generations=[ChatGeneration(message=AIMessage(content=text))])
+
+    async def _astream(self, messages, stop=None, run_manager=None, **kwargs):
+        await self._delay_or_fail()
+        text = SyntheticChatModel()._respond(get_buffer_string(messages))
+        for i in range(0, len(text), 64):
+            yield ChatGenerationChunk(message=AIMessageChunk(content=text[i:i + 64]))
+
+
+POLICIES = {
+    "single": {"LLM_RETRY_ATTEMPTS": 1, "LLM_HEDGE_ENABLED": False},
+    "retry": {"LLM_RETRY_ATTEMPTS": 3, "LLM_HEDGE_ENABLED": False},
+    "hedge": {"LLM_RETRY_ATTEMPTS": 3, "LLM_HEDGE_ENABLED": True},
+}
+
+
+async def run_policy(args, policy):
+    for name, value in POLICIES[policy].items():
+        setattr(llm_resilience, name, value)
+    llm_resilience.LLM_RETRY_BASE_DELAY = args.retry_base_delay
+    llm_resilience.latencies = llm_resilience.LatencyTracker()
+    llm_resilience.breaker = llm_resilience.CircuitBreaker(failure_threshold=10 ** 9)
+    model = FlakyChatModel(latency=args.latency, slow_latency=args.slow_latency, slow_rate=args.slow_rate,
+                           error_rate=args.error_rate)
+    main.llm_clients.get_chat_model = lambda *model_args, **model_kwargs: model
+    # Seed the latency history so hedging has a threshold from the first session
+    for stage in ("brainstorm", "critique", "evaluation", "expansion", "convergence", "final_answer",
+                  "improved_question", "summary", "rationale", "harmony_principle", "new_dimensions"):
+        for _ in range(llm_resilience.LLM_HEDGE_MIN_SAMPLES):
+            llm_resilience.latencies.record(stage, args.latency)
+
+    semaphore = asyncio.Semaphore(args.concurrency)
+    samples = []
+    failures = 0
+
+    async def one(i):
+        nonlocal failures
+        question = QUESTIONS[i % len(QUESTIONS)]
+        personas = main.fast_select_personas(question)["selectedPersonas"]
+        async with semaphore:
+            start = time.perf_counter()
+            try:
+                await main.run_improvement(question, personas)
+            except Exception:
+                failures += 1
+            else:
+                samples.append(time.perf_counter() - start)
+
+    start = time.perf_counter()
+    await asyncio.gather(*[one(i) for i in range(args.sessions)])
+    elapsed = time.perf_counter() - start
+    return {"completed": len(samples), "failed": failures, "elapsed_s": round(elapsed, 2),
+            "attempts_per_session": round(model.attempts / max(1, len(samples)), 2),
+            **(percentiles(samples) if samples else {})}
+
+
+async def run(args):
+    logging.disable(logging.CRITICAL)
+    random.seed(args.seed)
+    await main.startup_event()
+    try:
+        results = {policy: await run_policy(args, policy) for policy in POLICIES}
+    finally:
+        await main.shutdown_event()
+    print(f"{args.sessions} sessions, first token {args.latency}s ({args.slow_rate:.0%} at {args.slow_latency}s), "
+          f"{args.error_rate:.0%} transient errors")
+    for policy, result in results.items():
+        print(f"  {policy:<7} completed {result['completed']:>4}  failed {result['failed']:>4}  "
+              f"p50 {result.get('p50_ms', 0) / 1000:6.2f}s  p95 {result.get('p95_ms', 0) / 1000:6.2f}s  "
+              f"p99 {result.get('p99_ms', 0) / 1000:6.2f}s  LLM attempts/session {result['attempts_per_session']}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sessions", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, default=20)
+    parser.add_argument("--latency", type=float, default=0.05, help="Usual seconds to first token")
+    parser.add_argument("--slow-latency", type=float, default=2.0, help="Seconds to first token of a slow call")
+    parser.add_argument("--slow-rate", type=float, default=0.03, help="Share of calls that are slow")
+    parser.add_argument("--error-rate", type=float, default=0.02, help="Share of calls that fail with a 503")
+    parser.add_argument("--retry-base-delay", type=float, default=0.05,
+                        help="Backoff base for the benchmark (the app default is LLM_RETRY_BASE_DELAY)")
+    parser.add_argument("--seed", type=int, default=7)
+    asyncio.run(run(parser.parse_args()))
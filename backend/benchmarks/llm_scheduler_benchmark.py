@@ -0,0 +1,223 @@
+"""
+Burst test of the LLM scheduler against a rate-limited local stub provider.
+
+Starts a local stub of the OpenAI chat completions API (plain and streamed responses)
+that allows at most --provider-rps requests per second and answers anything beyond
+that with 429, like a provider enforcing RPM limits. Its responses come from the load
+test's synthetic model, so the whole pipeline runs. A burst of sessions (persona
+selection plus the improvement pipeline, all started at once) is then driven through
+the app in-process, from one heavy client sending most of the sessions and several
+light clients, in two modes:
+
+  * unscheduled: calls go straight to the provider (the previous behaviour)
+  * scheduled:   calls go through an LLMScheduler limited to --headroom of the
+                 provider's rate, with a bounded queue
+
+For each mode it reports completed, rejected (429/503 from our own admission control)
+and failed sessions, the 429s the provider returned, and session latency for the heavy
+and the light clients.
+
+Usage (from the backend directory):
+    python benchmarks/llm_scheduler_benchmark.py --sessions 40 --light-clients 4 --provider-rps 50
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import httpx
+
+# Imported first: it points the app at scratch storage and turns off the selection cache and coalescing
+from load_test import QUESTIONS, SyntheticChatModel, percentiles
+
+import llm_resilience
+import main
+from llm_clients import LLMClientRegistry
+from llm_scheduler import LLMScheduler
+
+ROLES = {"user": "Human", "assistant": "AI", "system": "System"}
+
+
+class RateLimitedStubProvider:
+    """Minimal OpenAI-compatible HTTP server that answers 429 once a second's request budget is spent."""
+
+    def __init__(self, requests_per_second, latency=0.02):
+        self.requests_per_second = requests_per_second
+        self.latency = latency
+        self.model = SyntheticChatModel()
+        self.accepted = 0
+        self.rate_limited = 0
+        self._window = 0
+        self._window_count = 0
+        self.server = None
+
+    async def start(self):
+        self.server = await asyncio.start_server(self._handle, "127.0.0.1", 0)
+        return self.server.sockets[0].getsockname()[1]
+
+    async def stop(self):
+        self.server.close()
+        await self.server.wait_closed()
+
+    def _admit(self):
+        window = int(time.monotonic())
+        if window != self._window:
+            self._window, self._window_count = window, 0
+        self._window_count += 1
+        return self._window_count <= self.requests_per_second
+
+    def _completion(self, request):
+        prompt = "\n".join(f"{ROLES.get(message['role'], message['role'])}: {message['content']}"
+                           for message in request["messages"])
+        text = self.model._respond(prompt)
+        if not request.get("stream"):
+            body = {"id": "chatcmpl-stub", "object": "chat.completion", "created": 0, "model": request["model"],
+                    "choices": [{"index": 0, "message": {"role": "assistant", "content": text},
+                                 "finish_reason": "stop"}]}
+            return "application/json", json.dumps(body)
+        events = []
+        for i in range(0, len(text), 64):
+            delta = {"content": text[i:i + 64]}
+            events.append({"id": "chatcmpl-stub", "object": "chat.completion.chunk", "created": 0,
+                           "model": request["model"], "choices": [{"index": 0, "delta": delta, "finish_reason": None}]})
+        events.append({"id": "chatcmpl-stub", "object": "chat.completion.chunk", "created": 0,
+                       "model": request["model"], "choices": [{"index": 0, "delta": {}, "finish_reason": "stop"}]})
+        return "text/event-stream", "".join(f"data: {json.dumps(event)}\n\n" for event in events) + "data: [DONE]\n\n"
+
+    async def _handle(self, reader, writer):
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line:
+                    break
+                content_length = 0
+                while True:
+                    header = await reader.readline()
+                    if header in (b"\r\n", b"\n", b""):
+                        break
+                    name, _, value = header.decode().partition(":")
+                    if name.strip().lower() == "content-length":
+                        content_length = int(value.strip())
+                payload = await reader.readexactly(content_length) if content_length else b"{}"
+                if self._admit():
+                    self.accepted += 1
+                    await asyncio.sleep(self.latency)
+                    status, (content_type, body) = "200 OK", self._completion(json.loads(payload))
+                else:
+                    self.rate_limited += 1
+                    status, content_type = "429 Too Many Requests", "application/json"
+                    body = json.dumps({"error": {"message": "Rate limit reached", "type": "requests",
+                                                 "code": "rate_limit_exceeded"}})
+                encoded = body.encode()
+                writer.write(f"HTTP/1.1 {status}\r\nContent-Type: {content_type}\r\nConnection: keep-alive\r\n"
+                             f"Content-Length: {len(encoded)}\r\n\r\n".encode() + encoded)
+                await writer.drain()
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+
+async def session(client, question):
+    """Select personas and run the improvement pipeline; return the outcome and how long it took."""
+    start = time.perf_counter()
+    response = await client.post("/select-personas", json={"text": question})
+    if response.status_code == 200:
+        personas = response.json()["selectedPersonas"]
+        response = await client.post("/improve-question", json={"text": question, "personas": personas})
+    elapsed = time.perf_counter() - start
+    if response.status_code == 200:
+        return "completed", elapsed
+    return ("rejected" if response.status_code in (429, 503) else "failed"), elapsed
+
+
+async def run_mode(args, port, scheduled):
+    provider_rate = args.provider_rps * 60
+    scheduler = LLMScheduler(rpm=provider_rate * args.headroom, burst_seconds=1,
+                             max_concurrency=args.max_concurrency, max_queue=args.max_queue,
+                             max_queue_per_client=args.max_queue_per_client)
+    await main.llm_clients.close()
+    # The provider's 429s would otherwise open the circuit breaker and fail every later
+    # call at once; this benchmark measures the scheduler alone
+    llm_resilience.breaker = llm_resilience.CircuitBreaker(failure_threshold=10 ** 9)
+    main.llm_scheduler = scheduler if scheduled else LLMScheduler(max_concurrency=10 ** 9, max_queue=10 ** 9,
+                                                                  max_queue_per_client=10 ** 9)
+    main.llm_clients = LLMClientRegistry("stub", base_url=f"http://127.0.0.1:{port}/v1",
+                                         scheduler=scheduler if scheduled else None)
+
+    # One heavy client sends --heavy-share of the sessions; the rest are spread over the light clients
+    heavy = round(args.sessions * args.heavy_share)
+    owners = ["heavy"] * heavy + [f"light-{i % args.light_clients}" for i in range(args.sessions - heavy)]
+    clients = {}
+    for owner in set(owners):
+        address = "10.0.0.1" if owner == "heavy" else f"10.0.1.{int(owner.split('-')[1]) + 1}"
+        clients[owner] = httpx.AsyncClient(transport=httpx.ASGITransport(app=main.app, client=(address, 4000)),
+                                           base_url="http://bench", timeout=None)
+    try:
+        start = time.perf_counter()
+        outcomes = await asyncio.gather(*[session(clients[owner], f"{QUESTIONS[i % len(QUESTIONS)]} (#{i})")
+                                          for i, owner in enumerate(owners)])
+        elapsed = time.perf_counter() - start
+    finally:
+        for client in clients.values():
+            await client.aclose()
+
+    result = {"elapsed_s": round(elapsed, 2)}
+    for outcome in ("completed", "rejected", "failed"):
+        result[outcome] = sum(1 for status, _ in outcomes if status == outcome)
+    for group in ("heavy", "light"):
+        samples = [seconds for owner, (status, seconds) in zip(owners, outcomes)
+                   if owner.startswith(group) and status == "completed"]
+        result[f"{group}_latency"] = percentiles(samples) if samples else {}
+    return result
+
+
+async def run(args):
+    logging.disable(logging.ERROR)
+    await main.startup_event()
+    results = {}
+    try:
+        for mode in ("unscheduled", "scheduled"):
+            provider = RateLimitedStubProvider(args.provider_rps)
+            port = await provider.start()
+            try:
+                results[mode] = await run_mode(args, port, scheduled=mode == "scheduled")
+            finally:
+                await provider.stop()
+            results[mode]["provider_accepted"] = provider.accepted
+            results[mode]["provider_429s"] = provider.rate_limited
+    finally:
+        await main.shutdown_event()
+
+    print(f"{args.sessions} sessions at once ({args.heavy_share:.0%} from one client), "
+          f"provider limit {args.provider_rps} req/s")
+    for mode, result in results.items():
+        heavy, light = result["heavy_latency"], result["light_latency"]
+        print(f"  {mode:<12} completed {result['completed']:>3}  rejected {result['rejected']:>3}  "
+              f"failed {result['failed']:>3}  provider 429s {result['provider_429s']:>5}  "
+              f"in {result['elapsed_s']:6.2f}s  heavy p50/p95 {heavy.get('p50_ms', 0) / 1000:6.2f}/"
+              f"{heavy.get('p95_ms', 0) / 1000:6.2f}s  light p50/p95 {light.get('p50_ms', 0) / 1000:6.2f}/"
+              f"{light.get('p95_ms', 0) / 1000:6.2f}s")
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
+        print(f"Wrote {args.json}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sessions", type=int, default=40)
+    parser.add_argument("--heavy-share", type=float, default=0.75, help="Share of sessions sent by the heavy client")
+    parser.add_argument("--light-clients", type=int, default=4)
+    parser.add_argument("--provider-rps", type=int, default=50, help="Requests per second the stub provider accepts")
+    parser.add_argument("--headroom", type=float, default=0.9, help="Share of the provider's rate the scheduler uses")
+    parser.add_argument("--max-concurrency", type=int, default=32)
+    parser.add_argument("--max-queue", type=int, default=256)
+    parser.add_argument("--max-queue-per-client", type=int, default=64)
+    parser.add_argument("--json", help="Also write the results to this JSON file")
+    asyncio.run(run(parser.parse_args()))
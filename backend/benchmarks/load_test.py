@@ -0,0 +1,279 @@
+"""
+Offline end-to-end load test of the FastAPI app.
+
+Drives N concurrent sessions against the app in-process (through the ASGI transport,
+no server or network needed). Each session selects personas, runs the improvement
+pipeline (streamed or not) and loads the first library page. The LLM is the replay
+backend, answering from a cassette with synthetic latency, so the numbers measure our
+own overhead on top of a known model latency; run with --latency 0 to see the
+overhead alone.
+
+If the cassette does not exist yet it is recorded first, offline, from a synthetic
+model that returns well-formed responses for every prompt (persona selection JSON,
+per-persona JSON answers for the convergence stage, filler text elsewhere). Recording
+with LLM_BACKEND=record against the real provider produces a cassette of real
+responses for the same question set instead.
+
+Reports p50/p95/p99 latency per endpoint, plus time to first event for the stream.
+The in-process transport hands over a response body only once it is complete, so
+time to first event is only meaningful with --base-url against a running server
+(started with LLM_BACKEND=replay and a cassette recorded for the same questions).
+
+Usage (from the backend directory):
+    python benchmarks/load_test.py --sessions 200 --concurrency 20 --latency 0.05
+    python benchmarks/load_test.py --stream --json load_test.json
+    python benchmarks/load_test.py --stream --base-url http://localhost:8000
+"""
+import argparse
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import re
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+WORKDIR = tempfile.mkdtemp(prefix="questioncrafter-load-")
+os.environ.setdefault("openai_api_key", "offline")
+os.environ.setdefault("LIBRARY_DB_PATH", os.path.join(WORKDIR, "library.sqlite3"))
+os.environ.setdefault("LIBRARY_JSON_PATH", os.path.join(WORKDIR, "library_entries.json"))
+os.environ.setdefault("BATCH_JOB_DB_PATH", os.path.join(WORKDIR, "batch_jobs.sqlite3"))
+os.environ.setdefault("IMPROVEMENT_SESSION_DB_PATH", os.path.join(WORKDIR, "improvement_sessions.sqlite3"))
+# Every session should exercise persona selection, not the cache
+if "--selection-cache" not in sys.argv:
+    os.environ["SELECTION_CACHE_BACKEND"] = "memory"
+    os.environ["SELECTION_CACHE_TTL"] = "0"
+# ...and run its own pipeline rather than share one with an identical concurrent session
+if "--coalesce" not in sys.argv:
+    os.environ["REQUEST_COALESCING_MAX_KEYS"] = "0"
+
+import httpx
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import AIMessage, get_buffer_string
+from langchain_core.outputs import ChatGeneration, ChatResult
+
+import main
+from llm_clients import LLMClientRegistry
+from llm_replay import Cassette, RecordingChatModel
+
+QUESTIONS = [
+    "How can small teams make better decisions under uncertainty?",
+    "What makes a habit stick after the initial motivation fades?",
+    "Why do some communities recover faster from disasters than others?",
+    "How should schools teach students to evaluate evidence online?",
+    "What does a fair transition away from fossil fuels look like?",
+    "How do we balance privacy with the benefits of shared health data?",
+    "What is the role of failure in creative work?",
+    "How can cities reduce loneliness among older residents?",
+    "What should we expect from AI assistants in everyday life?",
+    "How do incentives shape honesty inside large organizations?",
+]
+
+FILLER = ("perspective insight tension assumption evidence tradeoff context framing question "
+          "stakeholder consequence value system pattern constraint opportunity").split()
+
+
+class SyntheticChatModel(BaseChatModel):
+    """Deterministic offline stand-in that returns a well-formed response for each pipeline prompt."""
+
+    # question -> persona names, learned from the brainstorm prompt for the convergence answers
+    personas_by_question: dict = {}
+
+    @property
+    def _llm_type(self):
+        return "synthetic"
+
+    def _respond(self, prompt):
+        seed = int(hashlib.sha256(prompt.encode()).hexdigest(), 16)
+        words = [FILLER[(seed >> (4 * i)) % len(FILLER)] for i in range(60)]
+        filler = " ".join(words).capitalize() + "."
+        available = re.search(r"Available Personas: (.*)", prompt)
+        if available and "persona1" in prompt:
+            names = [name.strip() for name in available.group(1).split(",")][:3]
+            return json.dumps({
+                "persona1": names[0], "persona2": names[1], "persona3": names[2],
+                "rationale": {name: f"{name} brings a relevant lens. {filler}" for name in names},
+            })
+        # Later prompts carry the earlier ones in the conversation history, so check the latest stage first
+        convergence = re.search(r"best answer to the initial question: (.+)\?$", prompt, re.MULTILINE)
+        if convergence:
+            names = self.personas_by_question.get(convergence.group(1).strip(), [])
+            return json.dumps({name: filler for name in names})
+        brainstorm = re.search(r"The question is: (.+)", prompt)
+        if brainstorm:
+            names = re.findall(r"^\s*Name: (.+)$", prompt, re.MULTILINE)
+            self.personas_by_question[brainstorm.group(1).strip()] = names
+            return "\n\n".join(f"{name}: {filler}" for name in names)
+        return filler
+
+    def _generate(self, messages, stop=None, run_manager=None, **kwargs):
+        text = self._respond(get_buffer_string(messages))
+        return ChatResult(generations=[ChatGeneration(message=AIMessage(content=text))])
+
+
+def percentiles(samples):
+    ordered = sorted(samples)
+    pick = lambda p: ordered[min(len(ordered) - 1, int(p * len(ordered)))] * 1000
+    return {"p50_ms": round(pick(0.50), 2), "p95_ms": round(pick(0.95), 2), "p99_ms": round(pick(0.99), 2)}
+
+
+class Recorder:
+    def __init__(self):
+        self.samples = {}
+        self.errors = {}
+
+    def add(self, endpoint, seconds, ok=True):
+        self.samples.setdefault(endpoint, [])
+        if ok:
+            self.samples[endpoint].append(seconds)
+        else:
+            self.errors[endpoint] = self.errors.get(endpoint, 0) + 1
+
+    def report(self):
+        return {
+            endpoint: {"requests": len(samples), "errors": self.errors.get(endpoint, 0),
+                       **(percentiles(samples) if samples else {})}
+            for endpoint, samples in self.samples.items()
+        }
+
+
+async def timed(recorder, endpoint, request):
+    start = time.perf_counter()
+    try:
+        response = await request()
+        ok = response.status_code < 400
+    except Exception:
+        response, ok = None, False
+    recorder.add(endpoint, time.perf_counter() - start, ok)
+    return response if ok else None
+
+
+async def session(client, question, stream, recorder):
+    response = await timed(recorder, "POST /select-personas",
+                           lambda: client.post("/select-personas", json={"text": question}))
+    if response is None:
+        return
+    personas = response.json()["selectedPersonas"]
+
+    if stream:
+        start = time.perf_counter()
+        first_event = None
+        try:
+            async with client.stream("POST", "/improve-question/stream",
+                                     json={"text": question, "personas": personas}) as streamed:
+                async for line in streamed.aiter_lines():
+                    if first_event is None and line.startswith("event:"):
+                        first_event = time.perf_counter() - start
+                    if line.startswith("event: error"):
+                        raise RuntimeError("pipeline error")
+            recorder.add("POST /improve-question/stream (first event)", first_event or 0.0)
+            recorder.add("POST /improve-question/stream", time.perf_counter() - start)
+        except Exception:
+            recorder.add("POST /improve-question/stream", time.perf_counter() - start, ok=False)
+    else:
+        await timed(recorder, "POST /improve-question",
+                    lambda: client.post("/improve-question", json={"text": question, "personas": personas}))
+
+    await timed(recorder, "GET /api/library/entries",
+                lambda: client.get("/api/library/entries", params={"fields": "summary", "limit": 24}))
+
+
+async def record_cassette(path, questions):
+    """Run every question once against the synthetic model, recording each interaction."""
+    cassette = Cassette(path)
+    recording = RecordingChatModel(inner=SyntheticChatModel(), cassette=cassette)
+    original = main.llm_clients.get_chat_model
+    main.llm_clients.get_chat_model = lambda model="o3-mini", temperature=1: recording
+    try:
+        transport = httpx.ASGITransport(app=main.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://load", timeout=None) as client:
+            for question in questions:
+                await session(client, question, stream=False, recorder=Recorder())
+    finally:
+        main.llm_clients.get_chat_model = original
+        cassette.flush()
+    print(f"Recorded {len(cassette)} interactions into {path}")
+
+
+async def drive(client, args, questions):
+    recorder = Recorder()
+    semaphore = asyncio.Semaphore(args.concurrency)
+
+    async def one(i):
+        async with semaphore:
+            await session(client, questions[i % len(questions)], args.stream, recorder)
+
+    start = time.perf_counter()
+    await asyncio.gather(*[one(i) for i in range(args.sessions)])
+    return recorder, time.perf_counter() - start
+
+
+async def run(args):
+    logging.disable(logging.ERROR)
+    questions = QUESTIONS[:args.questions]
+    if args.base_url:
+        # A running server, started with LLM_BACKEND=replay and a cassette for the same questions
+        async with httpx.AsyncClient(base_url=args.base_url, timeout=None) as client:
+            recorder, elapsed = await drive(client, args, questions)
+    else:
+        await main.startup_event()
+        try:
+            if not os.path.exists(args.cassette):
+                await record_cassette(args.cassette, questions)
+
+            await main.llm_clients.close()
+            main.llm_clients = LLMClientRegistry("offline", backend="replay", cassette_path=args.cassette)
+            replay_model = main.llm_clients.get_chat_model
+
+            def get_chat_model(*model_args, **model_kwargs):
+                chat = replay_model(*model_args, **model_kwargs)
+                chat.latency = str(args.latency)
+                return chat
+
+            main.llm_clients.get_chat_model = get_chat_model
+            transport = httpx.ASGITransport(app=main.app)
+            async with httpx.AsyncClient(transport=transport, base_url="http://load", timeout=None) as client:
+                recorder, elapsed = await drive(client, args, questions)
+        finally:
+            await main.shutdown_event()
+
+    report = {
+        "sessions": args.sessions,
+        "concurrency": args.concurrency,
+        "llm_latency_s": args.latency,
+        "stream": args.stream,
+        "coalesce": args.coalesce,
+        "elapsed_s": round(elapsed, 3),
+        "sessions_per_s": round(args.sessions / elapsed, 2),
+        "endpoints": recorder.report(),
+    }
+    print(f"{args.sessions} sessions at concurrency {args.concurrency}, {args.latency}s per LLM call: "
+          f"{elapsed:.2f}s ({report['sessions_per_s']} sessions/s)")
+    for endpoint, stats in report["endpoints"].items():
+        print(f"  {endpoint:<45} n={stats['requests']:<5} errors={stats['errors']:<3} "
+              f"p50 {stats.get('p50_ms', 0):9.2f} ms  p95 {stats.get('p95_ms', 0):9.2f} ms  "
+              f"p99 {stats.get('p99_ms', 0):9.2f} ms")
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"Wrote {args.json}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sessions", type=int, default=100)
+    parser.add_argument("--concurrency", type=int, default=10)
+    parser.add_argument("--latency", type=float, default=0.05, help="Synthetic seconds per LLM call (in-process only; a server uses LLM_REPLAY_LATENCY)")
+    parser.add_argument("--questions", type=int, default=len(QUESTIONS), help="Distinct questions to cycle through")
+    parser.add_argument("--stream", action="store_true", help="Use the streaming improvement endpoint")
+    parser.add_argument("--selection-cache", action="store_true", help="Let repeated questions hit the selection cache")
+    parser.add_argument("--coalesce", action="store_true", help="Let identical concurrent sessions share one computation")
+    parser.add_argument("--cassette", default=os.path.join(WORKDIR, "cassette.json"),
+                        help="Cassette to replay (recorded offline first if missing)")
+    parser.add_argument("--base-url", help="Load a running server instead of the in-process app")
+    parser.add_argument("--json", help="Also write the report to this JSON file")
+    asyncio.run(run(parser.parse_args()))
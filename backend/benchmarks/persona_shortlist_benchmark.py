@@ -0,0 +1,96 @@
+"""
+Benchmark persona-selection prompt size and shortlist latency versus catalog size.
+
+Synthetic catalogs of the requested sizes are generated by recombining the fields of
+the personas in personas.yaml. For each size the script reports the selection prompt
+token count with the full catalog and with the BM25 shortlist, plus index build time
+and shortlist query latency.
+
+Usage (from the backend directory):
+    python benchmarks/persona_shortlist_benchmark.py --sizes 50 500 5000 --shortlist 12
+"""
+import argparse
+import os
+import random
+import statistics
+import sys
+import time
+
+import yaml
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("openai_api_key", "benchmark")
+
+from main import build_persona_selection_prompt
+from persona_index import PersonaIndex
+
+QUESTIONS = [
+    "How should a small team secure its CI/CD pipeline without slowing releases?",
+    "What can quantum computing realistically change about drug discovery in the next decade?",
+    "How do I balance data privacy regulations with building a personalized product?",
+    "Why do some cities recover from economic shocks faster than others?",
+    "What makes a piece of music feel nostalgic?",
+]
+
+try:
+    import tiktoken
+    _encoding = tiktoken.get_encoding("o200k_base")
+
+    def count_tokens(text):
+        return len(_encoding.encode(text))
+except Exception:
+    # tiktoken missing, or its encoding file cannot be fetched offline
+    def count_tokens(text):
+        return len(text) // 4
+
+
+def synthetic_catalog(base_personas, size, seed=7):
+    """Build a catalog of `size` personas by recombining fields of the real ones."""
+    rng = random.Random(seed)
+    base = list(base_personas.items())
+    expertise_pool = [item for _, persona in base for item in persona.get("core_expertise", [])]
+    catalog = {}
+    for i in range(size):
+        key, persona = base[i % len(base)]
+        variant = dict(persona)
+        variant["core_expertise"] = rng.sample(expertise_pool, k=min(5, len(expertise_pool)))
+        catalog[f"{key}_{i}" if i >= len(base) else key] = variant
+    return catalog
+
+
+def main(sizes, shortlist_size, repeats):
+    with open("personas.yaml", "r", encoding="utf-8") as file:
+        base_personas = yaml.safe_load(file)["personas"]
+    prompt, _ = build_persona_selection_prompt()
+
+    print(f"{'personas':>9} {'full tokens':>12} {'shortlist tokens':>17} {'build ms':>9} {'query p50 ms':>13} {'query max ms':>13}")
+    for size in sizes:
+        catalog = synthetic_catalog(base_personas, size)
+
+        start = time.perf_counter()
+        index = PersonaIndex.from_personas(catalog)
+        build_ms = (time.perf_counter() - start) * 1000
+
+        timings = []
+        full_tokens = []
+        shortlist_tokens = []
+        for _ in range(repeats):
+            for question in QUESTIONS:
+                start = time.perf_counter()
+                names = index.shortlist(question, shortlist_size)
+                timings.append((time.perf_counter() - start) * 1000)
+                shortlist_tokens.append(count_tokens(prompt.format(question=question, personas=", ".join(names))))
+        for question in QUESTIONS:
+            full_tokens.append(count_tokens(prompt.format(question=question, personas=", ".join(catalog))))
+
+        print(f"{size:>9} {statistics.mean(full_tokens):>12.0f} {statistics.mean(shortlist_tokens):>17.0f} "
+              f"{build_ms:>9.1f} {statistics.median(timings):>13.3f} {max(timings):>13.3f}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[50, 500, 5000])
+    parser.add_argument("--shortlist", type=int, default=12)
+    parser.add_argument("--repeats", type=int, default=20)
+    args = parser.parse_args()
+    main(args.sizes, args.shortlist, args.repeats)
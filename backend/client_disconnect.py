@@ -0,0 +1,45 @@
+"""
+Cancel a request's remaining work when its client disconnects.
+
+A FastAPI handler keeps running after the client has gone away (a closed tab, a
+navigation), so without this the rest of the improvement pipeline would still be paid
+for and its result thrown away. cancel_on_disconnect watches the request's ASGI
+receive channel for `http.disconnect` while the work runs. If the client goes first,
+the work is cancelled wherever it is, between stages or mid-stream, and the
+cancellation reaches the in-flight LLM calls before ClientDisconnected is raised.
+"""
+import asyncio
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class ClientDisconnected(Exception):
+    """Raised when the client disconnected before its response was ready."""
+
+
+async def wait_for_disconnect(request):
+    """Return once the client of `request` (a Starlette Request whose body has been read) disconnects."""
+    while True:
+        message = await request.receive()
+        if message["type"] == "http.disconnect":
+            return
+
+
+async def cancel_on_disconnect(request, awaitable):
+    """Await `awaitable`, cancelling it and raising ClientDisconnected if the client disconnects first."""
+    task = asyncio.ensure_future(awaitable)
+    watcher = asyncio.ensure_future(wait_for_disconnect(request))
+    try:
+        await asyncio.wait((task, watcher), return_when=asyncio.FIRST_COMPLETED)
+        if task.done():
+            return task.result()
+        logger.info("Client disconnected, cancelling the rest of its request")
+        task.cancel()
+        # Wait for the cancellation to unwind, so no further LLM call starts after we return
+        await asyncio.gather(task, return_exceptions=True)
+        raise ClientDisconnected("The client disconnected before the response was ready")
+    finally:
+        watcher.cancel()
+        if not task.done():
+            task.cancel()
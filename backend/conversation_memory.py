@@ -0,0 +1,175 @@
+"""
+Conversation memory strategies for the improvement pipeline.
+
+Each stage of the pipeline is sent to the model as the standard LangChain
+conversation prompt: a history of earlier turns followed by the stage prompt. How
+much history a stage sees depends on the memory strategy:
+
+  * buffer    - the full transcript of every earlier stage (the original behaviour)
+  * summary   - a rolling LLM-written summary of older stages plus the most recent
+                turns, verbatim, up to a token budget
+  * selective - only the turns of the earlier stages listed in STAGE_CONTEXT
+
+Every memory also keeps local per-stage token counts, shared with its forks, so the
+strategies can be compared from the response metadata.
+"""
+import logging
+import os
+
+from langchain.chains.conversation.prompt import PROMPT as CONVERSATION_PROMPT
+from langchain.memory.prompt import SUMMARY_PROMPT
+from langchain_core.messages import AIMessage, HumanMessage, SystemMessage, get_buffer_string
+
+from llm_resilience import call_llm, single_response
+
+logger = logging.getLogger(__name__)
+
+CONVERSATION_MEMORY_STRATEGY = os.getenv("CONVERSATION_MEMORY_STRATEGY", "buffer")
+CONVERSATION_SUMMARY_MAX_TOKENS = int(os.getenv("CONVERSATION_SUMMARY_MAX_TOKENS", "2000"))
+TOKENIZER_ENCODING = os.getenv("TOKENIZER_ENCODING", "o200k_base")
+
+# Earlier stages whose turns each stage needs under the selective strategy
+STAGE_CONTEXT = {
+    "brainstorm": (),
+    "critique": ("brainstorm",),
+    "evaluation": ("brainstorm", "critique"),
+    "expansion": ("brainstorm", "critique", "evaluation"),
+    "convergence": ("brainstorm", "evaluation", "expansion"),
+    "final_answer": ("convergence",),
+    "improved_question": ("convergence", "final_answer"),
+    "summary": ("brainstorm", "expansion", "convergence", "improved_question"),
+    "rationale": ("convergence", "improved_question"),
+    "harmony_principle": ("convergence", "final_answer"),
+    "new_dimensions": ("final_answer", "improved_question"),
+}
+
+_encoding = None
+
+
+def count_tokens(text):
+    """Count tokens locally with tiktoken, or estimate at ~4 characters per token if it is unavailable."""
+    global _encoding
+    if _encoding is None:
+        try:
+            import tiktoken
+            _encoding = tiktoken.get_encoding(TOKENIZER_ENCODING)
+        except Exception as e:
+            logger.warning(f"tiktoken unavailable ({str(e)}), estimating token counts from text length")
+            _encoding = False
+    if _encoding is False:
+        return (len(text) + 3) // 4
+    return len(_encoding.encode(text, disallowed_special=()))
+
+
+class BufferMemory:
+    """Full transcript of every earlier stage."""
+
+    strategy = "buffer"
+
+    def __init__(self, llm=None, turns=None, token_usage=None):
+        self.llm = llm
+        # (stage, prompt, response) for every recorded stage, in order
+        self.turns = list(turns or [])
+        self.token_usage = token_usage if token_usage is not None else {}
+
+    def messages_for(self, stage):
+        return [message for _, prompt, response in self.turns
+                for message in (HumanMessage(content=prompt), AIMessage(content=response))]
+
+    def history(self, stage):
+        return get_buffer_string(self.messages_for(stage))
+
+    def format_prompt(self, stage, prompt):
+        """Render the full text sent to the model for this stage."""
+        return CONVERSATION_PROMPT.format(history=self.history(stage), input=prompt)
+
+    def record_usage(self, stage, prompt_text, response):
+        self.token_usage[stage] = {
+            "prompt_tokens": count_tokens(prompt_text),
+            "completion_tokens": count_tokens(response),
+        }
+
+    async def record(self, stage, prompt, response):
+        self.turns.append((stage, prompt, response))
+
+    def fork(self):
+        """Snapshot of the memory; later records on either copy do not affect the other."""
+        return type(self)(self.llm, self.turns, self.token_usage)
+
+    def state(self):
+        """JSON-serializable state; create_memory(llm, strategy, state) rebuilds the memory from it."""
+        return {"turns": [list(turn) for turn in self.turns], "token_usage": dict(self.token_usage)}
+
+    def usage_report(self):
+        return {
+            "memory_strategy": self.strategy,
+            "stages": dict(self.token_usage),
+            "prompt_tokens": sum(u["prompt_tokens"] for u in self.token_usage.values()),
+            "completion_tokens": sum(u["completion_tokens"] for u in self.token_usage.values()),
+        }
+
+
+class SelectiveMemory(BufferMemory):
+    """Only the turns of the earlier stages a stage declares in STAGE_CONTEXT."""
+
+    strategy = "selective"
+
+    def messages_for(self, stage):
+        needed = STAGE_CONTEXT.get(stage)
+        if needed is None:
+            return super().messages_for(stage)
+        return [message for turn_stage, prompt, response in self.turns if turn_stage in needed
+                for message in (HumanMessage(content=prompt), AIMessage(content=response))]
+
+
+class SummaryMemory(BufferMemory):
+    """Rolling summary of older stages, plus recent turns verbatim within a token budget."""
+
+    strategy = "summary"
+
+    def __init__(self, llm=None, turns=None, token_usage=None, summary="", max_tokens=CONVERSATION_SUMMARY_MAX_TOKENS):
+        super().__init__(llm, turns, token_usage)
+        self.summary = summary
+        self.max_tokens = max_tokens
+
+    def messages_for(self, stage):
+        messages = super().messages_for(stage)
+        if self.summary:
+            messages.insert(0, SystemMessage(content=self.summary))
+        return messages
+
+    async def record(self, stage, prompt, response):
+        await super().record(stage, prompt, response)
+        pruned = []
+        while len(self.turns) > 1 and count_tokens(get_buffer_string(BufferMemory.messages_for(self, stage))) > self.max_tokens:
+            pruned.append(self.turns.pop(0))
+        if pruned:
+            new_lines = get_buffer_string([message for _, p, r in pruned
+                                           for message in (HumanMessage(content=p), AIMessage(content=r))])
+            summary_prompt = SUMMARY_PROMPT.format(summary=self.summary, new_lines=new_lines)
+            result = await call_llm("memory_summary", single_response(lambda: self.llm.ainvoke(summary_prompt)))
+            self.summary = result.content
+            self.record_usage(f"memory_summary_after_{stage}", summary_prompt, self.summary)
+            logger.info(f"Folded {len(pruned)} stage(s) into the rolling conversation summary after {stage}")
+
+    def fork(self):
+        return type(self)(self.llm, self.turns, self.token_usage, self.summary, self.max_tokens)
+
+    def state(self):
+        return {**super().state(), "summary": self.summary}
+
+
+MEMORY_STRATEGIES = {
+    "buffer": BufferMemory,
+    "summary": SummaryMemory,
+    "selective": SelectiveMemory,
+}
+
+
+def create_memory(llm, strategy=None, state=None):
+    """Build the conversation memory for one pipeline run, optionally restored from a saved state()."""
+    strategy = strategy or CONVERSATION_MEMORY_STRATEGY
+    memory_class = MEMORY_STRATEGIES.get(strategy)
+    if memory_class is None:
+        raise ValueError(f"Unknown memory strategy '{strategy}'. Expected one of: {', '.join(MEMORY_STRATEGIES)}")
+    return memory_class(llm, **(state or {}))
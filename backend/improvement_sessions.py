@@ -0,0 +1,235 @@
+"""
+Checkpointed, resumable improvement sessions.
+
+Every improvement runs under a session id. As each pipeline stage completes, its
+output is written to a local SQLite file together with the conversation memory at
+that point. When the same session id is sent again (a retry after a failure, or a
+stream reconnecting), the pipeline picks up after the last completed stage instead
+of paying for the earlier ones again. The stages completed so far can be read while
+the session is still running.
+
+A session expires IMPROVEMENT_SESSION_TTL seconds after it was last written, and
+expired sessions are deleted as new ones are created. SessionStore blocks on SQLite;
+SessionManager and SessionCheckpoint run its calls in a worker thread, so writing a
+checkpoint never stalls the event loop.
+"""
+import asyncio
+import json
+import logging
+import os
+import re
+import time
+import uuid
+import weakref
+
+from sqlite_storage import connect, init_database
+
+logger = logging.getLogger(__name__)
+
+IMPROVEMENT_SESSION_DB_PATH = os.getenv("IMPROVEMENT_SESSION_DB_PATH", "improvement_sessions.sqlite3")
+IMPROVEMENT_SESSION_TTL = float(os.getenv("IMPROVEMENT_SESSION_TTL", "86400"))
+
+# Client-chosen session ids are opaque, but kept short and safe to echo in headers
+SESSION_ID_PATTERN = re.compile(r"^[A-Za-z0-9_-]{8,64}$")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS sessions (
+    id TEXT PRIMARY KEY,
+    status TEXT NOT NULL,
+    question TEXT NOT NULL,
+    personas TEXT NOT NULL,
+    memory_strategy TEXT,
+    memory TEXT,
+    result TEXT,
+    error TEXT,
+    created_at REAL NOT NULL,
+    updated_at REAL NOT NULL,
+    expires_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS sessions_expiry ON sessions (expires_at);
+CREATE TABLE IF NOT EXISTS session_stages (
+    session_id TEXT NOT NULL REFERENCES sessions (id) ON DELETE CASCADE,
+    stage TEXT NOT NULL,
+    content TEXT NOT NULL,
+    completed_at REAL NOT NULL,
+    PRIMARY KEY (session_id, stage)
+) WITHOUT ROWID;
+"""
+
+
+class SessionNotFound(LookupError):
+    """Raised when a session id does not exist or has expired."""
+
+
+class SessionConflict(ValueError):
+    """Raised when a session is resumed with a different question, personas or memory strategy."""
+
+
+def new_session_id():
+    return uuid.uuid4().hex
+
+
+def valid_session_id(session_id):
+    return isinstance(session_id, str) and SESSION_ID_PATTERN.match(session_id) is not None
+
+
+class SessionStore:
+    """Sessions and their completed stages in a local SQLite file. Its methods block; call them off the event loop."""
+
+    def __init__(self, path=IMPROVEMENT_SESSION_DB_PATH, ttl=IMPROVEMENT_SESSION_TTL):
+        self.path = path
+        self.ttl = ttl
+        init_database(path, SCHEMA)
+
+    def _connect(self):
+        # A checkpoint lost to a power cut only costs rerunning a stage, so commits skip the fsync
+        return connect(self.path, ("synchronous=NORMAL", "foreign_keys=ON"))
+
+    def purge_expired(self):
+        """Delete expired sessions and their stages; returns how many sessions were deleted."""
+        with self._connect() as conn:
+            return conn.execute("DELETE FROM sessions WHERE expires_at <= ?", (time.time(),)).rowcount
+
+    def create(self, session_id, question, personas, memory_strategy):
+        purged = self.purge_expired()
+        if purged:
+            logger.info(f"Evicted {purged} expired improvement sessions")
+        now = time.time()
+        with self._connect() as conn:
+            conn.execute(
+                "INSERT INTO sessions (id, status, question, personas, memory_strategy, created_at, updated_at, "
+                "expires_at) VALUES (?, 'running', ?, ?, ?, ?, ?, ?)",
+                (session_id, question, json.dumps(personas), memory_strategy, now, now, now + self.ttl),
+            )
+
+    def load(self, session_id):
+        """Return a session's row and its completed stages, or raise SessionNotFound."""
+        with self._connect() as conn:
+            row = conn.execute("SELECT * FROM sessions WHERE id = ? AND expires_at > ?",
+                               (session_id, time.time())).fetchone()
+            if row is None:
+                raise SessionNotFound(session_id)
+            stages = conn.execute(
+                "SELECT stage, content FROM session_stages WHERE session_id = ? ORDER BY completed_at", (session_id,)
+            ).fetchall()
+        return row, {stage["stage"]: json.loads(stage["content"]) for stage in stages}
+
+    def save_stage(self, session_id, stage, content, memory=None):
+        """Record a completed stage and, if given, the conversation memory after it, in one transaction."""
+        now = time.time()
+        with self._connect() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO session_stages (session_id, stage, content, completed_at) VALUES (?, ?, ?, ?)",
+                (session_id, stage, json.dumps(content), now),
+            )
+            if memory is not None:
+                conn.execute("UPDATE sessions SET memory = ?, updated_at = ?, expires_at = ? WHERE id = ?",
+                             (json.dumps(memory), now, now + self.ttl, session_id))
+            else:
+                conn.execute("UPDATE sessions SET updated_at = ?, expires_at = ? WHERE id = ?",
+                             (now, now + self.ttl, session_id))
+
+    def set_status(self, session_id, status, result=None, error=None):
+        now = time.time()
+        with self._connect() as conn:
+            conn.execute(
+                "UPDATE sessions SET status = ?, result = ?, error = ?, updated_at = ?, expires_at = ? WHERE id = ?",
+                (status, json.dumps(result) if result is not None else None, error, now, now + self.ttl, session_id),
+            )
+
+    def session(self, session_id):
+        """Return a session's status, the stages completed so far, and its result once completed."""
+        row, stages = self.load(session_id)
+        return {
+            "sessionId": row["id"],
+            "status": row["status"],
+            "question": row["question"],
+            "personas": json.loads(row["personas"]),
+            "memoryStrategy": row["memory_strategy"],
+            "completedStages": list(stages),
+            "stages": stages,
+            "result": json.loads(row["result"]) if row["result"] is not None else None,
+            "error": row["error"],
+            "createdAt": row["created_at"],
+            "updatedAt": row["updated_at"],
+            "expiresAt": row["expires_at"],
+        }
+
+
+class SessionCheckpoint:
+    """One run of a session's pipeline: what earlier runs completed, and where this run saves its stages."""
+
+    def __init__(self, store, session_id, question, personas, memory_strategy, stages=None, memory=None):
+        self.store = store
+        self.session_id = session_id
+        self.question = question
+        self.personas = personas
+        self.memory_strategy = memory_strategy
+        # Stage name -> output, for every stage completed by this or an earlier run
+        self.stages = dict(stages or {})
+        # Conversation memory state after the last completed stage that changed it
+        self.memory = memory
+        self.resumed = list(self.stages)
+
+    async def save(self, stage, content, memory=None):
+        await asyncio.to_thread(self.store.save_stage, self.session_id, stage, content, memory)
+        self.stages[stage] = content
+
+
+class SessionManager:
+    """Opens sessions for new and resumed improvements and records how each run ends."""
+
+    def __init__(self, store):
+        self.store = store
+        # Per-session locks, so two requests for one session never run its stages at the same time
+        self._locks = weakref.WeakValueDictionary()
+
+    async def session(self, session_id):
+        return await asyncio.to_thread(self.store.session, session_id)
+
+    async def open(self, session_id, question=None, personas=None, memory_strategy=None):
+        """
+        Resume a session, or create it if it does not exist yet.
+
+        A resumed session keeps its own question, personas and memory strategy; any of
+        these sent again must match them. Creating a session needs the question and personas.
+        The question is stored and compared without surrounding whitespace, as the request
+        coalescing key treats it.
+        """
+        question = question.strip() if question else question
+        try:
+            row, stages = await asyncio.to_thread(self.store.load, session_id)
+        except SessionNotFound:
+            if not question or not personas:
+                raise
+            await asyncio.to_thread(self.store.create, session_id, question, personas, memory_strategy)
+            logger.info(f"Started improvement session {session_id}")
+            return SessionCheckpoint(self.store, session_id, question, personas, memory_strategy)
+        stored_personas = json.loads(row["personas"])
+        for name, sent, stored in (("question", question, row["question"].strip()), ("personas", personas, stored_personas),
+                                   ("memory strategy", memory_strategy, row["memory_strategy"])):
+            if sent and sent != stored:
+                raise SessionConflict(f"Session {session_id} was started with a different {name}")
+        await asyncio.to_thread(self.store.set_status, session_id, "running")
+        logger.info(f"Resuming improvement session {session_id} after {len(stages)} completed stages")
+        memory = json.loads(row["memory"]) if row["memory"] is not None else None
+        return SessionCheckpoint(self.store, session_id, row["question"], stored_personas, row["memory_strategy"],
+                                 stages, memory)
+
+    async def run(self, session_id, pipeline, question=None, personas=None, memory_strategy=None):
+        """Open the session and await `pipeline(checkpoint)`, recording its result or error on the session."""
+        lock = self._locks.get(session_id)
+        if lock is None:
+            lock = self._locks[session_id] = asyncio.Lock()
+        async with lock:
+            checkpoint = await self.open(session_id, question, personas, memory_strategy)
+            try:
+                result = await pipeline(checkpoint)
+            except asyncio.CancelledError:
+                await asyncio.to_thread(self.store.set_status, session_id, "interrupted")
+                raise
+            except Exception as e:
+                await asyncio.to_thread(self.store.set_status, session_id, "failed", error=str(e))
+                raise
+            await asyncio.to_thread(self.store.set_status, session_id, "completed", result=result)
+            return result
@@ -0,0 +1,110 @@
+"""
+Write-behind aggregation of library view and vote counters.
+
+Viewing or upvoting an entry only bumps an in-memory counter. Pending increments
+are handed to the library writer as one mutation when the flush interval elapses or
+when enough increments have piled up, and once more on shutdown. Reads add the
+pending increments, and any still being committed, on top of the stored counts, so
+clients always see up-to-date numbers.
+"""
+import asyncio
+import logging
+import os
+
+logger = logging.getLogger(__name__)
+
+LIBRARY_COUNTER_FLUSH_INTERVAL = float(os.getenv("LIBRARY_COUNTER_FLUSH_INTERVAL", "2.0"))
+LIBRARY_COUNTER_MAX_PENDING = int(os.getenv("LIBRARY_COUNTER_MAX_PENDING", "1000"))
+
+
+class CounterAggregator:
+    """Buffers vote/view increments per entry and flushes them through the library writer in batches."""
+
+    def __init__(self, writer, flush_interval=LIBRARY_COUNTER_FLUSH_INTERVAL,
+                 max_pending=LIBRARY_COUNTER_MAX_PENDING):
+        self.writer = writer
+        self.flush_interval = flush_interval
+        self.max_pending = max_pending
+        # entry id -> [votes, views] not yet handed to the writer
+        self._pending = {}
+        self._pending_count = 0
+        # Batches handed to the writer but not yet committed
+        self._in_flight = []
+        self._task = None
+        self.flushes = 0
+
+    @property
+    def write_through(self):
+        """A non-positive flush interval disables buffering."""
+        return self.flush_interval <= 0
+
+    def start(self):
+        if self.write_through or self._task is not None:
+            return
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """Stop the flush loop and write out everything still pending."""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        await self.flush()
+
+    async def add(self, entry_id, votes=0, views=0):
+        if self.write_through:
+            await self.writer.apply_increments({entry_id: (votes, views)})
+            return
+        counts = self._pending.setdefault(entry_id, [0, 0])
+        counts[0] += votes
+        counts[1] += views
+        self._pending_count += 1
+        if self._pending_count >= self.max_pending:
+            await self.flush()
+
+    def pending_for(self, entry_id):
+        votes = views = 0
+        for batch in (self._pending, *self._in_flight):
+            counts = batch.get(entry_id)
+            if counts:
+                votes += counts[0]
+                views += counts[1]
+        return votes, views
+
+    def overlay(self, entry, fields=None):
+        """Add uncommitted increments to an entry read from the repository (in place), limited to `fields` if given."""
+        votes, views = self.pending_for(entry["id"])
+        if votes and (fields is None or "votes" in fields):
+            entry["votes"] = entry.get("votes", 0) + votes
+        if views and (fields is None or "views" in fields):
+            entry["views"] = entry.get("views", 0) + views
+        return entry
+
+    async def flush(self):
+        """Commit all pending increments as one writer mutation."""
+        if not self._pending:
+            return 0
+        pending, self._pending = self._pending, {}
+        self._pending_count = 0
+        self._in_flight.append(pending)
+        try:
+            await self.writer.apply_increments({entry_id: tuple(counts) for entry_id, counts in pending.items()})
+        except Exception as e:
+            logger.error(f"Failed to flush library counters, keeping them for the next flush: {str(e)}")
+            for entry_id, (votes, views) in pending.items():
+                counts = self._pending.setdefault(entry_id, [0, 0])
+                counts[0] += votes
+                counts[1] += views
+            return 0
+        finally:
+            self._in_flight.remove(pending)
+        self.flushes += 1
+        return len(pending)
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            await self.flush()
@@ -0,0 +1,96 @@
+"""
+Full-text search over the question library.
+
+The library database carries an SQLite FTS5 inverted index with one row per entry
+(rowid = entry id) over the original and refined questions, the best answer, the
+individual expert answers and the tags. The index is written in the same transaction
+as the entry itself, so each submission updates it incrementally; nothing is ever
+rebuilt. Queries are ranked with BM25, weighting the questions and tags above the
+long answer texts, and each hit comes with a highlighted snippet.
+"""
+import html
+import os
+import re
+
+LIBRARY_SEARCH_LIMIT = int(os.getenv("LIBRARY_SEARCH_LIMIT", "20"))
+LIBRARY_SEARCH_MAX_LIMIT = int(os.getenv("LIBRARY_SEARCH_MAX_LIMIT", "100"))
+LIBRARY_SEARCH_SNIPPET_TOKENS = int(os.getenv("LIBRARY_SEARCH_SNIPPET_TOKENS", "16"))
+
+# FTS5 wraps matched terms in these private-use sentinels; snippet_html escapes the
+# entry text and only then turns them into <mark> tags
+SNIPPET_MATCH_START = "\ue000"
+SNIPPET_MATCH_END = "\ue001"
+HIGHLIGHT_START = "<mark>"
+HIGHLIGHT_END = "</mark>"
+
+# Indexed fields, in FTS column order, with their BM25 weights
+SEARCH_COLUMNS = (
+    ("original_question", 4.0),
+    ("refined_question", 4.0),
+    ("best_answer", 1.0),
+    ("individual_answers", 0.5),
+    ("tags", 2.0),
+)
+
+SEARCH_SCHEMA = f"""
+CREATE VIRTUAL TABLE IF NOT EXISTS entries_fts USING fts5 (
+    {', '.join(column for column, _ in SEARCH_COLUMNS)},
+    tokenize = 'porter unicode61 remove_diacritics 2'
+);
+"""
+
+_QUERY_TERM = re.compile(r"\w+", re.UNICODE)
+
+
+def answers_text(individual_answers):
+    """Flatten the individualAnswers field, whichever of its historical shapes it has, to plain text."""
+    if not individual_answers:
+        return ""
+    if isinstance(individual_answers, str):
+        return individual_answers
+    if isinstance(individual_answers, dict):
+        return "\n".join(f"{name}: {answer}" for name, answer in individual_answers.items())
+    parts = []
+    for answer in individual_answers:
+        if isinstance(answer, dict):
+            parts.append(f"{answer.get('name', '')}: {answer.get('answer', '')}")
+        else:
+            parts.append(str(answer))
+    return "\n".join(parts)
+
+
+def search_document(entry):
+    """The FTS column values for an entry, in SEARCH_COLUMNS order."""
+    return (
+        entry.get("originalQuestion") or "",
+        entry.get("refinedQuestion") or "",
+        entry.get("bestAnswer") or "",
+        answers_text(entry.get("individualAnswers")),
+        " ".join(str(tag) for tag in entry.get("tags") or []),
+    )
+
+
+def build_match_query(text):
+    """
+    Turn free text into an FTS5 MATCH expression, or None if it has no searchable terms.
+
+    Every term must match, after the same stemming as the indexed text ("bee" finds
+    "bees"). Terms are quoted, so FTS5 operators in user input are searched for
+    literally rather than interpreted.
+    """
+    terms = _QUERY_TERM.findall(text or "")
+    if not terms:
+        return None
+    return " AND ".join(f'"{term}"' for term in terms)
+
+
+def snippet_html(snippet):
+    """HTML-escape a raw FTS5 snippet, then mark its matched terms with HIGHLIGHT_START/END."""
+    if snippet is None:
+        return None
+    escaped = html.escape(snippet)
+    return escaped.replace(SNIPPET_MATCH_START, HIGHLIGHT_START).replace(SNIPPET_MATCH_END, HIGHLIGHT_END)
+
+
+def bm25_weights():
+    return ", ".join(str(weight) for _, weight in SEARCH_COLUMNS)
@@ -0,0 +1,544 @@
+"""
+Storage for the question library.
+
+Entries live in a SQLite database in WAL mode instead of one JSON file that every
+request rewrites. Each entry is a row keyed by an autoincrementing id, with
+secondary indexes on category, status, date, votes and views. An entry's tags and
+expert personas are also kept in lookup tables so they can be filtered on without
+reading every document. Comments are a separate table, so adding one does not
+rewrite its entry. Entries are also written to the full-text index defined in
+library_search. The existing library_entries.json is imported once, the first time
+the database is opened.
+
+Listings are paginated with keyset cursors: each page ends with the sort value and
+id of its last entry, and the next page starts strictly after that pair, so every
+page is an index range scan no matter how deep it is.
+"""
+import base64
+import json
+import logging
+import os
+import sqlite3
+import threading
+
+from library_search import (
+    LIBRARY_SEARCH_LIMIT,
+    LIBRARY_SEARCH_SNIPPET_TOKENS,
+    SEARCH_COLUMNS,
+    SEARCH_SCHEMA,
+    SNIPPET_MATCH_END,
+    SNIPPET_MATCH_START,
+    bm25_weights,
+    search_document,
+    snippet_html,
+)
+
+logger = logging.getLogger(__name__)
+
+LIBRARY_DB_PATH = os.getenv("LIBRARY_DB_PATH", "library.sqlite3")
+LIBRARY_JSON_PATH = os.getenv("LIBRARY_JSON_PATH", "library_entries.json")
+LIBRARY_BUSY_TIMEOUT_MS = int(os.getenv("LIBRARY_BUSY_TIMEOUT_MS", "5000"))
+LIBRARY_PAGE_SIZE = int(os.getenv("LIBRARY_PAGE_SIZE", "50"))
+LIBRARY_MAX_PAGE_SIZE = int(os.getenv("LIBRARY_MAX_PAGE_SIZE", "200"))
+
+# Entry fields kept in their own columns/tables rather than in the JSON document
+COLUMN_FIELDS = ("id", "votes", "views", "comments", "commentList")
+
+# Sortable fields and the indexed column behind each
+SORT_COLUMNS = {"date": "date", "votes": "votes", "views": "views"}
+
+# Fields returned by the "summary" projection: enough to render a library card
+SUMMARY_FIELDS = (
+    "id",
+    "originalQuestion",
+    "refinedQuestion",
+    "expertPersonas",
+    "category",
+    "tags",
+    "status",
+    "date",
+    "votes",
+    "views",
+    "comments",
+    "impact",
+    "podcast",
+)
+
+# Every field an entry has, and so every name a `fields` projection may ask for
+ENTRY_FIELDS = SUMMARY_FIELDS + ("author", "individualAnswers", "bestAnswer", "commentList")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS entries (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    category TEXT NOT NULL DEFAULT 'General',
+    status TEXT NOT NULL DEFAULT 'user',
+    date TEXT NOT NULL DEFAULT '',
+    votes INTEGER NOT NULL DEFAULT 0,
+    views INTEGER NOT NULL DEFAULT 0,
+    comments INTEGER NOT NULL DEFAULT 0,
+    data TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS entries_category ON entries (category, date);
+CREATE INDEX IF NOT EXISTS entries_date ON entries (date);
+CREATE INDEX IF NOT EXISTS entries_votes ON entries (votes);
+CREATE INDEX IF NOT EXISTS entries_views ON entries (views);
+CREATE INDEX IF NOT EXISTS entries_status ON entries (status, date);
+CREATE INDEX IF NOT EXISTS entries_category_votes ON entries (category, votes);
+CREATE INDEX IF NOT EXISTS entries_category_views ON entries (category, views);
+CREATE INDEX IF NOT EXISTS entries_status_votes ON entries (status, votes);
+CREATE INDEX IF NOT EXISTS entries_status_views ON entries (status, views);
+
+-- Each lookup row carries its entry's date, so a tag or persona page in date order
+-- walks the (term, date) index instead of sorting every matching entry
+CREATE TABLE IF NOT EXISTS entry_tags (
+    tag TEXT NOT NULL,
+    entry_id INTEGER NOT NULL REFERENCES entries (id) ON DELETE CASCADE,
+    date TEXT NOT NULL DEFAULT '',
+    PRIMARY KEY (tag, entry_id)
+) WITHOUT ROWID;
+
+CREATE TABLE IF NOT EXISTS entry_personas (
+    persona TEXT NOT NULL,
+    entry_id INTEGER NOT NULL REFERENCES entries (id) ON DELETE CASCADE,
+    date TEXT NOT NULL DEFAULT '',
+    PRIMARY KEY (persona, entry_id)
+) WITHOUT ROWID;
+
+CREATE TABLE IF NOT EXISTS comments (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    entry_id INTEGER NOT NULL REFERENCES entries (id) ON DELETE CASCADE,
+    data TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS comments_entry ON comments (entry_id, id);
+
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value TEXT NOT NULL
+);
+"""
+
+
+class EntryNotFound(LookupError):
+    """Raised when a library entry id does not exist."""
+
+
+class InvalidCursor(ValueError):
+    """Raised when a pagination cursor is malformed or belongs to a different sort order."""
+
+
+def encode_cursor(sort, descending, value, entry_id):
+    """Opaque cursor pointing just past the entry with this sort value and id."""
+    payload = json.dumps([sort, descending, value, entry_id], separators=(",", ":"))
+    return base64.urlsafe_b64encode(payload.encode()).decode().rstrip("=")
+
+
+def decode_cursor(cursor, sort, descending):
+    """Return the (value, id) pair a cursor points past, checking it matches the requested order."""
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        cursor_sort, cursor_descending, value, entry_id = json.loads(base64.urlsafe_b64decode(padded))
+    except Exception:
+        raise InvalidCursor("Malformed cursor")
+    if cursor_sort != sort or cursor_descending != descending or not isinstance(entry_id, int):
+        raise InvalidCursor("Cursor does not match the requested sort order")
+    return value, entry_id
+
+
+class LibraryRepository:
+    """Library entries, comments and counters stored in SQLite."""
+
+    def __init__(self, path=LIBRARY_DB_PATH):
+        self.path = path
+        self._lock = threading.RLock()
+        self._conn = self.connect()
+        self._conn.executescript(SCHEMA)
+        self._conn.executescript(SEARCH_SCHEMA)
+        self._add_lookup_dates()
+        self._backfill_derived_tables()
+
+    def connect(self):
+        """
+        Open a connection to the library database.
+
+        The repository reads through its own connection; the library writer opens a
+        second one so reads never wait behind a commit. Commits are fully synced, so a
+        committed change survives a crash or power loss.
+        """
+        conn = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None)
+        conn.row_factory = sqlite3.Row
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=FULL")
+        conn.execute("PRAGMA foreign_keys=ON")
+        conn.execute(f"PRAGMA busy_timeout={LIBRARY_BUSY_TIMEOUT_MS}")
+        return conn
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+    def transaction(self):
+        """Context manager running the enclosed statements as one atomic write."""
+        return _Transaction(self)
+
+    # Migration
+
+    def migrate_from_json(self, json_path=LIBRARY_JSON_PATH):
+        """Import library_entries.json once; later calls are no-ops. Returns the number of entries imported."""
+        with self.transaction() as conn:
+            if conn.execute("SELECT 1 FROM meta WHERE key = 'migrated_from_json'").fetchone():
+                return 0
+            imported = 0
+            if os.path.exists(json_path):
+                try:
+                    with open(json_path, 'r') as f:
+                        library_data = json.load(f)
+                except json.JSONDecodeError:
+                    logger.error(f"Error parsing {json_path}, skipping library migration")
+                    library_data = {"entries": []}
+                for entry in library_data.get("entries", []):
+                    self.insert_entry(conn, entry, entry_id=entry.get("id"))
+                    imported += 1
+            conn.execute("INSERT INTO meta (key, value) VALUES ('migrated_from_json', ?)", (json_path,))
+        logger.info(f"Migrated {imported} library entries from {json_path} into {self.path}")
+        return imported
+
+    # Writes, each in its own transaction on the repository connection. The server
+    # routes its writes through LibraryWriter instead, which batches the mutations
+    # below into shared transactions.
+
+    def add_entry(self, entry):
+        """Insert a new entry and return its generated id."""
+        with self.transaction() as conn:
+            return self.insert_entry(conn, entry)
+
+    def add_entries(self, entries):
+        """Insert many entries in one transaction and return their generated ids."""
+        with self.transaction() as conn:
+            return [self.insert_entry(conn, entry) for entry in entries]
+
+    def add_comment(self, entry_id, comment):
+        """Attach a comment to an entry and return the comment's generated id."""
+        with self.transaction() as conn:
+            return self.insert_comment(conn, entry_id, comment)
+
+    def apply_increments(self, increments):
+        """Add {entry_id: (votes, views)} to the stored counters in one transaction."""
+        with self.transaction() as conn:
+            self.increment_counters(conn, increments)
+
+    # Mutations, run inside a transaction the caller owns on the given connection
+
+    def insert_entry(self, conn, entry, entry_id=None):
+        """Insert an entry with its comments, lookup terms and search document; returns its id."""
+        document = {key: value for key, value in entry.items() if key not in COLUMN_FIELDS}
+        comment_list = entry.get("commentList") or []
+        cursor = conn.execute(
+            "INSERT INTO entries (id, category, status, date, votes, views, comments, data) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+            (
+                entry_id,
+                entry.get("category") or "General",
+                entry.get("status") or "user",
+                entry.get("date") or "",
+                entry.get("votes", 0),
+                entry.get("views", 0),
+                entry.get("comments", len(comment_list)),
+                json.dumps(document),
+            ),
+        )
+        new_id = cursor.lastrowid
+        self._index_lookup_terms(conn, new_id, document, entry.get("date") or "")
+        self._index_search_document(conn, new_id, document)
+        for comment in comment_list:
+            self._insert_comment(conn, new_id, comment, comment_id=comment.get("id"))
+        return new_id
+
+    def insert_comment(self, conn, entry_id, comment):
+        """Attach a comment and bump the entry's comment count; raises EntryNotFound."""
+        if not conn.execute("SELECT 1 FROM entries WHERE id = ?", (entry_id,)).fetchone():
+            raise EntryNotFound(entry_id)
+        comment_id = self._insert_comment(conn, entry_id, comment)
+        conn.execute("UPDATE entries SET comments = comments + 1 WHERE id = ?", (entry_id,))
+        return comment_id
+
+    @staticmethod
+    def increment_counters(conn, increments):
+        """Add {entry_id: (votes, views)} to the stored counters."""
+        conn.executemany(
+            "UPDATE entries SET votes = votes + ?, views = views + ? WHERE id = ?",
+            [(votes, views, entry_id) for entry_id, (votes, views) in increments.items()],
+        )
+
+    # Reads
+
+    def exists(self, entry_id):
+        with self._lock:
+            return self._conn.execute("SELECT 1 FROM entries WHERE id = ?", (entry_id,)).fetchone() is not None
+
+    def get_entry(self, entry_id):
+        """Return one entry with its comments, or raise EntryNotFound."""
+        with self._lock:
+            row = self._conn.execute("SELECT * FROM entries WHERE id = ?", (entry_id,)).fetchone()
+            if row is None:
+                raise EntryNotFound(entry_id)
+            return self._row_to_entry(row, self._comments_for([entry_id]).get(entry_id, []))
+
+    def list_entries(self):
+        """Return every entry with its comments, oldest first."""
+        with self._lock:
+            rows = self._conn.execute("SELECT * FROM entries ORDER BY date, id").fetchall()
+            comments = self._comments_for([row["id"] for row in rows])
+            return [self._row_to_entry(row, comments.get(row["id"], [])) for row in rows]
+
+    def query_entries(self, category=None, tag=None, status=None, persona=None, sort="date",
+                      descending=True, limit=LIBRARY_PAGE_SIZE, cursor=None, fields=None):
+        """
+        Return one page of entries and the cursor for the next page (None on the last page).
+
+        Filters are exact matches and combine with AND. `fields` limits each entry to the
+        named fields (the id is always included); None returns whole entries with comments.
+        """
+        column = SORT_COLUMNS.get(sort)
+        if column is None:
+            raise ValueError(f"Unknown sort field '{sort}'. Expected one of: {', '.join(SORT_COLUMNS)}")
+        direction = "DESC" if descending else "ASC"
+
+        conditions, params = [], []
+        source, sort_value, sort_id = "entries e", f"e.{column}", "e.id"
+        lookups = [(table, key, value) for table, key, value in
+                   (("entry_tags", "tag", tag), ("entry_personas", "persona", persona)) if value is not None]
+        if lookups and column == "date":
+            # Walk the lookup table's (term, date) index in page order rather than
+            # sorting every entry with the tag or persona
+            table, key, value = lookups.pop(0)
+            source = f"{table} l JOIN entries e ON e.id = l.entry_id"
+            sort_value, sort_id = "l.date", "l.entry_id"
+            conditions.append(f"l.{key} = ?")
+            params.append(value)
+        if category is not None:
+            conditions.append("e.category = ?")
+            params.append(category)
+        if status is not None:
+            conditions.append("e.status = ?")
+            params.append(status)
+        for table, key, value in lookups:
+            conditions.append(f"EXISTS (SELECT 1 FROM {table} WHERE {key} = ? AND entry_id = e.id)")
+            params.append(value)
+        if cursor is not None:
+            value, entry_id = decode_cursor(cursor, sort, descending)
+            conditions.append(f"({sort_value}, {sort_id}) {'<' if descending else '>'} (?, ?)")
+            params.extend([value, entry_id])
+        where = f"WHERE {' AND '.join(conditions)} " if conditions else ""
+
+        if fields is None:
+            select = "e.*"
+        else:
+            fields = ["id"] + [field for field in dict.fromkeys(fields) if field != "id"]
+            document_fields = [field for field in fields if field not in COLUMN_FIELDS]
+            select = f"e.id AS id, {sort_value} AS sort_value, e.votes AS votes, e.views AS views, e.comments AS comments"
+            if document_fields:
+                pairs = ", ".join("?, json_extract(e.data, ?)" for _ in document_fields)
+                select += f", json_object({pairs}) AS data"
+                params[:0] = [arg for field in document_fields for arg in (field, _json_path(field))]
+
+        with self._lock:
+            rows = self._conn.execute(
+                f"SELECT {select} FROM {source} {where}"
+                f"ORDER BY {sort_value} {direction}, {sort_id} {direction} LIMIT ?",
+                params + [limit + 1],
+            ).fetchall()
+            more = len(rows) > limit
+            rows = rows[:limit]
+            wants_comments = fields is None or "commentList" in fields
+            comments = self._comments_for([row["id"] for row in rows]) if wants_comments else {}
+
+        if fields is None:
+            entries = [self._row_to_entry(row, comments.get(row["id"], [])) for row in rows]
+        else:
+            entries = [self._row_to_projection(row, fields, comments) for row in rows]
+
+        next_cursor = None
+        if more and rows:
+            last = rows[-1]
+            next_cursor = encode_cursor(sort, descending, last[column] if fields is None else last["sort_value"], last["id"])
+        return entries, next_cursor
+
+    def search(self, match_query, category=None, limit=LIBRARY_SEARCH_LIMIT, offset=0):
+        """
+        Rank entries against an FTS5 MATCH expression (see library_search.build_match_query).
+
+        Returns card fields for each hit plus an HTML-escaped snippet with the matched
+        terms in <mark> tags, and its BM25 score (higher is better), best first.
+        """
+        # FTS5 yields hits already ordered by rank, so the join can stop at the limit;
+        # a category filter is applied in the join rather than as a rowid subquery,
+        # which would make FTS5 materialize and sort every hit
+        params = [SNIPPET_MATCH_START, SNIPPET_MATCH_END, LIBRARY_SEARCH_SNIPPET_TOKENS, match_query, f"bm25({bm25_weights()})"]
+        category_filter = ""
+        if category is not None:
+            category_filter = "AND e.category = ? "
+            params.append(category)
+        params.extend([limit, offset])
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT e.id, e.category, e.status, e.date, e.votes, e.views, e.comments, "
+                "json_extract(e.data, '$.originalQuestion') AS original_question, "
+                "json_extract(e.data, '$.refinedQuestion') AS refined_question, "
+                "json_extract(e.data, '$.tags') AS tags, "
+                "snippet(entries_fts, -1, ?, ?, '…', ?) AS snippet, entries_fts.rank "
+                "FROM entries_fts JOIN entries e ON e.id = entries_fts.rowid "
+                f"WHERE entries_fts MATCH ? AND entries_fts.rank MATCH ? {category_filter}"
+                "ORDER BY entries_fts.rank LIMIT ? OFFSET ?",
+                params,
+            ).fetchall()
+        return [
+            {
+                "id": row["id"],
+                "originalQuestion": row["original_question"],
+                "refinedQuestion": row["refined_question"],
+                "category": row["category"],
+                "status": row["status"],
+                "tags": json.loads(row["tags"]) if row["tags"] else [],
+                "date": row["date"],
+                "votes": row["votes"],
+                "views": row["views"],
+                "comments": row["comments"],
+                "snippet": snippet_html(row["snippet"]),
+                "score": round(-row["rank"], 6),
+            }
+            for row in rows
+        ]
+
+    def count(self):
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM entries").fetchone()[0]
+
+    # Helpers
+
+    @staticmethod
+    def _index_lookup_terms(conn, entry_id, document, date):
+        tags = document.get("tags") or []
+        personas = document.get("expertPersonas") or []
+        conn.executemany("INSERT OR IGNORE INTO entry_tags (tag, entry_id, date) VALUES (?, ?, ?)",
+                         [(str(tag), entry_id, date) for tag in tags])
+        conn.executemany("INSERT OR IGNORE INTO entry_personas (persona, entry_id, date) VALUES (?, ?, ?)",
+                         [(str(persona), entry_id, date) for persona in personas])
+
+    @staticmethod
+    def _index_search_document(conn, entry_id, document):
+        columns = ", ".join(column for column, _ in SEARCH_COLUMNS)
+        conn.execute(
+            f"INSERT INTO entries_fts (rowid, {columns}) VALUES (?{', ?' * len(SEARCH_COLUMNS)})",
+            (entry_id, *search_document(document)),
+        )
+
+    def _add_lookup_dates(self):
+        """Give lookup tables created before they carried entry dates a date column, and index it."""
+        with self.transaction() as conn:
+            for table, key in (("entry_tags", "tag"), ("entry_personas", "persona")):
+                columns = {row["name"] for row in conn.execute(f"PRAGMA table_info({table})").fetchall()}
+                if "date" not in columns:
+                    conn.execute(f"ALTER TABLE {table} ADD COLUMN date TEXT NOT NULL DEFAULT ''")
+                    conn.execute(f"UPDATE {table} SET date = (SELECT date FROM entries WHERE id = entry_id)")
+                    logger.info(f"Added entry dates to {table}")
+                conn.execute(f"CREATE INDEX IF NOT EXISTS {table}_date ON {table} ({key}, date)")
+
+    def _backfill_derived_tables(self):
+        """Fill lookup and search tables for entries stored before those tables existed (once per table)."""
+        indexers = {
+            "lookup_tables": self._index_lookup_terms,
+            "search_index": lambda conn, entry_id, document, date: self._index_search_document(
+                conn, entry_id, document),
+        }
+        with self.transaction() as conn:
+            done = {row["key"] for row in conn.execute("SELECT key FROM meta").fetchall()}
+            pending = {key: indexer for key, indexer in indexers.items() if key not in done}
+            if not pending:
+                return
+            for row in conn.execute("SELECT id, date, data FROM entries").fetchall():
+                document = json.loads(row["data"])
+                for indexer in pending.values():
+                    indexer(conn, row["id"], document, row["date"])
+            conn.executemany("INSERT INTO meta (key, value) VALUES (?, '1')", [(key,) for key in pending])
+
+    def _insert_comment(self, conn, entry_id, comment, comment_id=None):
+        document = {key: value for key, value in comment.items() if key not in ("id", "entryId")}
+        cursor = conn.execute(
+            "INSERT INTO comments (id, entry_id, data) VALUES (?, ?, ?)",
+            (comment_id, entry_id, json.dumps(document)),
+        )
+        return cursor.lastrowid
+
+    def _comments_for(self, entry_ids):
+        comments = {}
+        if not entry_ids:
+            return comments
+        # Chunk the id list to stay under SQLite's bound-parameter limit
+        for start in range(0, len(entry_ids), 500):
+            chunk = entry_ids[start:start + 500]
+            rows = self._conn.execute(
+                f"SELECT id, entry_id, data FROM comments WHERE entry_id IN ({','.join('?' * len(chunk))}) "
+                "ORDER BY entry_id, id",
+                chunk,
+            ).fetchall()
+            for row in rows:
+                comments.setdefault(row["entry_id"], []).append(
+                    {"id": row["id"], "entryId": row["entry_id"], **json.loads(row["data"])}
+                )
+        return comments
+
+    @staticmethod
+    def _row_to_entry(row, comment_list):
+        entry = json.loads(row["data"])
+        entry.update({
+            "id": row["id"],
+            "votes": row["votes"],
+            "views": row["views"],
+            "comments": row["comments"],
+            "commentList": comment_list,
+        })
+        return entry
+
+    @staticmethod
+    def _row_to_projection(row, fields, comments):
+        document = json.loads(row["data"]) if "data" in row.keys() else {}
+        entry = {}
+        for field in fields:
+            if field == "commentList":
+                entry[field] = comments.get(row["id"], [])
+            elif field in COLUMN_FIELDS:
+                entry[field] = row[field]
+            elif document.get(field) is not None:
+                entry[field] = document[field]
+        return entry
+
+
+def _json_path(field):
+    """JSON path selecting a top-level key, quoted so any field name is taken literally."""
+    return '$."' + field.replace('"', '') + '"'
+
+
+class _Transaction:
+    """BEGIN IMMEDIATE ... COMMIT on the repository connection, rolled back on error."""
+
+    def __init__(self, repository):
+        self.repository = repository
+
+    def __enter__(self):
+        self.repository._lock.acquire()
+        try:
+            self.repository._conn.execute("BEGIN IMMEDIATE")
+        except Exception:
+            self.repository._lock.release()
+            raise
+        return self.repository._conn
+
+    def __exit__(self, exc_type, exc, tb):
+        try:
+            if exc_type is None:
+                self.repository._conn.execute("COMMIT")
+            else:
+                self.repository._conn.execute("ROLLBACK")
+        finally:
+            self.repository._lock.release()
+        return False
@@ -0,0 +1,134 @@
+"""
+Single writer for the question library.
+
+Every library mutation (new entries, comments and counter flushes) goes through one
+LibraryWriter. Mutations are queued, and a single writer task takes whatever has
+arrived within a short batching window and runs it as one transaction on its own
+connection, in a dedicated thread so the event loop keeps serving reads while the
+commit syncs to disk. Each mutation runs under a savepoint, so one that fails (say, a
+comment on a missing entry) is rolled back on its own without failing the rest of the
+batch. Callers are resumed only after the transaction holding their change has
+committed, so a returned result means the change is durable.
+"""
+import asyncio
+import logging
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+from metrics import LIBRARY_OPERATION_SECONDS, LIBRARY_WRITE_BATCH_SIZE
+
+logger = logging.getLogger(__name__)
+
+LIBRARY_WRITE_BATCH_WINDOW = float(os.getenv("LIBRARY_WRITE_BATCH_WINDOW", "0"))
+LIBRARY_WRITE_MAX_BATCH = int(os.getenv("LIBRARY_WRITE_MAX_BATCH", "256"))
+
+
+class LibraryWriter:
+    """Serializes library mutations and group-commits them in batches."""
+
+    def __init__(self, repository, batch_window=LIBRARY_WRITE_BATCH_WINDOW, max_batch=LIBRARY_WRITE_MAX_BATCH):
+        self.repository = repository
+        self.batch_window = batch_window
+        self.max_batch = max_batch
+        self._queue = None
+        self._task = None
+        self._executor = None
+        self._conn = None
+        self._closing = False
+        self.commits = 0
+        self.mutations = 0
+
+    def start(self):
+        if self._task is not None:
+            return
+        self._closing = False
+        self._conn = self.repository.connect()
+        self._queue = asyncio.Queue()
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="library-writer")
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """Commit everything already queued, then stop the writer."""
+        if self._task is None:
+            return
+        self._closing = True
+        await self._queue.put(None)
+        await self._task
+        self._task = None
+        self._executor.shutdown()
+        self._conn.close()
+
+    async def submit(self, mutation):
+        """Queue mutation(conn) and return its result once it has been committed."""
+        if self._task is None or self._closing:
+            raise RuntimeError("Library writer is not running")
+        future = asyncio.get_running_loop().create_future()
+        await self._queue.put((mutation, future))
+        return await future
+
+    async def add_entry(self, entry):
+        return await self.submit(lambda conn: self.repository.insert_entry(conn, entry))
+
+    async def add_comment(self, entry_id, comment):
+        return await self.submit(lambda conn: self.repository.insert_comment(conn, entry_id, comment))
+
+    async def apply_increments(self, increments):
+        return await self.submit(lambda conn: self.repository.increment_counters(conn, increments))
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        stopping = False
+        while not stopping:
+            item = await self._queue.get()
+            if item is None:
+                break
+            batch = [item]
+            # Let concurrent writers join this commit: anything queued while the previous
+            # commit was syncing is already here, and the window can wait a little longer
+            await asyncio.sleep(self.batch_window)
+            while len(batch) < self.max_batch and not self._queue.empty():
+                item = self._queue.get_nowait()
+                if item is None:
+                    stopping = True
+                    break
+                batch.append(item)
+
+            LIBRARY_WRITE_BATCH_SIZE.observe(len(batch))
+            try:
+                with LIBRARY_OPERATION_SECONDS.time(operation="commit"):
+                    outcomes = await loop.run_in_executor(self._executor, self._commit, [m for m, _ in batch])
+            except Exception as e:
+                logger.error(f"Library write batch of {len(batch)} failed to commit: {str(e)}")
+                outcomes = [(False, e)] * len(batch)
+            else:
+                self.commits += 1
+                self.mutations += len(batch)
+
+            for (_, future), (ok, value) in zip(batch, outcomes):
+                if future.done():
+                    continue
+                if ok:
+                    future.set_result(value)
+                else:
+                    future.set_exception(value)
+
+    def _commit(self, mutations):
+        """Run a batch of mutations in one transaction (writer thread). Returns (ok, result or error) per mutation."""
+        conn = self._conn
+        outcomes = []
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            for mutation in mutations:
+                conn.execute("SAVEPOINT mutation")
+                try:
+                    outcomes.append((True, mutation(conn)))
+                except Exception as e:
+                    conn.execute("ROLLBACK TO mutation")
+                    outcomes.append((False, e))
+                conn.execute("RELEASE mutation")
+            conn.execute("COMMIT")
+        except BaseException:
+            if conn.in_transaction:
+                conn.execute("ROLLBACK")
+            raise
+        return outcomes
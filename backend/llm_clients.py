@@ -0,0 +1,108 @@
+"""
+Process-wide registry of chat model clients.
+
+All chat models handed out by the registry share one pooled async HTTP client, so
+requests reuse keep-alive connections to the provider instead of paying connection
+and TLS setup on every call. The registry is started on application startup and
+closed on shutdown.
+
+LLM_BACKEND selects what the models talk to: "openai" (the default) calls the
+provider; "record" calls it too and records every response into a cassette; "replay"
+answers from that cassette offline (see llm_replay).
+
+Given an LLMScheduler, every model's calls also wait for the scheduler's admission
+(shared rate limits, concurrency cap and fair queueing; see llm_scheduler). The
+provider client does not retry on its own: call_llm (see llm_resilience) owns
+timeouts, retries, hedging and the circuit breaker.
+"""
+import asyncio
+import os
+import logging
+import httpx
+from langchain_openai import ChatOpenAI
+
+from llm_replay import LLM_CASSETTE_PATH, Cassette, RecordingChatModel, ReplayChatModel
+from llm_scheduler import ScheduledChatModel
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_MODEL = "o3-mini"
+
+LLM_POOL_MAX_CONNECTIONS = int(os.getenv("LLM_POOL_MAX_CONNECTIONS", "100"))
+LLM_POOL_MAX_KEEPALIVE = int(os.getenv("LLM_POOL_MAX_KEEPALIVE", "20"))
+LLM_POOL_KEEPALIVE_EXPIRY = float(os.getenv("LLM_POOL_KEEPALIVE_EXPIRY", "60"))
+LLM_REQUEST_TIMEOUT = float(os.getenv("LLM_REQUEST_TIMEOUT", "600"))
+LLM_BACKEND = os.getenv("LLM_BACKEND", "openai")
+LLM_BACKENDS = ("openai", "record", "replay")
+
+
+class LLMClientRegistry:
+    """Create chat models on demand, all backed by a single pooled HTTP client."""
+
+    def __init__(self, api_key, base_url=None,
+                 max_connections=LLM_POOL_MAX_CONNECTIONS,
+                 max_keepalive_connections=LLM_POOL_MAX_KEEPALIVE,
+                 keepalive_expiry=LLM_POOL_KEEPALIVE_EXPIRY,
+                 timeout=LLM_REQUEST_TIMEOUT,
+                 backend=LLM_BACKEND,
+                 cassette_path=LLM_CASSETTE_PATH,
+                 scheduler=None):
+        if backend not in LLM_BACKENDS:
+            raise ValueError(f"Unknown LLM backend '{backend}'. Expected one of: {', '.join(LLM_BACKENDS)}")
+        self.api_key = api_key
+        self.backend = backend
+        self.cassette = Cassette(cassette_path) if backend != "openai" else None
+        self.scheduler = scheduler
+        self.base_url = base_url or os.getenv("OPENAI_BASE_URL")
+        self.limits = httpx.Limits(
+            max_connections=max_connections,
+            max_keepalive_connections=max_keepalive_connections,
+            keepalive_expiry=keepalive_expiry,
+        )
+        self.timeout = timeout
+        self._http_client = None
+        self._models = {}
+
+    def start(self):
+        """Open the shared connection pool."""
+        if self._http_client is None:
+            self._http_client = httpx.AsyncClient(limits=self.limits, timeout=self.timeout)
+            logger.info(f"LLM client pool started (max_connections={self.limits.max_connections}, "
+                        f"max_keepalive={self.limits.max_keepalive_connections}, "
+                        f"keepalive_expiry={self.limits.keepalive_expiry}s)")
+
+    async def close(self):
+        """Drop cached models, write out any recorded interactions and close the shared connection pool."""
+        self._models.clear()
+        if self.cassette is not None:
+            await asyncio.to_thread(self.cassette.flush)
+        if self._http_client is not None:
+            await self._http_client.aclose()
+            self._http_client = None
+            logger.info("LLM client pool closed")
+
+    def get_chat_model(self, model=DEFAULT_MODEL, temperature=1):
+        """Return the shared chat model for this model/temperature pair."""
+        if self._http_client is None:
+            self.start()
+        key = (model, temperature)
+        chat = self._models.get(key)
+        if chat is None:
+            if self.backend == "replay":
+                chat = ReplayChatModel(cassette=self.cassette, model_name=model)
+            else:
+                chat = ChatOpenAI(
+                    model=model,
+                    temperature=temperature,
+                    openai_api_key=self.api_key,
+                    base_url=self.base_url,
+                    http_async_client=self._http_client,
+                    # Retries, with jittered backoff and a circuit breaker, happen in llm_resilience
+                    max_retries=0,
+                )
+                if self.backend == "record":
+                    chat = RecordingChatModel(inner=chat, cassette=self.cassette, model_name=model)
+            if self.scheduler is not None:
+                chat = ScheduledChatModel(inner=chat, scheduler=self.scheduler)
+            self._models[key] = chat
+        return chat
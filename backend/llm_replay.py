@@ -0,0 +1,189 @@
+"""
+Record/replay chat models for running the pipeline without a live provider.
+
+A cassette is a JSON file of recorded LLM interactions keyed by the SHA-256 of the
+model name and the prompt exactly as sent. RecordingChatModel wraps a real chat
+model and records every response, along with how long it took, into a cassette.
+ReplayChatModel answers from a cassette with no network access at all, streaming the
+recorded text back with synthetic latency: either the latency captured at recording
+time (scaled) or a fixed per-call delay, spread between time to first token and the
+remaining chunks.
+
+Select the backend with LLM_BACKEND (see llm_clients).
+"""
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import tempfile
+import threading
+import time
+from typing import Any, List
+
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import AIMessage, AIMessageChunk, get_buffer_string
+from langchain_core.outputs import ChatGeneration, ChatGenerationChunk, ChatResult
+
+logger = logging.getLogger(__name__)
+
+LLM_CASSETTE_PATH = os.getenv("LLM_CASSETTE_PATH", "cassettes/llm_cassette.json")
+# "recorded" replays each interaction's recorded latency; a number is a fixed delay in seconds per call
+LLM_REPLAY_LATENCY = os.getenv("LLM_REPLAY_LATENCY", "recorded")
+LLM_REPLAY_LATENCY_SCALE = float(os.getenv("LLM_REPLAY_LATENCY_SCALE", "1.0"))
+# Share of a call's latency spent before the first token; the rest is spread over the chunks
+LLM_REPLAY_FIRST_TOKEN_SHARE = float(os.getenv("LLM_REPLAY_FIRST_TOKEN_SHARE", "0.3"))
+LLM_REPLAY_CHUNK_CHARS = int(os.getenv("LLM_REPLAY_CHUNK_CHARS", "16"))
+
+
+class CassetteMiss(LookupError):
+    """Raised when a replayed prompt was never recorded."""
+
+
+def prompt_key(model, prompt_text):
+    return hashlib.sha256(f"{model}\n{prompt_text}".encode("utf-8")).hexdigest()
+
+
+class Cassette:
+    """
+    Recorded interactions in a JSON file.
+
+    New interactions are kept in memory and written out, atomically, by flush(); the
+    client registry flushes its cassette when it closes at shutdown.
+    """
+
+    def __init__(self, path=LLM_CASSETTE_PATH):
+        self.path = path
+        self._lock = threading.Lock()
+        self.interactions = {}
+        self._unsaved = 0
+        if os.path.exists(path):
+            with open(path, "r") as f:
+                self.interactions = json.load(f).get("interactions", {})
+            logger.info(f"Loaded {len(self.interactions)} recorded LLM interactions from {path}")
+
+    def get(self, key):
+        return self.interactions.get(key)
+
+    def record(self, key, model, prompt_text, response, latency):
+        with self._lock:
+            self.interactions[key] = {
+                "model": model,
+                "prompt_preview": prompt_text[:200],
+                "response": response,
+                "latency": round(latency, 4),
+            }
+            self._unsaved += 1
+
+    def flush(self):
+        """Write the cassette if interactions were recorded since the last flush; returns how many."""
+        with self._lock:
+            unsaved = self._unsaved
+            if not unsaved:
+                return 0
+            directory = os.path.dirname(os.path.abspath(self.path))
+            os.makedirs(directory, exist_ok=True)
+            fd, tmp_path = tempfile.mkstemp(dir=directory, suffix=".tmp")
+            with os.fdopen(fd, "w") as f:
+                json.dump({"version": 1, "interactions": self.interactions}, f, indent=1)
+            os.replace(tmp_path, self.path)
+            self._unsaved = 0
+        logger.info(f"Saved {unsaved} new LLM interactions to {self.path}")
+        return unsaved
+
+    def __len__(self):
+        return len(self.interactions)
+
+
+class ReplayChatModel(BaseChatModel):
+    """Chat model that answers from a cassette, with synthetic latency."""
+
+    cassette: Any
+    model_name: str = "o3-mini"
+    latency: str = LLM_REPLAY_LATENCY
+    latency_scale: float = LLM_REPLAY_LATENCY_SCALE
+    first_token_share: float = LLM_REPLAY_FIRST_TOKEN_SHARE
+    chunk_chars: int = LLM_REPLAY_CHUNK_CHARS
+
+    @property
+    def _llm_type(self):
+        return "replay"
+
+    def _lookup(self, messages):
+        prompt_text = get_buffer_string(messages)
+        interaction = self.cassette.get(prompt_key(self.model_name, prompt_text))
+        if interaction is None:
+            raise CassetteMiss(f"No recorded {self.model_name} response for prompt: {prompt_text[:120]!r}")
+        if self.latency == "recorded":
+            delay = interaction.get("latency", 0.0) * self.latency_scale
+        else:
+            delay = float(self.latency) * self.latency_scale
+        return interaction["response"], delay
+
+    def _chunks(self, text):
+        size = max(1, self.chunk_chars)
+        return [text[i:i + size] for i in range(0, len(text), size)] or [""]
+
+    def _generate(self, messages, stop=None, run_manager=None, **kwargs):
+        response, delay = self._lookup(messages)
+        time.sleep(delay)
+        return ChatResult(generations=[ChatGeneration(message=AIMessage(content=response))])
+
+    async def _agenerate(self, messages, stop=None, run_manager=None, **kwargs):
+        response, delay = self._lookup(messages)
+        await asyncio.sleep(delay)
+        return ChatResult(generations=[ChatGeneration(message=AIMessage(content=response))])
+
+    async def _astream(self, messages, stop=None, run_manager=None, **kwargs):
+        response, delay = self._lookup(messages)
+        chunks = self._chunks(response)
+        await asyncio.sleep(delay * self.first_token_share)
+        per_chunk = delay * (1 - self.first_token_share) / len(chunks)
+        for i, text in enumerate(chunks):
+            if i and per_chunk:
+                await asyncio.sleep(per_chunk)
+            chunk = ChatGenerationChunk(message=AIMessageChunk(content=text))
+            if run_manager:
+                await run_manager.on_llm_new_token(text, chunk=chunk)
+            yield chunk
+
+
+class RecordingChatModel(BaseChatModel):
+    """Wraps a real chat model and records each of its responses into a cassette."""
+
+    inner: Any
+    cassette: Any
+    model_name: str = "o3-mini"
+
+    @property
+    def _llm_type(self):
+        return "recording"
+
+    def _record(self, messages, response, started):
+        prompt_text = get_buffer_string(messages)
+        self.cassette.record(prompt_key(self.model_name, prompt_text), self.model_name, prompt_text,
+                             response, time.perf_counter() - started)
+
+    def _generate(self, messages, stop=None, run_manager=None, **kwargs):
+        started = time.perf_counter()
+        message = self.inner.invoke(messages, stop=stop, **kwargs)
+        self._record(messages, message.content, started)
+        return ChatResult(generations=[ChatGeneration(message=AIMessage(content=message.content))])
+
+    async def _agenerate(self, messages, stop=None, run_manager=None, **kwargs):
+        started = time.perf_counter()
+        message = await self.inner.ainvoke(messages, stop=stop, **kwargs)
+        self._record(messages, message.content, started)
+        return ChatResult(generations=[ChatGeneration(message=AIMessage(content=message.content))])
+
+    async def _astream(self, messages, stop=None, run_manager=None, **kwargs):
+        started = time.perf_counter()
+        parts: List[str] = []
+        async for chunk in self.inner.astream(messages, stop=stop, **kwargs):
+            text = chunk.content if isinstance(chunk.content, str) else ""
+            parts.append(text)
+            generation = ChatGenerationChunk(message=AIMessageChunk(content=text))
+            if run_manager:
+                await run_manager.on_llm_new_token(text, chunk=generation)
+            yield generation
+        self._record(messages, "".join(parts), started)
@@ -0,0 +1,341 @@
+"""
+Timeouts, retries, hedging and a circuit breaker for LLM calls.
+
+call_llm runs one logical LLM call (a pipeline stage, persona selection, a memory
+summary) as a series of attempts:
+
+  * each attempt gets LLM_STAGE_TIMEOUT seconds, cut short by the caller's overall
+    Deadline if there is one (LLM_PIPELINE_DEADLINE for the improvement pipeline).
+    Time the call spends queued in the LLM scheduler does not count against the stage
+    timeout or the hedging threshold, only against the deadline
+  * transient failures (timeouts, connection errors, provider 408/409/429/5xx) are
+    retried up to LLM_RETRY_ATTEMPTS attempts in all, after a fully jittered
+    exponential backoff (random between 0 and LLM_RETRY_BASE_DELAY * 2^n, capped at
+    LLM_RETRY_MAX_DELAY), unless the backoff would overrun the deadline. Other
+    errors are raised at once
+  * with LLM_HEDGE_ENABLED, an attempt that has produced no output by the
+    LLM_HEDGE_PERCENTILE of recent time-to-first-output for its stage gets a
+    duplicate. Whichever produces output first is kept and the other is cancelled.
+    At most LLM_HEDGE_MAX_RATIO of calls are hedged, which bounds the extra cost
+  * a process-wide circuit breaker opens after LLM_BREAKER_FAILURES consecutive
+    transient failures of the provider (running out of deadline is not one). While it is open, calls fail at once with CircuitOpen, until
+    LLM_BREAKER_COOLDOWN seconds have passed and a single probe call succeeds
+
+An attempt is a coroutine function taking a `claim` callback. It calls claim() once it
+has output to show (its first streamed token, or its whole response). A False return
+means a hedged duplicate got there first, and the attempt should stop. The provider
+client's own retries are turned off (see llm_clients), so that retries happen only here.
+"""
+import asyncio
+import logging
+import os
+import random
+import time
+from collections import deque
+from contextvars import ContextVar
+
+import httpx
+import openai
+
+from metrics import LLM_ATTEMPT_TIMEOUTS, LLM_CALLS_CANCELLED, LLM_CIRCUIT_REJECTIONS, LLM_HEDGES, LLM_RETRIES
+
+logger = logging.getLogger(__name__)
+
+LLM_STAGE_TIMEOUT = float(os.getenv("LLM_STAGE_TIMEOUT", "180"))
+LLM_PIPELINE_DEADLINE = float(os.getenv("LLM_PIPELINE_DEADLINE", "900"))
+LLM_RETRY_ATTEMPTS = int(os.getenv("LLM_RETRY_ATTEMPTS", "3"))
+LLM_RETRY_BASE_DELAY = float(os.getenv("LLM_RETRY_BASE_DELAY", "0.5"))
+LLM_RETRY_MAX_DELAY = float(os.getenv("LLM_RETRY_MAX_DELAY", "8"))
+LLM_HEDGE_ENABLED = os.getenv("LLM_HEDGE_ENABLED", "false").lower() in ("1", "true", "yes")
+LLM_HEDGE_PERCENTILE = float(os.getenv("LLM_HEDGE_PERCENTILE", "0.95"))
+# Recent attempts per stage needed before the percentile is trusted
+LLM_HEDGE_MIN_SAMPLES = int(os.getenv("LLM_HEDGE_MIN_SAMPLES", "20"))
+LLM_HEDGE_MAX_RATIO = float(os.getenv("LLM_HEDGE_MAX_RATIO", "0.1"))
+LLM_BREAKER_FAILURES = int(os.getenv("LLM_BREAKER_FAILURES", "5"))
+LLM_BREAKER_COOLDOWN = float(os.getenv("LLM_BREAKER_COOLDOWN", "30"))
+
+TRANSIENT_STATUS_CODES = (408, 409, 429, 500, 502, 503, 504)
+
+# The AttemptClock of the attempt running in the current task, paused by the LLM scheduler while it queues
+attempt_clock_var = ContextVar("llm_attempt_clock", default=None)
+
+
+class StageTimeout(TimeoutError):
+    """Raised when an LLM call still has no result after its timeout, on every attempt."""
+
+
+class DeadlineExceeded(TimeoutError):
+    """Raised when an LLM call cannot finish before the caller's overall deadline."""
+
+
+class CircuitOpen(Exception):
+    """Raised without calling the provider while the circuit breaker is open."""
+
+    def __init__(self, retry_after):
+        super().__init__("The LLM provider is failing, calls are paused; please retry later")
+        self.retry_after = retry_after
+
+
+def is_transient(error):
+    """Whether a failed attempt is worth retrying."""
+    if isinstance(error, (TimeoutError, asyncio.TimeoutError, httpx.TransportError,
+                          openai.APIConnectionError, openai.APITimeoutError)):
+        return True
+    return getattr(error, "status_code", None) in TRANSIENT_STATUS_CODES
+
+
+class Deadline:
+    """A point in time a whole operation must finish by."""
+
+    def __init__(self, seconds=LLM_PIPELINE_DEADLINE):
+        self.expires_at = time.monotonic() + seconds
+
+    def remaining(self):
+        return self.expires_at - time.monotonic()
+
+
+class CircuitBreaker:
+    """Opens after consecutive transient failures; after a cooldown, lets one probe call through."""
+
+    def __init__(self, failure_threshold=LLM_BREAKER_FAILURES, cooldown=LLM_BREAKER_COOLDOWN):
+        self.failure_threshold = failure_threshold
+        self.cooldown = cooldown
+        self.failures = 0
+        self.opened_at = None
+        self._probing = False
+
+    @property
+    def state(self):
+        if self.opened_at is None:
+            return "closed"
+        return "half_open" if time.monotonic() - self.opened_at >= self.cooldown else "open"
+
+    def before_call(self, stage):
+        state = self.state
+        if state == "closed":
+            return
+        if state == "half_open" and not self._probing:
+            self._probing = True
+            logger.info(f"Circuit breaker half open, probing the provider with a {stage} call")
+            return
+        LLM_CIRCUIT_REJECTIONS.inc(stage=stage)
+        raise CircuitOpen(max(1, round(self.cooldown - (time.monotonic() - self.opened_at))))
+
+    def record_success(self):
+        if self.opened_at is not None:
+            logger.info("Circuit breaker closed, the provider is answering again")
+        self.failures = 0
+        self.opened_at = None
+        self._probing = False
+
+    def release(self):
+        """End a probe that neither succeeded nor failed in a way that says anything about the provider."""
+        self._probing = False
+
+    def record_failure(self):
+        self.failures += 1
+        if self._probing or (self.opened_at is None and self.failures >= self.failure_threshold):
+            logger.warning(f"Circuit breaker opened after {self.failures} consecutive LLM failures")
+            self.opened_at = time.monotonic()
+        self._probing = False
+
+
+class AttemptClock:
+    """Time an attempt has spent with the provider, leaving out time its call waited for a scheduler slot."""
+
+    def __init__(self, loop):
+        self.loop = loop
+        self.started = loop.time()
+        self.queued_seconds = 0.0
+        self.queued_since = None
+        # Set whenever the call starts or stops waiting, so a timer armed for the other state is rearmed
+        self.changed = asyncio.Event()
+
+    @property
+    def queued(self):
+        return self.queued_since is not None
+
+    def pause(self):
+        """The call is waiting in the scheduler's queue."""
+        self.queued_since = self.loop.time()
+        self.changed.set()
+
+    def resume(self):
+        """The call got its slot (or gave up waiting for it)."""
+        if self.queued_since is not None:
+            self.queued_seconds += self.loop.time() - self.queued_since
+            self.queued_since = None
+        self.changed.set()
+
+    def elapsed(self):
+        now = self.loop.time()
+        queued = self.queued_seconds + (now - self.queued_since if self.queued_since is not None else 0.0)
+        return now - self.started - queued
+
+
+class LatencyTracker:
+    """Recent time-to-first-output samples per stage, for the hedging threshold."""
+
+    def __init__(self, window=200):
+        self.window = window
+        self._samples = {}
+
+    def record(self, stage, seconds):
+        self._samples.setdefault(stage, deque(maxlen=self.window)).append(seconds)
+
+    def percentile(self, stage, percentile, min_samples):
+        samples = self._samples.get(stage)
+        if not samples or len(samples) < min_samples:
+            return None
+        ordered = sorted(samples)
+        return ordered[min(len(ordered) - 1, int(percentile * len(ordered)))]
+
+
+breaker = CircuitBreaker()
+latencies = LatencyTracker()
+_calls = 0
+_hedged_calls = 0
+
+
+def _hedge_delay(stage):
+    if not LLM_HEDGE_ENABLED or _hedged_calls >= LLM_HEDGE_MAX_RATIO * _calls:
+        return None
+    return latencies.percentile(stage, LLM_HEDGE_PERCENTILE, LLM_HEDGE_MIN_SAMPLES)
+
+
+async def _attempt_once(stage, attempt, timeout, deadline=None):
+    """
+    Run one attempt, hedged with a duplicate if it is slow to produce output.
+
+    The stage timeout and the hedge timer run on the first attempt's AttemptClock, so they
+    only start once its call has a scheduler slot. The deadline runs on the wall clock.
+    """
+    global _calls, _hedged_calls
+    _calls += 1
+    loop = asyncio.get_running_loop()
+    tasks = []
+    clocks = []
+    owner = []
+
+    def start():
+        index = len(tasks)
+        clock = AttemptClock(loop)
+
+        def claim():
+            if not owner:
+                owner.append(index)
+                latencies.record(stage, clock.elapsed())
+                # Output is being shown from this attempt; the duplicate is no longer needed
+                for other, task in enumerate(tasks):
+                    if other != index:
+                        task.cancel()
+            return owner[0] == index
+
+        async def run():
+            # Set inside the attempt's own task, so the scheduler pauses this attempt's clock only
+            attempt_clock_var.set(clock)
+            return await attempt(claim)
+
+        clocks.append(clock)
+        tasks.append(asyncio.ensure_future(run()))
+
+    start()
+    clock = clocks[0]
+    hedge_delay = _hedge_delay(stage)
+    if hedge_delay is not None and hedge_delay >= timeout:
+        hedge_delay = None
+    changed = None
+    try:
+        while True:
+            for task in tasks:
+                if task.done() and not task.cancelled() and task.exception() is None:
+                    return task.result()
+            pending = [task for task in tasks if not task.done()]
+            if not pending:
+                errors = [task.exception() for task in tasks if not task.cancelled()]
+                raise errors[0] if errors else asyncio.CancelledError()
+            elapsed = clock.elapsed()
+            if elapsed >= timeout:
+                break
+            if hedge_delay is not None and len(tasks) == 1 and not owner and elapsed >= hedge_delay:
+                _hedged_calls += 1
+                LLM_HEDGES.inc(stage=stage)
+                logger.info(f"Hedging {stage}: no output after {hedge_delay:.2f}s")
+                start()
+                continue
+            waits = []
+            if not clock.queued:
+                waits.append(timeout - elapsed)
+                if hedge_delay is not None and len(tasks) == 1 and not owner:
+                    waits.append(hedge_delay - elapsed)
+            if deadline is not None:
+                remaining = deadline.remaining()
+                if remaining <= 0:
+                    if clock.queued:
+                        raise DeadlineExceeded(f"Deadline passed while the {stage} call was queued")
+                    raise DeadlineExceeded(f"Deadline passed during the {stage} call")
+                waits.append(remaining)
+            clock.changed.clear()
+            if changed is None or changed.done():
+                changed = asyncio.ensure_future(clock.changed.wait())
+            await asyncio.wait(pending + [changed], timeout=min(waits) if waits else None,
+                               return_when=asyncio.FIRST_COMPLETED)
+        LLM_ATTEMPT_TIMEOUTS.inc(stage=stage)
+        raise StageTimeout(f"No {stage} response after {clock.elapsed():.0f}s")
+    finally:
+        if changed is not None:
+            changed.cancel()
+        for task in tasks:
+            if not task.done():
+                task.cancel()
+
+
+def single_response(call):
+    """Adapt a coroutine function returning a whole (unstreamed) response into an attempt."""
+    async def attempt(claim):
+        result = await call()
+        claim()
+        return result
+    return attempt
+
+
+async def call_llm(stage, attempt, deadline=None, timeout=None, on_retry=None):
+    """Run `attempt` under the stage timeout, deadline, retry policy, hedging and circuit breaker."""
+    timeout = timeout or LLM_STAGE_TIMEOUT
+    try:
+        for number in range(1, LLM_RETRY_ATTEMPTS + 1):
+            if deadline is not None and deadline.remaining() <= 0:
+                raise DeadlineExceeded(f"Deadline passed before the {stage} call")
+            breaker.before_call(stage)
+            try:
+                result = await _attempt_once(stage, attempt, timeout, deadline)
+            except DeadlineExceeded:
+                # The caller ran out of time (often queued behind other calls); that says nothing about the provider
+                breaker.release()
+                raise
+            except Exception as e:
+                if not is_transient(e):
+                    breaker.release()
+                    raise
+                breaker.record_failure()
+                if deadline is not None and deadline.remaining() <= 0:
+                    raise DeadlineExceeded(f"Deadline passed during the {stage} call") from e
+                if number == LLM_RETRY_ATTEMPTS:
+                    raise
+                delay = random.uniform(0, min(LLM_RETRY_MAX_DELAY, LLM_RETRY_BASE_DELAY * 2 ** (number - 1)))
+                if deadline is not None and delay >= deadline.remaining():
+                    raise DeadlineExceeded(f"No time left to retry the {stage} call") from e
+                LLM_RETRIES.inc(stage=stage)
+                logger.warning(f"Retrying {stage} in {delay:.2f}s after attempt {number} failed: {str(e) or type(e).__name__}")
+                if on_retry:
+                    on_retry(number, e)
+                await asyncio.sleep(delay)
+            else:
+                breaker.record_success()
+                return result
+    except asyncio.CancelledError:
+        # Typically the client went away; the call's remaining attempts are never made.
+        # A cancelled probe says nothing about the provider, so it must not hold the breaker half open
+        breaker.release()
+        LLM_CALLS_CANCELLED.inc(stage=stage)
+        raise
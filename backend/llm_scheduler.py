@@ -0,0 +1,357 @@
+"""
+Process-wide admission control for LLM calls.
+
+Every chat model handed out by LLMClientRegistry goes through one LLMScheduler, so all
+handlers share a single view of the provider's rate limits:
+
+  * token buckets for requests and for estimated tokens, refilled continuously at
+    LLM_SCHEDULER_RPM / LLM_SCHEDULER_TPM per minute (0 leaves that limit off), with
+    room for LLM_SCHEDULER_BURST_SECONDS worth of calls at once. A call's tokens are
+    estimated from its prompt plus LLM_SCHEDULER_COMPLETION_TOKENS, then corrected
+    by the tokens it actually used once it finishes
+  * at most LLM_SCHEDULER_MAX_CONCURRENCY calls in flight
+  * a bounded queue for calls waiting on either. Interactive calls are granted ahead
+    of batch calls, and within a priority clients take turns, so one client's burst
+    cannot starve the others
+
+Admission is decided once per request, before its first LLM call: check_admission
+rejects a new interactive request with LLMRejected when the queue is full, 503 when
+the whole queue is full and 429 when the calling client alone holds
+LLM_SCHEDULER_MAX_QUEUE_PER_CLIENT queued calls. Both carry a Retry-After estimate of
+how long the queue takes to drain. Once admitted, a request's calls always wait for
+their turn, so a pipeline is never turned away part way through after paying for its
+earlier stages. Batch calls are never rejected, since the batch worker pool already
+bounds how many of them there are.
+
+The client and priority of a call come from context variables: ClientContextMiddleware
+sets the client of each HTTP request, and bind_llm_context sets both for other work.
+"""
+import asyncio
+import logging
+import math
+import os
+import time
+from collections import OrderedDict, deque
+from contextlib import asynccontextmanager, contextmanager
+from contextvars import ContextVar
+from typing import Any, List
+
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import AIMessage, AIMessageChunk, get_buffer_string
+from langchain_core.outputs import ChatGeneration, ChatGenerationChunk, ChatResult
+
+from conversation_memory import count_tokens
+from llm_resilience import attempt_clock_var
+from metrics import LLM_SCHEDULER_QUEUE_SECONDS, LLM_SCHEDULER_REJECTIONS
+
+logger = logging.getLogger(__name__)
+
+LLM_SCHEDULER_RPM = float(os.getenv("LLM_SCHEDULER_RPM", "0"))
+LLM_SCHEDULER_TPM = float(os.getenv("LLM_SCHEDULER_TPM", "0"))
+LLM_SCHEDULER_BURST_SECONDS = float(os.getenv("LLM_SCHEDULER_BURST_SECONDS", "10"))
+LLM_SCHEDULER_MAX_CONCURRENCY = int(os.getenv("LLM_SCHEDULER_MAX_CONCURRENCY", "64"))
+LLM_SCHEDULER_MAX_QUEUE = int(os.getenv("LLM_SCHEDULER_MAX_QUEUE", "256"))
+LLM_SCHEDULER_MAX_QUEUE_PER_CLIENT = int(os.getenv("LLM_SCHEDULER_MAX_QUEUE_PER_CLIENT", "64"))
+# Expected completion length, counted against the token bucket until the real usage is known
+LLM_SCHEDULER_COMPLETION_TOKENS = int(os.getenv("LLM_SCHEDULER_COMPLETION_TOKENS", "1000"))
+
+# Highest priority first
+PRIORITIES = ("interactive", "batch")
+
+llm_client_var = ContextVar("llm_client", default="anonymous")
+llm_priority_var = ContextVar("llm_priority", default="interactive")
+
+
+class LLMRejected(Exception):
+    """Raised when an LLM call is turned away because the scheduler's queue is full."""
+
+    def __init__(self, message, status_code, retry_after):
+        super().__init__(message)
+        self.status_code = status_code
+        self.retry_after = retry_after
+
+
+@contextmanager
+def bind_llm_context(client=None, priority=None):
+    """Attribute the LLM calls made in the block to a client and/or priority."""
+    tokens = []
+    if client is not None:
+        tokens.append((llm_client_var, llm_client_var.set(client)))
+    if priority is not None:
+        tokens.append((llm_priority_var, llm_priority_var.set(priority)))
+    try:
+        yield
+    finally:
+        for var, token in reversed(tokens):
+            var.reset(token)
+
+
+class TokenBucket:
+    """Continuously refilled allowance of `rate_per_minute`, holding at most `burst_seconds` worth."""
+
+    def __init__(self, rate_per_minute, burst_seconds, clock=time.monotonic):
+        self.rate = rate_per_minute / 60
+        self.capacity = max(1.0, self.rate * burst_seconds)
+        self.level = self.capacity
+        self.clock = clock
+        self._updated = clock()
+
+    def _refill(self):
+        now = self.clock()
+        self.level = min(self.capacity, self.level + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def wait_time(self, amount):
+        """Seconds until `amount` can be taken (a call larger than the bucket only needs it full)."""
+        self._refill()
+        needed = min(amount, self.capacity)
+        return 0.0 if self.level >= needed else (needed - self.level) / self.rate
+
+    def take(self, amount):
+        """Take `amount`, going into debt if it is more than the bucket holds."""
+        self._refill()
+        self.level -= amount
+
+    def give_back(self, amount):
+        self._refill()
+        self.level = min(self.capacity, self.level + amount)
+
+
+class _Waiter:
+    __slots__ = ("client", "priority", "tokens", "future", "enqueued")
+
+    def __init__(self, client, priority, tokens, future, enqueued):
+        self.client = client
+        self.priority = priority
+        self.tokens = tokens
+        self.future = future
+        self.enqueued = enqueued
+
+
+class LLMScheduler:
+    """Grants LLM calls under shared request/token rate limits, a concurrency cap and a fair, bounded queue."""
+
+    def __init__(self, rpm=LLM_SCHEDULER_RPM, tpm=LLM_SCHEDULER_TPM, burst_seconds=LLM_SCHEDULER_BURST_SECONDS,
+                 max_concurrency=LLM_SCHEDULER_MAX_CONCURRENCY, max_queue=LLM_SCHEDULER_MAX_QUEUE,
+                 max_queue_per_client=LLM_SCHEDULER_MAX_QUEUE_PER_CLIENT,
+                 completion_tokens=LLM_SCHEDULER_COMPLETION_TOKENS, clock=time.monotonic):
+        self.rpm = rpm
+        self.tpm = tpm
+        self.max_concurrency = max_concurrency
+        self.max_queue = max_queue
+        self.max_queue_per_client = max_queue_per_client
+        self.completion_tokens = completion_tokens
+        self.clock = clock
+        self.request_bucket = TokenBucket(rpm, burst_seconds, clock) if rpm > 0 else None
+        self.token_bucket = TokenBucket(tpm, burst_seconds, clock) if tpm > 0 else None
+        # priority -> client -> waiting calls; clients are served round-robin in dict order
+        self._queues = {priority: OrderedDict() for priority in PRIORITIES}
+        self._queued_by_client = {}
+        self.queued = 0
+        self.queued_tokens = 0
+        self.active = 0
+        self._timer = None
+
+    def estimate_tokens(self, prompt_text):
+        """Tokens a call is expected to use (only counted when there is a token limit)."""
+        if self.token_bucket is None:
+            return 0
+        return count_tokens(prompt_text) + self.completion_tokens
+
+    def actual_tokens(self, estimated_tokens, completion_text):
+        """Tokens a call used: its counted prompt plus its completion."""
+        if self.token_bucket is None:
+            return 0
+        return estimated_tokens - self.completion_tokens + count_tokens(completion_text)
+
+    def retry_after(self):
+        """Rough seconds until the current queue drains at the configured rates."""
+        seconds = 1.0
+        if self.request_bucket is not None:
+            seconds = max(seconds, self.queued / self.request_bucket.rate)
+        if self.token_bucket is not None:
+            seconds = max(seconds, self.queued_tokens / self.token_bucket.rate)
+        return math.ceil(seconds)
+
+    def check_admission(self, client=None, priority=None):
+        """Raise LLMRejected if a new interactive request from `client` would not fit in the queue."""
+        client = client or llm_client_var.get()
+        if (priority or llm_priority_var.get()) != "interactive":
+            return
+        if self.queued >= self.max_queue:
+            LLM_SCHEDULER_REJECTIONS.inc(reason="queue_full")
+            raise LLMRejected("LLM capacity exhausted, please retry later", 503, self.retry_after())
+        if self._queued_by_client.get(client, 0) >= self.max_queue_per_client:
+            LLM_SCHEDULER_REJECTIONS.inc(reason="client_queue_full")
+            raise LLMRejected("Too many LLM requests from this client, please retry later", 429, self.retry_after())
+
+    @asynccontextmanager
+    async def slot(self, estimated_tokens, client=None, priority=None):
+        """
+        Wait for permission to make one LLM call, then hold one concurrency slot for the block.
+
+        Never rejects: callers are admitted once per request with check_admission.
+
+        Yields a callback that records the call's actual token usage, so the token bucket
+        is charged for what was used rather than the estimate.
+        """
+        client = client or llm_client_var.get()
+        priority = priority or llm_priority_var.get()
+        waiter = _Waiter(client, priority, estimated_tokens, asyncio.get_running_loop().create_future(), self.clock())
+        self._enqueue(waiter)
+        self._dispatch()
+        # The attempt's stage timeout and hedge timer stand still while the call waits its turn
+        clock = attempt_clock_var.get() if not waiter.future.done() else None
+        if clock is not None:
+            clock.pause()
+        try:
+            await waiter.future
+        except asyncio.CancelledError:
+            if waiter.future.done() and not waiter.future.cancelled():
+                self._release(waiter.tokens, waiter.tokens)
+            else:
+                self._remove(waiter)
+            raise
+        finally:
+            if clock is not None:
+                clock.resume()
+        LLM_SCHEDULER_QUEUE_SECONDS.observe(self.clock() - waiter.enqueued, priority=priority)
+
+        used = [estimated_tokens]
+        try:
+            yield lambda tokens: used.__setitem__(0, tokens)
+        finally:
+            self._release(estimated_tokens, used[0])
+
+    def _enqueue(self, waiter):
+        self._queues[waiter.priority].setdefault(waiter.client, deque()).append(waiter)
+        self._queued_by_client[waiter.client] = self._queued_by_client.get(waiter.client, 0) + 1
+        self.queued += 1
+        self.queued_tokens += waiter.tokens
+
+    def _dequeued(self, waiter):
+        clients = self._queues[waiter.priority]
+        if not clients[waiter.client]:
+            del clients[waiter.client]
+        remaining = self._queued_by_client[waiter.client] - 1
+        if remaining:
+            self._queued_by_client[waiter.client] = remaining
+        else:
+            del self._queued_by_client[waiter.client]
+        self.queued -= 1
+        self.queued_tokens -= waiter.tokens
+
+    def _remove(self, waiter):
+        """Drop a call that stopped waiting before it was granted."""
+        calls = self._queues[waiter.priority].get(waiter.client)
+        if calls and waiter in calls:
+            calls.remove(waiter)
+            self._dequeued(waiter)
+            self._dispatch()
+
+    def _release(self, estimated_tokens, used_tokens):
+        self.active -= 1
+        if self.token_bucket is not None and used_tokens != estimated_tokens:
+            if used_tokens > estimated_tokens:
+                self.token_bucket.take(used_tokens - estimated_tokens)
+            else:
+                self.token_bucket.give_back(estimated_tokens - used_tokens)
+        self._dispatch()
+
+    def _next_waiter(self):
+        for priority in PRIORITIES:
+            clients = self._queues[priority]
+            if clients:
+                return clients[next(iter(clients))][0]
+        return None
+
+    def _dispatch(self):
+        """Grant queued calls, in priority and then round-robin client order, while capacity allows."""
+        while self.active < self.max_concurrency:
+            waiter = self._next_waiter()
+            if waiter is None:
+                return
+            wait = 0.0
+            if self.request_bucket is not None:
+                wait = max(wait, self.request_bucket.wait_time(1))
+            if self.token_bucket is not None:
+                wait = max(wait, self.token_bucket.wait_time(waiter.tokens))
+            if wait > 0:
+                self._schedule(wait)
+                return
+            clients = self._queues[waiter.priority]
+            clients[waiter.client].popleft()
+            self._dequeued(waiter)
+            if waiter.client in clients:
+                # The client goes to the back of the rotation
+                clients.move_to_end(waiter.client)
+            if self.request_bucket is not None:
+                self.request_bucket.take(1)
+            if self.token_bucket is not None:
+                self.token_bucket.take(waiter.tokens)
+            self.active += 1
+            waiter.future.set_result(None)
+
+    def _schedule(self, delay):
+        if self._timer is not None:
+            self._timer.cancel()
+        self._timer = asyncio.get_running_loop().call_later(delay, self._on_timer)
+
+    def _on_timer(self):
+        self._timer = None
+        self._dispatch()
+
+
+class ScheduledChatModel(BaseChatModel):
+    """Wraps a chat model so each of its calls waits for a slot from the scheduler."""
+
+    inner: Any
+    scheduler: Any
+
+    @property
+    def _llm_type(self):
+        return "scheduled"
+
+    def _estimate(self, messages):
+        return self.scheduler.estimate_tokens(get_buffer_string(messages))
+
+    def _generate(self, messages, stop=None, run_manager=None, **kwargs):
+        # Synchronous calls cannot wait on the event loop's scheduler; the app only makes async calls
+        message = self.inner.invoke(messages, stop=stop, **kwargs)
+        return ChatResult(generations=[ChatGeneration(message=message)])
+
+    async def _agenerate(self, messages, stop=None, run_manager=None, **kwargs):
+        estimate = self._estimate(messages)
+        async with self.scheduler.slot(estimate) as record_usage:
+            message = await self.inner.ainvoke(messages, stop=stop, **kwargs)
+            text = message.content if isinstance(message.content, str) else ""
+            record_usage(self.scheduler.actual_tokens(estimate, text))
+        return ChatResult(generations=[ChatGeneration(message=AIMessage(content=message.content))])
+
+    async def _astream(self, messages, stop=None, run_manager=None, **kwargs):
+        estimate = self._estimate(messages)
+        async with self.scheduler.slot(estimate) as record_usage:
+            parts: List[str] = []
+            async for chunk in self.inner.astream(messages, stop=stop, **kwargs):
+                text = chunk.content if isinstance(chunk.content, str) else ""
+                parts.append(text)
+                generation = ChatGenerationChunk(message=AIMessageChunk(content=text))
+                if run_manager:
+                    await run_manager.on_llm_new_token(text, chunk=generation)
+                yield generation
+            record_usage(self.scheduler.actual_tokens(estimate, "".join(parts)))
+
+
+class ClientContextMiddleware:
+    """ASGI middleware attributing each request's LLM calls to its client address, for fair queueing."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        client = scope.get("client")
+        with bind_llm_context(client=client[0] if client else "anonymous"):
+            await self.app(scope, receive, send)
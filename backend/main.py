@@ -1,32 +1,106 @@
+import asyncio
+import hashlib
 import json
 import random
 import os
 import re
-import time
 from datetime import datetime
 from dotenv import load_dotenv
-from fastapi import FastAPI, HTTPException
+from fastapi import FastAPI, HTTPException, Query, Request, Response
+from fastapi.responses import StreamingResponse
 from pydantic import BaseModel
 from fastapi.middleware.cors import CORSMiddleware
-from langchain_openai import ChatOpenAI
 from langchain.prompts import PromptTemplate
-from langchain.chains import ConversationChain, LLMChain
-from langchain.memory import ConversationBufferMemory
+from langchain.chains import LLMChain
 from langchain.output_parsers import ResponseSchema, StructuredOutputParser
 import logging
 import yaml
-from typing import List, Optional, Dict, Any, Union
+from typing import List, Literal, Optional, Dict, Any, Union
+from llm_clients import LLMClientRegistry
+from llm_scheduler import ClientContextMiddleware, LLMRejected, LLMScheduler
+from llm_resilience import (
+    CircuitOpen,
+    Deadline,
+    DeadlineExceeded,
+    StageTimeout,
+    breaker as llm_breaker,
+    call_llm,
+    single_response,
+)
+from selection_cache import catalog_version, create_selection_cache, normalize_question
+from persona_index import PERSONA_SHORTLIST_SIZE, PersonaIndex
+from persona_fast_select import FastPersonaSelector
+from persona_catalog import PersonaCatalog
+from conversation_memory import MEMORY_STRATEGIES, count_tokens, create_memory
+from library_store import (
+    LIBRARY_MAX_PAGE_SIZE,
+    LIBRARY_PAGE_SIZE,
+    ENTRY_FIELDS,
+    SORT_COLUMNS,
+    SUMMARY_FIELDS,
+    EntryNotFound,
+    InvalidCursor,
+    LibraryRepository,
+)
+from library_counters import CounterAggregator
+from library_writer import LibraryWriter
+from client_disconnect import ClientDisconnected, cancel_on_disconnect
+from batch_jobs import BATCH_JOB_MAX_QUESTIONS, BatchJobManager, JobNotFound, JobStore
+from improvement_sessions import (
+    SessionConflict,
+    SessionManager,
+    SessionNotFound,
+    SessionStore,
+    new_session_id,
+    valid_session_id,
+)
+from library_search import LIBRARY_SEARCH_LIMIT, LIBRARY_SEARCH_MAX_LIMIT, build_match_query
+from metrics import (
+    ANSWER_PARSE_FALLBACKS,
+    CLIENT_DISCONNECTS,
+    CONTENT_TYPE as METRICS_CONTENT_TYPE,
+    LIBRARY_NOT_MODIFIED,
+    LIBRARY_OPERATION_SECONDS,
+    LLM_TOKENS,
+    REGISTRY as METRICS,
+    SESSION_STAGES_RESUMED,
+    MetricsMiddleware,
+    track_pipeline,
+    track_stage,
+)
+from request_coalescing import CoalescedWaitTimeout, RequestCoalescer, coalescing_key
+from answer_parser import format_instructions as answer_format_instructions, parse_individual_answers
+from structured_logging import RequestContextMiddleware, configure_logging, log_payload
 
 app = FastAPI()
 
-# Set up logging
-logging.basicConfig(level=logging.INFO)
+# Structured JSON logging through a background queue (see structured_logging for settings)
+configure_logging()
 logger = logging.getLogger(__name__)
 
 # Load environment variables
 load_dotenv('keys.env')
 openai_api_key = os.environ['openai_api_key']
 
+# Admission control shared by every LLM call: rate limits, concurrency cap and a fair, bounded queue
+llm_scheduler = LLMScheduler()
+
+# Shared, pooled chat model clients (opened on startup, closed on shutdown)
+llm_clients = LLMClientRegistry(openai_api_key, scheduler=llm_scheduler)
+
+# Question library storage, its single writer and its write-behind view/vote counters
+# (opened on startup, closed on shutdown). Reads go to `library`; every mutation goes
+# through `library_writer`.
+library = None
+library_writer = None
+library_counters = None
+
+# Batch improvement jobs (worker pool started on startup, stopped on shutdown)
+batch_jobs = None
+
+# Checkpointed improvement sessions, resumable by session id (opened on startup)
+improvement_sessions = None
+
 @app.get("/api/emailjs-credentials")
 async def get_emailjs_credentials():
     return {
@@ -52,11 +126,56 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# Request latency and in-flight counts for every route, exposed at /metrics
+app.add_middleware(MetricsMiddleware)
+# Correlation id for every request's log records, echoed in X-Request-ID
+app.add_middleware(RequestContextMiddleware)
+# Client address each request's LLM calls are queued under, for fair sharing
+app.add_middleware(ClientContextMiddleware)
+
 # Global variable to store personas data
 personas_data = {}
+# Immutable personas compiled from personas_data, with prompt blocks and API fields precomputed
+persona_catalog = PersonaCatalog({})
+# Hash of the loaded personas, part of every selection cache key
+personas_version = ""
+# Lexical index used to shortlist candidate personas for selection
+persona_index = PersonaIndex([])
+# Vectorized scorer for zero-LLM ("fast" mode) persona selection
+fast_persona_selector = FastPersonaSelector({})
+
+# Cached persona selections, keyed on normalized question and personas_version
+selection_cache = create_selection_cache()
+METRICS.counter(
+    "questioncrafter_selection_cache_lookups_total", "Persona selection cache lookups by result", ("result",),
+    function=lambda: {("hit",): selection_cache.hits, ("miss",): selection_cache.misses},
+)
+METRICS.gauge(
+    "questioncrafter_selection_cache_hit_ratio", "Share of persona selection cache lookups that were hits",
+    function=lambda: selection_cache.hits / max(1, selection_cache.hits + selection_cache.misses),
+)
+
+# Concurrent identical persona selections and improvements share one in-flight computation
+request_coalescer = RequestCoalescer()
+METRICS.gauge(
+    "questioncrafter_coalesced_keys_in_flight", "Distinct computations currently shared by coalesced requests",
+    function=lambda: len(request_coalescer),
+)
+METRICS.gauge(
+    "questioncrafter_llm_circuit_state", "LLM circuit breaker state: 0 closed, 1 half open (probing), 2 open",
+    function=lambda: ("closed", "half_open", "open").index(llm_breaker.state),
+)
+METRICS.gauge(
+    "questioncrafter_llm_scheduler_queued_calls", "LLM calls waiting for the scheduler",
+    function=lambda: llm_scheduler.queued,
+)
+METRICS.gauge(
+    "questioncrafter_llm_scheduler_active_calls", "LLM calls the scheduler has granted that are still running",
+    function=lambda: llm_scheduler.active,
+)
 
 def load_personas():
-    global personas_data
+    global personas_data, personas_version, persona_catalog, persona_index, fast_persona_selector
     try:
         with open('personas.yaml', 'r', encoding='utf-8') as file:
             personas_data = yaml.safe_load(file)
@@ -65,44 +184,50 @@ def load_personas():
     except Exception as e:
         logger.error(f"Error loading personas: {str(e)}")
         personas_data = {"personas": {}}
+    persona_catalog = PersonaCatalog(personas_data['personas'])
+    personas_version = catalog_version(personas_data)
+    compiled_fields = {key: persona.api_fields for key, persona in persona_catalog.personas.items()}
+    persona_index = PersonaIndex.from_personas(compiled_fields)
+    fast_persona_selector = FastPersonaSelector(compiled_fields)
 
 @app.on_event("startup")
 async def startup_event():
+    global library, library_writer, library_counters, batch_jobs, improvement_sessions
     load_personas()
+    llm_clients.start()
+    library = LibraryRepository()
+    library.migrate_from_json()
+    library_writer = LibraryWriter(library)
+    library_writer.start()
+    library_counters = CounterAggregator(library_writer)
+    library_counters.start()
+    batch_jobs = BatchJobManager(JobStore(), run_batch_question)
+    await batch_jobs.start()
+    improvement_sessions = SessionManager(SessionStore())
     logger.info("Application started, personas loaded.")
 
-def get_all_persona_names():
-    """Return all persona names from the loaded YAML file."""
-    persona_names = list(personas_data['personas'].keys())
-    logger.info(f"Available personas: {persona_names}")
-    return persona_names
+@app.on_event("shutdown")
+async def shutdown_event():
+    if batch_jobs is not None:
+        await batch_jobs.stop()
+    await llm_clients.close()
+    if library_counters is not None:
+        await library_counters.stop()
+    if library_writer is not None:
+        await library_writer.stop()
+    if library is not None:
+        library.close()
+    logger.info("Application shut down, LLM clients closed.")
 
 def get_persona_definition(persona_name):
-    """Return a specific persona definition from the loaded YAML file."""
-    persona = personas_data['personas'].get(persona_name, {
-        "name": persona_name,
-        "role": "Unknown",
-        "background": "No background available"
-    })
-
-    logger.info(f"Retrieved persona: {persona_name}")
-    logger.info(f"Persona keys: {persona.keys()}")
-    
-    # Add default values for missing keys
-    persona['original_role'] = persona_name
-    persona['core_expertise'] = persona.get('core_expertise', [])
-    persona['cognitive_approach'] = persona.get('cognitive_approach', '')
-    persona['values_and_motivations'] = persona.get('values_and_motivations', '')
-    persona['communication_style'] = persona.get('communication_style', '')
-    persona['notable_trait'] = persona.get('notable_trait', '')
-    
-    return persona
+    """Return a specific compiled persona from the loaded catalog (a placeholder if it is unknown)."""
+    return persona_catalog.get(persona_name)
 
 def validate_persona_selection(selected_personas):
-    valid_personas = get_all_persona_names()
+    valid_personas = persona_catalog.names
     validated_personas = []
     for persona in selected_personas:
-        if persona in valid_personas:
+        if persona in persona_catalog:
             validated_personas.append(persona)
         else:
             logger.warning(f"Invalid persona selected: {persona}. Selecting a random valid persona instead.")
@@ -111,472 +236,816 @@ def validate_persona_selection(selected_personas):
 
 class Question(BaseModel):
     text: str
+    # "llm" asks the model to pick personas; "fast" scores them locally without an LLM call
+    mode: Literal["llm", "fast"] = "llm"
+
+def build_persona_selection_prompt():
+    """Return the persona selection prompt template and the parser for its structured output."""
+    response_schemas = [
+        ResponseSchema(name="persona1", description="the most relevant persona selected to use to reason through the question"),
+        ResponseSchema(name="persona2", description="the second most relevant persona selected to use to reason through the question"),
+        ResponseSchema(name="persona3", description="the third most relevant persona selected to use to reason through the question"),
+        ResponseSchema(name="rationale", description="a dictionary where keys are the selected persona names and values are the rationales for selecting each persona")
+    ]
+    output_parser = StructuredOutputParser.from_response_schemas(response_schemas)
+    format_instructions = output_parser.get_format_instructions()
+    format_instructions += "\nEnsure that the 'rationale' field is a dictionary with keys for each selected persona and corresponding rationale values." 
+
+    persona_selection_prompt = PromptTemplate(
+        input_variables=["question", "personas"],
+        template="""
+        Consider the following question with careful attention to its nature and underlying essence.
+
+        Question: {question}
+
+        Carefully select 3 expert personas from the following list. Envision how their expertise can intertwine, forming a rich tapestry of interconnected knowledge and perspectives. 
+        
+        Consider the depth and breadth each brings, and how their unique insights, when combined could lead to groundbreaking explorations of the question.
 
-def get_content(response):
-    if isinstance(response, str):
-        return response
-    elif isinstance(response, dict) and "response" in response:
-        return response["response"]
-    elif isinstance(response, dict) and "output" in response:
-        return response["output"]
-    else:
-        return str(response)
+        Available Personas: {personas}
 
-# Select Personas
-@app.post("/select-personas")
-async def select_personas(question: Question):
-    try:
-        logger.info(f"Selecting personas for question: {question.text}")
-        
-        available_personas = get_all_persona_names()
-        logger.info(f"All available personas for selection: {available_personas}")
+       IMPORTANT:
+        - Select 3 of the most relevant expert personas only from the provided list
+        - Each persona must be unique
+        - Provide a clear rationale to the user for why each selection was chosen in relation to the nature of the question posed
+        - Include a 'rationale' dictionary with persona names as keys and selection reasons as values
+        - Consider how these personas might interact to generate unexpected insights
+        - Your output must be valid JSON with no markdown formatting, no code fences, or additional text.
+        - Failure to provide a rationale for each selected persona will result in an error and require reprocessing.
 
-        chat = ChatOpenAI(temperature=1, openai_api_key=openai_api_key, model="o3-mini")
+        {format_instructions}
+        """,
+        partial_variables={"format_instructions": format_instructions}
+    )
 
-        response_schemas = [
-            ResponseSchema(name="persona1", description="the most relevant persona selected to use to reason through the question"),
-            ResponseSchema(name="persona2", description="the second most relevant persona selected to use to reason through the question"),
-            ResponseSchema(name="persona3", description="the third most relevant persona selected to use to reason through the question"),
-            ResponseSchema(name="rationale", description="a dictionary where keys are the selected persona names and values are the rationales for selecting each persona")
-        ]
-        output_parser = StructuredOutputParser.from_response_schemas(response_schemas)
-        format_instructions = output_parser.get_format_instructions()
-        format_instructions += "\nEnsure that the 'rationale' field is a dictionary with keys for each selected persona and corresponding rationale values." 
+    return persona_selection_prompt, output_parser
 
-        persona_selection_prompt = PromptTemplate(
-            input_variables=["question", "personas"],
-            template="""
-            Consider the following question with careful attention to its nature and underlying essence.
+def format_selected_personas(persona_definitions, rationales):
+    """Build the /select-personas response body from compiled personas and their rationales."""
+    return {
+        "selectedPersonas": [
+            persona.to_api(rationales.get(persona.key, "Error: No rationale provided"))
+            for persona in persona_definitions
+        ]
+    }
 
-            Question: {question}
+def fast_select_personas(question_text):
+    """Select a persona triad locally, without calling the LLM."""
+    selection = fast_persona_selector.select(question_text)
+    rationales = dict(selection)
+    return format_selected_personas([get_persona_definition(key) for key, _ in selection], rationales)
 
-            Carefully select 3 expert personas from the following list. Envision how their expertise can intertwine, forming a rich tapestry of interconnected knowledge and perspectives. 
-            
-            Consider the depth and breadth each brings, and how their unique insights, when combined could lead to groundbreaking explorations of the question.
-
-            Available Personas: {personas}
-
-           IMPORTANT:
-            - Select 3 of the most relevant expert personas only from the provided list
-            - Each persona must be unique
-            - Provide a clear rationale to the user for why each selection was chosen in relation to the nature of the question posed
-            - Include a 'rationale' dictionary with persona names as keys and selection reasons as values
-            - Consider how these personas might interact to generate unexpected insights
-            - Your output must be valid JSON with no markdown formatting, no code fences, or additional text.
-            - Failure to provide a rationale for each selected persona will result in an error and require reprocessing.
-
-            {format_instructions}
-            """,
-            partial_variables={"format_instructions": format_instructions}
-        )
+# Select Personas
+@app.post("/select-personas")
+@track_pipeline("persona_selection")
+async def select_personas(question: Question):
+    try:
+        logger.info(f"Selecting personas for question: {question.text} (mode: {question.mode})")
 
-        personas_string = ", ".join(available_personas)
-        prompt_content = persona_selection_prompt.format(question=question.text, personas=personas_string)
-        logger.info("Persona selection prompt content:")
-        logger.info(prompt_content)
+        if question.mode == "fast":
+            return fast_select_personas(question.text)
 
-        # IMPORTANT: LLMChain.invoke here returns a dict immediately (synchronous), so do not await it.
-        response = LLMChain(llm=chat, prompt=persona_selection_prompt).invoke({"question": question.text, "personas": personas_string})
-        logger.info(f"Persona selection response: {response}")
+        cached_result = await selection_cache.get(question.text, personas_version)
+        if cached_result is not None:
+            logger.info("Returning cached persona selection")
+            return cached_result
+        
+        # Identical selections already running share one LLM call
+        key = coalescing_key("persona_selection", {"question": normalize_question(question.text),
+                                                   "personas_version": personas_version})
+        return await request_coalescer.run("persona_selection", key, lambda: llm_select_personas(question.text))
+
+    except CoalescedWaitTimeout as e:
+        raise HTTPException(status_code=504, detail=str(e))
+    except LLMRejected as e:
+        raise HTTPException(status_code=e.status_code, detail=str(e), headers={"Retry-After": str(e.retry_after)})
+    except CircuitOpen as e:
+        raise HTTPException(status_code=503, detail=str(e), headers={"Retry-After": str(e.retry_after)})
+    except (StageTimeout, DeadlineExceeded) as e:
+        raise HTTPException(status_code=504, detail=str(e))
+    except Exception as e:
+        logger.error(f"Error occurred during persona selection: {str(e)}", exc_info=True)
+        raise HTTPException(status_code=500, detail=str(e))
 
-        if isinstance(response, dict):
-            selection = response
-        else:
-            try:
-                selection = output_parser.parse(response)
-            except Exception as e:
-                logger.error(f"Error parsing OpenAI response: {e}")
-                logger.error(f"Problematic response: {response}")
-                raise HTTPException(status_code=500, detail="Error parsing OpenAI response")
-
-        logger.info(f"Parsed selection: {json.dumps(selection, indent=2)}")
-
-        # Check if the output is wrapped in markdown code fences in the 'text' key
-        if "text" in selection:
-            raw_text = selection["text"]
-            # Remove markdown code fences and any 'json' language identifiers.
-            cleaned_text = re.sub(r'^```(?:json)?\s*', '', raw_text).strip()
-            cleaned_text = re.sub(r'\s*```$', '', cleaned_text).strip()
-            try:
-                # Now parse the cleaned JSON string.
-                selection = json.loads(cleaned_text)
-            except Exception as e:
-                logger.error(f"Error parsing cleaned JSON: {e}")
-                raise HTTPException(status_code=500, detail="Error parsing persona selection output")
-
-        # Now you should have keys 'persona1', 'persona2', 'persona3'
+async def llm_select_personas(question_text):
+    """Select personas for the question with the LLM, and cache the selection."""
+    # Turn the request away before doing any work if the LLM queue is already full
+    llm_scheduler.check_admission()
+    # Only offer the LLM the personas most relevant to the question
+    available_personas = persona_index.shortlist(question_text, PERSONA_SHORTLIST_SIZE)
+    logger.info(f"Shortlisted personas for selection: {available_personas}")
+
+    chat = llm_clients.get_chat_model(model="o3-mini", temperature=1)
+
+    persona_selection_prompt, output_parser = build_persona_selection_prompt()
+
+    personas_string = ", ".join(available_personas)
+    prompt_content = persona_selection_prompt.format(question=question_text, personas=personas_string)
+    log_payload(logger, "Persona selection prompt", prompt_content)
+
+    # Use the async chain API so the provider round trip does not block the event loop
+    with track_stage("persona_selection"):
+        response = await call_llm("persona_selection", single_response(
+            lambda: LLMChain(llm=chat, prompt=persona_selection_prompt).ainvoke({"question": question_text, "personas": personas_string})))
+    log_payload(logger, "Persona selection response", response)
+    LLM_TOKENS.inc(count_tokens(prompt_content), stage="persona_selection", kind="prompt")
+    LLM_TOKENS.inc(count_tokens(response.get("text", "") if isinstance(response, dict) else str(response)),
+                   stage="persona_selection", kind="completion")
+
+    if isinstance(response, dict):
+        selection = response
+    else:
         try:
-            selected_personas = [selection['persona1'], selection['persona2'], selection['persona3']]
-        except KeyError as e:
-            logger.error(f"Key error: {e}")
-            raise HTTPException(status_code=500, detail=f"Expected key {e} not found in persona selection output")
+            selection = output_parser.parse(response)
+        except Exception as e:
+            logger.error(f"Error parsing OpenAI response: {e}")
+            logger.error(f"Problematic response: {response}")
+            raise HTTPException(status_code=500, detail="Error parsing OpenAI response")
+
+    log_payload(logger, "Parsed persona selection", selection)
+
+    # Check if the output is wrapped in markdown code fences in the 'text' key
+    if "text" in selection:
+        raw_text = selection["text"]
+        # Remove markdown code fences and any 'json' language identifiers.
+        cleaned_text = re.sub(r'^```(?:json)?\s*', '', raw_text).strip()
+        cleaned_text = re.sub(r'\s*```$', '', cleaned_text).strip()
+        try:
+            # Now parse the cleaned JSON string.
+            selection = json.loads(cleaned_text)
+        except Exception as e:
+            logger.error(f"Error parsing cleaned JSON: {e}")
+            raise HTTPException(status_code=500, detail="Error parsing persona selection output")
 
-        # Continue with your persona validation and definition retrieval...
-        validated_personas = validate_persona_selection(selected_personas)
-        logger.info(f"Validated selected personas: {validated_personas}")
+    # Now you should have keys 'persona1', 'persona2', 'persona3'
+    try:
+        selected_personas = [selection['persona1'], selection['persona2'], selection['persona3']]
+    except KeyError as e:
+        logger.error(f"Key error: {e}")
+        raise HTTPException(status_code=500, detail=f"Expected key {e} not found in persona selection output")
 
-        selected_persona_definitions = [get_persona_definition(persona) for persona in validated_personas]
-        logger.info(f"Selected persona definitions: {selected_persona_definitions}")
+    # Continue with your persona validation and definition retrieval...
+    validated_personas = validate_persona_selection(selected_personas)
+    logger.info(f"Validated selected personas: {validated_personas}")
 
-        rationales = selection.get('rationale', {})
-        if not isinstance(rationales, dict):
-            logger.error(f"Rationale is not a dictionary: {rationales}")
-            rationales = {}
+    selected_persona_definitions = [get_persona_definition(persona) for persona in validated_personas]
+    logger.info(f"Selected persona definitions: {[persona.key for persona in selected_persona_definitions]}")
 
-        missing_rationales = [p for p in validated_personas if p not in rationales]
+    rationales = selection.get('rationale', {})
+    if not isinstance(rationales, dict):
+        logger.error(f"Rationale is not a dictionary: {rationales}")
+        rationales = {}
+
+    missing_rationales = [p for p in validated_personas if p not in rationales]
         
-        if missing_rationales:
-            logger.warning(f"Missing rationales for: {missing_rationales}")
+    if missing_rationales:
+        logger.warning(f"Missing rationales for: {missing_rationales}")
             
-            # Make another API call to get missing rationales
-            missing_rationale_prompt = PromptTemplate(
-                input_variables=["question", "personas"],
-                template="""
-                For the following question: {question}
+        # Make another API call to get missing rationales
+        missing_rationale_prompt = PromptTemplate(
+            input_variables=["question", "personas"],
+            template="""
+            For the following question: {question}
                 
-                Provide a clear and specific rationale for selecting each of these personas as it relates to exploring the nature of the question posed:
-                {personas}
+            Provide a clear and specific rationale for selecting each of these personas as it relates to exploring the nature of the question posed:
+            {personas}
                 
-                Your response must be a dictionary where each key is a persona name and the value is the rationale.
-                """
-            )
+            Your response must be a dictionary where each key is a persona name and the value is the rationale.
+            """
+        )
             
-            missing_rationale_response = LLMChain(llm=chat, prompt=missing_rationale_prompt).run(question=question.text, personas=", ".join(missing_rationales))
+        with track_stage("persona_rationale"):
+            missing_rationale_response = await call_llm("persona_rationale", single_response(
+                lambda: LLMChain(llm=chat, prompt=missing_rationale_prompt).arun(question=question_text, personas=", ".join(missing_rationales))))
             
-            try:
-                additional_rationales = json.loads(missing_rationale_response)
-                rationales.update(additional_rationales)
-            except json.JSONDecodeError:
-                logger.error(f"Error parsing additional rationales: {missing_rationale_response}")
-                raise HTTPException(status_code=500, detail="Error generating complete rationales")
-
-        logger.info(f"Final rationales: {json.dumps(rationales, indent=2)}")
-
-        # Return the result with key "selectedPersonas" for the frontend
-        result = {
-            "selectedPersonas": [
-                {
-                    "name": persona.get('name', 'Unknown'),
-                    "role": persona.get('role', 'Unknown'),
-                    "background": persona.get('background', 'No background available'),
-                    "core_expertise": persona.get('core_expertise', []),
-                    "cognitive_approach": persona.get('cognitive_approach', ''),
-                    "values_and_motivations": persona.get('values_and_motivations', ''),
-                    "communication_style": persona.get('communication_style', ''),
-                    "notable_trait": persona.get('notable_trait', ''),
-                    "rationale": rationales.get(persona['original_role'], "Error: No rationale provided")
-                }
-                for persona in selected_persona_definitions
-            ]
-        }
+        try:
+            additional_rationales = json.loads(missing_rationale_response)
+            rationales.update(additional_rationales)
+        except json.JSONDecodeError:
+            logger.error(f"Error parsing additional rationales: {missing_rationale_response}")
+            raise HTTPException(status_code=500, detail="Error generating complete rationales")
+
+    log_payload(logger, "Final rationales", rationales)
+
+    # Return the result with key "selectedPersonas" for the frontend
+    result = format_selected_personas(selected_persona_definitions, rationales)
+
+    log_payload(logger, "Returning personas", result)
+    await selection_cache.set(question_text, personas_version, result)
+    return result
+
+async def run_stage(conversation, prompt, stage, emit=None, remember=True, deadline=None):
+    """Run one pipeline prompt through the conversation, streaming its tokens to emit."""
+    with track_stage(stage):
+        prompt_text = conversation.format_prompt(stage, prompt)
+
+        async def attempt(claim):
+            chunks = []
+            async for chunk in conversation.llm.astream(prompt_text):
+                if chunk.content:
+                    # Only the first attempt to produce output (hedging may start two) streams it
+                    if not chunks and not claim():
+                        raise asyncio.CancelledError
+                    chunks.append(chunk.content)
+                    if emit:
+                        emit("token", {"stage": stage, "token": chunk.content})
+            if not chunks and not claim():
+                raise asyncio.CancelledError
+            return "".join(chunks)
+
+        def on_retry(number, error):
+            # Tokens already streamed for this stage are superseded by the next attempt's
+            if emit:
+                emit("retry", {"stage": stage, "attempt": number + 1, "detail": str(error)})
+
+        content = await call_llm(stage, attempt, deadline=deadline, on_retry=on_retry)
+        conversation.record_usage(stage, prompt_text, content)
+        if remember:
+            await conversation.record(stage, prompt, content)
+    # Count this stage's tokens, and those of any summary the memory wrote while recording it
+    for label, usage in ((stage, conversation.token_usage.get(stage)),
+                         ("memory_summary", conversation.token_usage.get(f"memory_summary_after_{stage}"))):
+        if usage is not None:
+            LLM_TOKENS.inc(usage["prompt_tokens"], stage=label, kind="prompt")
+            LLM_TOKENS.inc(usage["completion_tokens"], stage=label, kind="completion")
+    if emit:
+        emit("stage", {"stage": stage, "content": content})
+    return content
+
+@track_pipeline("improvement")
+async def run_improvement(question, personas, emit=None, memory_strategy=None, checkpoint=None):
+    """
+    Run the 11-prompt improvement pipeline, reporting each stage to emit as soon as it completes.
 
-        logger.info(f"Returning personas: {json.dumps(result, indent=2)}")
-        return result
+    With a session checkpoint, each completed stage is saved to it, and stages an
+    earlier run of the session completed are replayed from it instead of run again.
+    """
+    # Turn the request away before its first stage if the LLM queue is already full
+    llm_scheduler.check_admission()
+    # Every stage, including retries, has to finish within the pipeline deadline
+    deadline = Deadline()
+    # Full persona definitions for the prompt, pre-rendered for personas served from the catalog
+    persona_info = "\n\n".join(persona_catalog.prompt_block(persona) for persona in personas)
+
+    # Shared ChatOpenAI model from the pooled client registry
+    chat = llm_clients.get_chat_model(model='o3-mini', temperature=1)
+
+    # Conversation memory decides how much of the earlier stages each prompt sees; a
+    # resumed session starts from the memory as it was after its last completed stage
+    conversation = create_memory(chat, memory_strategy, checkpoint.memory if checkpoint else None)
+
+    async def checkpointed_stage(conversation, prompt, stage, remember=True):
+        if checkpoint is not None and stage in checkpoint.stages:
+            content = checkpoint.stages[stage]
+            SESSION_STAGES_RESUMED.inc(stage=stage)
+            if emit:
+                emit("stage", {"stage": stage, "content": content, "resumed": True})
+            return content
+        content = await run_stage(conversation, prompt, stage, emit, remember=remember, deadline=deadline)
+        if checkpoint is not None:
+            await checkpoint.save(stage, content, conversation.state())
+        return content
+
+    # Prompt 1: Brainstorm
+    prompt_1_template = PromptTemplate(
+        input_variables=["selected_personas", "question"],
+        template="""
+        You are a QuestionCrafter reasoning agent using three unique, specified personas to reason collectively step-by-step to ultimately provide 
+        the best possible quality improvement to a given user-posed question by arriving at a synthesized improved version of the question.
+
+        To begin with, allow each persona to share their initial insights about the following question. 
+        Detail your perspective, drawing on specific knowledge, experiences, and pioneering concepts from your field.
+        Aim to uncover new angles and dimensions of the question, demonstrating how your unique expertise contributes 
+        to a multifaceted understanding. In subsequent prompts, we'll engage in a collaborative process where these 
+        perspectives are woven into an intricate network of thoughts. Later in the conversation, we'll highlight how 
+        each viewpoint complements or challenges the others, constructing a more multidimensional and higher quality question 
+        to pose back to the user who asked the initial question.
+
+        The personas are:
+        {selected_personas}
+
+        The question is: {question}
+        
+        Please output each persona's individual initial response to the question on a new line.
+        """
+    )
 
-    except Exception as e:
-        logger.error(f"Error occurred during persona selection: {str(e)}", exc_info=True)
-        raise HTTPException(status_code=500, detail=str(e))
+    prompt_1 = prompt_1_template.format(selected_personas=persona_info, question=question)
+    first = await checkpointed_stage(conversation, prompt_1, "brainstorm")
+    log_payload(logger, "Stage response", first, stage="brainstorm")
 
-# Improve Question
-@app.post("/improve-question")
-async def improve_question(request: dict):
-    try:
-        logger.info(f"Improving question: {request['text']}")
-        
-        question = request['text']
-        # Ensure that the request payload contains persona data (either as "personas" or "selectedPersonas")
-        personas = request.get('personas') or request.get('selectedPersonas')
-        if not personas:
-            raise HTTPException(status_code=422, detail="Personas data is missing from the request")
-        
-        # Format full persona definitions for the prompt
-        persona_info = "\n\n".join([
-            f"Name: {persona['name']}\n"
-            f"Role: {persona['role']}\n"
-            f"Background: {persona['background']}\n"
-            f"Core Expertise: {', '.join(persona['core_expertise'])}\n"
-            f"Cognitive Approach: {persona['cognitive_approach']}\n"
-            f"Values and Motivations: {persona['values_and_motivations']}\n"
-            f"Communication Style: {persona['communication_style']}\n"
-            f"Notable Trait: {persona['notable_trait']}\n"
-            f"Rationale for Selection: {persona['rationale']}"
-            for persona in personas
-        ]) 
-
-        # Initialize ChatOpenAI model
-        chat = ChatOpenAI(temperature=1,
-                          openai_api_key=openai_api_key,
-                          model='o3-mini')
-
-        conversation = ConversationChain(
-            llm=chat,
-            memory=ConversationBufferMemory()
-        )
+    # Prompt 2: Self<>Peer Criticism
+    prompt_2 = """
+    Adopt a critical lens. Evaluate and challenge your own initial analysis and the analyses provided by your peers.
+    As each expert, critically examine the collective insights thus far, aiming not just to critique but to enrich and expand upon them in helpful ways.
+    This process should delve into identifying underlying assumptions, potential biases, and areas where further exploration could yield significant insights, thereby enhancing the collective understanding.
+    """
+    second = await checkpointed_stage(conversation, prompt_2, "critique")
+    log_payload(logger, "Stage response", second, stage="critique")
 
-        # Prompt 1: Brainstorm
-        prompt_1_template = PromptTemplate(
-            input_variables=["selected_personas", "question"],
-            template="""
-            You are a QuestionCrafter reasoning agent using three unique, specified personas to reason collectively step-by-step to ultimately provide 
-            the best possible quality improvement to a given user-posed question by arriving at a synthesized improved version of the question.
+    # Prompt 3: Self<>Peer Evaluation
+    prompt_3 = """
+    Reflect on the critiques received, and adapt your perspectives accordingly. 
+    This prompt is about evolution and expansion of thought, where you reassess and reformulate ideas, creating a more nuanced and comprehensive network of interconnected ideas and insights in relation to the question.
 
-            To begin with, allow each persona to share their initial insights about the following question. 
-            Detail your perspective, drawing on specific knowledge, experiences, and pioneering concepts from your field.
-            Aim to uncover new angles and dimensions of the question, demonstrating how your unique expertise contributes 
-            to a multifaceted understanding. In subsequent prompts, we'll engage in a collaborative process where these 
-            perspectives are woven into an intricate network of thoughts. Later in the conversation, we'll highlight how 
-            each viewpoint complements or challenges the others, constructing a more multidimensional and higher quality question 
-            to pose back to the user who asked the initial question.
+    Prioritize assertions that are well-supported, constructive and resilient to scrutiny.
+    """
+    third = await checkpointed_stage(conversation, prompt_3, "evaluation")
+    log_payload(logger, "Stage response", third, stage="evaluation")
 
-            The personas are:
-            {selected_personas}
+    # Prompt 4: Expand, Explore, Branch, Network
+    prompt_4 = """
+    In this stage, weave a network of thoughts by integrating critiques and alternative perspectives.
+    Focus on how new ideas can interconnect with and enhance existing thoughts. 
+    Explore the potential of novel concepts to form new nodes in this thought network. 
 
-            The question is: {question}
-            
-            Please output each persona's individual initial response to the question on a new line.
-            """
-        )
+    Push the boundaries of conventional thinking. Each persona explores new, divergent ideas, stimulated by the feedback loop. 
+    
+    Critically assess how these ideas contribute fresh insights, creating a richer and more intricate web of understanding, or introducing new deeper dimensions to the question. Consider pivoting to new lines of reasoning that promise to add valuable connections to this evolving thought network. Branch out as you wish!
+    """
+    fourth = await checkpointed_stage(conversation, prompt_4, "expansion")
+    log_payload(logger, "Stage response", fourth, stage="expansion")
 
-        prompt_1 = prompt_1_template.format(selected_personas=persona_info, question=question)
-        first = get_content(conversation.invoke(prompt_1))
-        logger.info(f"Prompt 1 Response: {first}")
+    # Prompt 5: Convergence on Best Individual Answer, as a JSON object keyed by persona name
+    persona_names = [persona['name'] for persona in personas]
+    prompt_5 = f"""
+    Now, it's time for each expert to finalize their thoughts and converge on a best answer. Synthesize the insights into a coherent individual answer that will be super helpful to the person who asked the original question.
 
-        # Prompt 2: Self<>Peer Criticism
-        prompt_2 = """
-        Adopt a critical lens. Evaluate and challenge your own initial analysis and the analyses provided by your peers.
-        As each expert, critically examine the collective insights thus far, aiming not just to critique but to enrich and expand upon them in helpful ways.
-        This process should delve into identifying underlying assumptions, potential biases, and areas where further exploration could yield significant insights, thereby enhancing the collective understanding.
-        """
-        second = get_content(conversation.invoke(prompt_2))
-        logger.info(f"Prompt 2 Response: {second}")
+    Reflect on the entire dialogue, considering how your thoughts evolved.
+    The final best answer here should not only represent your strongest answer with any valid and useful insights from others that you integrated.
+    
+    For each expert, provide a concise summary of their final best answer to the original question.
+    Each summary should:
+        1. Be no more than 3-4 sentences of helpful, useful insight, encapsulating the essence of your best thoughts about the question. If the oriiginal question implies that the person asking it is seeking advice, make your answer actionable and specific in the most contextually relevant way. 
+        2. Optimize for truth, helpfulness, and practicality
+        3. Highlight any useful insight or anything fundamentally profound you've communicated to the pursuit of this inquiry
+        4. Avoid repetition of information covered by other experts.
 
-        # Prompt 3: Self<>Peer Evaluation
-        prompt_3 = """
-        Reflect on the critiques received, and adapt your perspectives accordingly. 
-        This prompt is about evolution and expansion of thought, where you reassess and reformulate ideas, creating a more nuanced and comprehensive network of interconnected ideas and insights in relation to the question.
+    Based on this, as each expert, what is your best answer to the initial question: {question}?
 
-        Prioritize assertions that are well-supported, constructive and resilient to scrutiny.
-        """
-        third = get_content(conversation.invoke(prompt_3))
-        logger.info(f"Prompt 3 Response: {third}")
+    {answer_format_instructions(persona_names)} I know you'll do great!
+    """
+    fifth = await checkpointed_stage(conversation, prompt_5, "convergence")
+    log_payload(logger, "Stage response", fifth, stage="convergence")
+
+    # Parse individual answers from prompt 5 output
+    logger.info("Parsing individual expert answers")
+    with track_stage("answer_parsing"):
+        parsed = parse_individual_answers(fifth, persona_names)
+    if parsed.method != "json":
+        logger.warning(f"Individual answers were not valid JSON, parsed with method: {parsed.method}")
+        ANSWER_PARSE_FALLBACKS.inc(fallback=parsed.method)
+    for persona_name in parsed.missing:
+        logger.error(f"No answer found for persona {persona_name}, using a placeholder")
+        ANSWER_PARSE_FALLBACKS.inc(fallback="default_answer")
+    individual_answers = parsed.answers
+    log_payload(logger, "Individual answers", individual_answers)
+
+    if emit:
+        emit("stage", {"stage": "individual_answers", "content": individual_answers})
+
+    # Prompt 6: Convergence on Best Collective Answer
+    prompt_6 = """
+    Facilitate a synthesis of the individual experts' answers to forge a unified, comprehensive answer to the original question that combines the best elements from each persona's insights.
+    
+    This response should be a testament to the depth of of the thought network, 
+    showcasing how the perspectives can coalesce into a singular, insightful, and useful narrative.
 
-        # Prompt 4: Expand, Explore, Branch, Network
-        prompt_4 = """
-        In this stage, weave a network of thoughts by integrating critiques and alternative perspectives.
-        Focus on how new ideas can interconnect with and enhance existing thoughts. 
-        Explore the potential of novel concepts to form new nodes in this thought network. 
+    The synthesized answer should not be formulated in explicit terms specific to each persona's own definition or agenda, but rather it should be phrased in a way that seeks to inspire and uncover deeper truths, regardless of what personas happened to be involved in this discussion. 
+    
+    A great answer will transcend the limited view of any one expert, and will be useful to the human who asked the original question to reflect deeper and to potentially illuminate novel, useful pathways of reasoning forward. The user is expecting some very helpful and profound insights in this section, so thank you for doing your best on crafting this final answer!
+    """
+    sixth = await checkpointed_stage(conversation, prompt_6, "final_answer")
+    log_payload(logger, "Stage response", sixth, stage="final_answer")
 
-        Push the boundaries of conventional thinking. Each persona explores new, divergent ideas, stimulated by the feedback loop. 
-        
-        Critically assess how these ideas contribute fresh insights, creating a richer and more intricate web of understanding, or introducing new deeper dimensions to the question. Consider pivoting to new lines of reasoning that promise to add valuable connections to this evolving thought network. Branch out as you wish!
-        """
-        fourth = get_content(conversation.invoke(prompt_4))
-        logger.info(f"Prompt 4 Response: {fourth}")
+    # Prompt 7: New Enhanced Question
+    prompt_7 = f"""
+    As we conclude our collaborative journey and after thorough analysis and reflection on the entire discussion,
+    let's now focus on the final objective - to vastly elevate the original question into a more insightful and universally engaging form. 
 
-        # Prompt 5: Convergence on Best Individual Answer
-        prompt_5 = f"""
-        Now, it's time for each expert to finalize their thoughts and converge on a best answer. Synthesize the insights into a coherent individual answer that will be super helpful to the person who asked the original question.
+    After going through the following thoughts, please take a deep breath and generate a far higher quality version of the original question.
 
-        Reflect on the entire dialogue, considering how your thoughts evolved.
-        The final best answer here should not only represent your strongest answer with any valid and useful insights from others that you integrated.
-        
-        For each expert, provide a concise summary of their final best answer to the original question.
-        Each summary should:
-            1. Be no more than 3-4 sentences of helpful, useful insight, encapsulating the essence of your best thoughts about the question. If the oriiginal question implies that the person asking it is seeking advice, make your answer actionable and specific in the most contextually relevant way. 
-            2. Optimize for truth, helpfulness, and practicality
-            3. Highlight any useful insight or anything fundamentally profound you've communicated to the pursuit of this inquiry
-            4. Avoid repetition of information covered by other experts.
+    Reformulate the initial question by weaving in the rich insights gained through this networked reasoning process. 
 
-        Based on this, as each expert, what is your best answer to the initial question: {question}?
+    The new question should be deeper, clearer, and designed to catalyze more curiosity and invite more comprehensive exploration. That doesn't mean making it too complex though, keep it straightforward for the user. Not too much of a mouthful, but deeper and more illuminating.
 
-        Format the output with the persona's name, title, and their best answer. I know you'll do great!
-        """
-        fifth = get_content(conversation.invoke(prompt_5))
-        logger.info(f"Prompt 5 Response: {fifth}")
+    Here are some thoughts to consider before you propose an improved version of the question:
 
-        # Parse individual answers from prompt 5 output
-        individual_answers = []
-        logger.info("Parsing individual expert answers")
-        try:
-            # Extract each persona's answer using regex
-            for persona in personas:
-                persona_name = persona['name']
-                logger.info(f"Looking for answer from {persona_name}")
-                
-                # Look for patterns like "Name: [Persona Name]" followed by text
-                pattern = rf"{persona_name}(?:.*?):(.*?)(?:(?:\n\n.*?:)|$)"
-                answer = re.search(pattern, fifth, re.DOTALL | re.IGNORECASE)
-                
-                if answer:
-                    answer_text = answer.group(1).strip()
-                    logger.info(f"Found answer for {persona_name}: {answer_text[:50]}...")
-                    individual_answers.append({
-                        "name": persona_name,
-                        "answer": answer_text
-                    })
-                else:
-                    logger.warning(f"Failed to extract answer for persona {persona_name}")
-                    # Try a more lenient pattern just looking for the name
-                    alt_pattern = rf"{persona_name}[^\n]*\n(.*?)(?:\n\n|\n[A-Z]|\Z)"
-                    alt_answer = re.search(alt_pattern, fifth, re.DOTALL)
-                    
-                    if alt_answer:
-                        answer_text = alt_answer.group(1).strip()
-                        logger.info(f"Found answer with alt pattern for {persona_name}: {answer_text[:50]}...")
-                        individual_answers.append({
-                            "name": persona_name,
-                            "answer": answer_text
-                        })
-                    else:
-                        logger.error(f"Completely failed to extract answer for persona {persona_name}")
-                        # Add default answer for this persona
-                        individual_answers.append({
-                            "name": persona_name,
-                            "answer": "This expert contributed their perspective to the final refinement."
-                        })
-            
-            # Log the full structure of the individual answers
-            logger.info(f"All individual answers: {json.dumps(individual_answers, indent=2)}")
-        except Exception as e:
-            logger.error(f"Error parsing individual answers: {str(e)}", exc_info=True)
-            # Provide fallback answers
-            for persona in personas:
-                individual_answers.append({
-                    "name": persona['name'],
-                    "answer": "This expert contributed to refining the question."
-                })
-
-        # Prompt 6: Convergence on Best Collective Answer
-        prompt_6 = """
-        Facilitate a synthesis of the individual experts' answers to forge a unified, comprehensive answer to the original question that combines the best elements from each persona's insights.
-        
-        This response should be a testament to the depth of of the thought network, 
-        showcasing how the perspectives can coalesce into a singular, insightful, and useful narrative.
+    1. Balanced Scope & Structure
 
-        The synthesized answer should not be formulated in explicit terms specific to each persona's own definition or agenda, but rather it should be phrased in a way that seeks to inspire and uncover deeper truths, regardless of what personas happened to be involved in this discussion. 
-        
-        A great answer will transcend the limited view of any one expert, and will be useful to the human who asked the original question to reflect deeper and to potentially illuminate novel, useful pathways of reasoning forward. The user is expecting some very helpful and profound insights in this section, so thank you for doing your best on crafting this final answer!
-        """
-        sixth = get_content(conversation.invoke(prompt_6))
-        logger.info(f"Prompt 6 Response: {sixth}")
+        - Does the question identify clear dimensions of inquiry without overwhelming?
+        - Does it create natural "hooks" for exploration while maintaining focus?
+        - Is there a logical flow to how concepts are connected?
 
-        # Prompt 7: New Enhanced Question
-        prompt_7 = f"""
-        As we conclude our collaborative journey and after thorough analysis and reflection on the entire discussion,
-        let's now focus on the final objective - to vastly elevate the original question into a more insightful and universally engaging form. 
+    2. Precision with Breathing Room
 
-        After going through the following thoughts, please take a deep breath and generate a far higher quality version of the original question.
+        - Are key terms specific enough to guide thought but open enough to invite interpretation?
+        - Does the question avoid unnecessary qualifiers or redundant concepts?
+        - Can the question be understood on first reading while still rewarding deeper consideration?
 
-        Reformulate the initial question by weaving in the rich insights gained through this networked reasoning process. 
+    3. Invitation to Multi-Level Analysis
 
-        The new question should be deeper, clearer, and designed to catalyze more curiosity and invite more comprehensive exploration. That doesn't mean making it too complex though, keep it straightforward for the user. Not too much of a mouthful, but deeper and more illuminating.
+        - Does the question naturally lead to both practical and theoretical explorations?
+        - Does it create space for both immediate responses and longer-term reflection?
 
-        Here are some thoughts to consider before you propose an improved version of the question:
+    4. Dialogic Potential
 
-        1. Balanced Scope & Structure
+        - Does the question set up natural follow-up areas without explicitly listing them?
+        - Can it spark discussion without requiring extensive context or definition?
+        - Does it invite both personal experience and broader analysis?
 
-            - Does the question identify clear dimensions of inquiry without overwhelming?
-            - Does it create natural "hooks" for exploration while maintaining focus?
-            - Is there a logical flow to how concepts are connected?
+    5. Generative Balance
 
-        2. Precision with Breathing Room
+        - Does the complexity serve a purpose rather than just adding words?
+        - Is there a clear central inquiry with room for branching exploration?
+        - Does it avoid the extremes of being either too basic or unnecessarily complex?
 
-            - Are key terms specific enough to guide thought but open enough to invite interpretation?
-            - Does the question avoid unnecessary qualifiers or redundant concepts?
-            - Can the question be understood on first reading while still rewarding deeper consideration?
+    Remember, the goal is to inspire curiosity and invite deeper exploration while remaining clear and concise.
 
-        3. Invitation to Multi-Level Analysis
+    As a reminder, the original question was {question}
 
-            - Does the question naturally lead to both practical and theoretical explorations?
-            - Does it create space for both immediate responses and longer-term reflection?
+    Please provide only the improved question in your response. Thanks again for your help in catalyzing the user to think deeper. Take a deep breath, and do your best!
+    """
+    improved_question = await checkpointed_stage(conversation, prompt_7, "improved_question")
+    log_payload(logger, "Stage response", improved_question, stage="improved_question")
+
+    # Prompt 8: Summary of conversation, any major insights and turning points
+    prompt_8 = """
+    Provide a brief summary of this conversation's evolution in a single paragraph.
+    Focus on:
+        1. Each expert's persona and their key contributions.
+        2. How the perspectives were integrated and refined.
+        3. The main turning points or breakthroughs in understanding.
+        4. How the final question emerged from this process.
+    
+    Aim for clarity and conciseness, highlighting only the most significant aspects of the journey.
+    """
 
-        4. Dialogic Potential
+    # Prompt 9: Rationale for Refinement
+    prompt_9 = """
+    Generate a rationale for this refinement.
+    
+    In a 1-2 concise bullet point list, explain how this new refined version improves the quality, depth, and effectiveness of the original question, and in contrast, explain the key limitation of the orginal question.
 
-            - Does the question set up natural follow-up areas without explicitly listing them?
-            - Can it spark discussion without requiring extensive context or definition?
-            - Does it invite both personal experience and broader analysis?
+    Additionally, please list the main dimensions/elements to the new question, and why they are important to consider.
 
-        5. Generative Balance
+    Use markdown as your answer format.
+    """
 
-            - Does the complexity serve a purpose rather than just adding words?
-            - Is there a clear central inquiry with room for branching exploration?
-            - Does it avoid the extremes of being either too basic or unnecessarily complex?
+    # Prompt 10: Harmony Seeking Loop
+    prompt_10 = """
+    Identify a deep fundamental principle that all personas can agree upon. 
+    In 2-3 sentences, explain:
+        1. What this shared foundation is.
+        2. How it influenced the collective reasoning process.
+    
+    Focus on the core idea, concept, or principle that bridges the different perspectives and its impact on the discussion. Really go deep here to see something foundational, profound, yet simple!
+    """
 
-        Remember, the goal is to inspire curiosity and invite deeper exploration while remaining clear and concise.
+    # Prompt 11: Explore New Dimensions
+    prompt_11 = """
+    Using a synthesized perspective, help the person who asked the initial question to explore new and related dimensions:
+    
+    Potential Exploration Pathways: Offer possible directions, sub-questions, or meta-questions for further exploration based on the enhanced question. This helps the user to spark more interesting avenues of inquiry.
 
-        As a reminder, the original question was {question}
+    Further Reading/Resources: Include links or references to relevant literature, articles, people of interest, or studies that can provide more context or information related to the enhanced question.
 
-        Please provide only the improved question in your response. Thanks again for your help in catalyzing the user to think deeper. Take a deep breath, and do your best!
-        """
-        improved_question = get_content(conversation.invoke(prompt_7))
-        logger.info(f"Improved question: {improved_question}")
-
-        # Prompt 8: Summary of conversation, any major insights and turning points
-        prompt_8 = """
-        Provide a brief summary of this conversation's evolution in a single paragraph.
-        Focus on:
-            1. Each expert's persona and their key contributions.
-            2. How the perspectives were integrated and refined.
-            3. The main turning points or breakthroughs in understanding.
-            4. How the final question emerged from this process.
-        
-        Aim for clarity and conciseness, highlighting only the most significant aspects of the journey.
-        """
-        eighth = get_content(conversation.invoke(prompt_8))
-        logger.info(f"Conversation summary: {eighth}")
+    Do not use markdown for your answer.
+    """
 
-        # Prompt 9: Rationale for Refinement
-        prompt_9 = """
-        Generate a rationale for this refinement.
-        
-        In a 1-2 concise bullet point list, explain how this new refined version improves the quality, depth, and effectiveness of the original question, and in contrast, explain the key limitation of the orginal question.
+    # Prompts 8-11 only read the conversation up to the improved question and do not
+    # depend on each other, so each one runs concurrently on its own snapshot of it.
+    # Nothing reads those snapshots afterwards, so their turns are not recorded.
+    post_synthesis_stages = [
+        (prompt_8, "summary"),
+        (prompt_9, "rationale"),
+        (prompt_10, "harmony_principle"),
+        (prompt_11, "new_dimensions"),
+    ]
+    results = await asyncio.gather(*[
+        checkpointed_stage(conversation.fork(), prompt, stage, remember=False)
+        for prompt, stage in post_synthesis_stages
+    ], return_exceptions=True)
+    # These stages only add to a finished answer, so one that still fails after its
+    # retries is left empty rather than failing the whole pipeline
+    failed_stages = []
+    for index, ((_, stage), content) in enumerate(zip(post_synthesis_stages, results)):
+        if isinstance(content, asyncio.CancelledError):
+            raise content
+        if isinstance(content, Exception):
+            logger.error(f"Stage {stage} failed, returning the result without it: {str(content)}")
+            failed_stages.append(stage)
+            if emit:
+                emit("stage_failed", {"stage": stage, "detail": str(content)})
+            results[index] = ""
+        else:
+            log_payload(logger, "Stage response", content, stage=stage)
+    eighth, ninth, tenth, eleventh = results
 
-        Additionally, please list the main dimensions/elements to the new question, and why they are important to consider.
+    token_usage = conversation.usage_report()
+    logger.info(f"Token usage ({token_usage['memory_strategy']} memory): "
+                f"{token_usage['prompt_tokens']} prompt, {token_usage['completion_tokens']} completion")
 
-        Use markdown as your answer format.
-        """
-        ninth = get_content(conversation.invoke(prompt_9))
-        logger.info(f"Rationale: {ninth}")
-
-        # Prompt 10: Harmony Seeking Loop
-        prompt_10 = """
-        Identify a deep fundamental principle that all personas can agree upon. 
-        In 2-3 sentences, explain:
-            1. What this shared foundation is.
-            2. How it influenced the collective reasoning process.
-        
-        Focus on the core idea, concept, or principle that bridges the different perspectives and its impact on the discussion. Really go deep here to see something foundational, profound, yet simple!
-        """
-        tenth = get_content(conversation.invoke(prompt_10))
-        logger.info(f"Harmony Principle: {tenth}")
+    metadata = {"token_usage": token_usage, "failed_stages": failed_stages}
+    if checkpoint is not None:
+        metadata.update(session_id=checkpoint.session_id, resumed_stages=checkpoint.resumed)
 
-        # Prompt 11: Explore New Dimensions
-        prompt_11 = """
-        Using a synthesized perspective, help the person who asked the initial question to explore new and related dimensions:
-        
-        Potential Exploration Pathways: Offer possible directions, sub-questions, or meta-questions for further exploration based on the enhanced question. This helps the user to spark more interesting avenues of inquiry.
+    # Return what's needed for the UI
+    return {
+        "improved_question": improved_question,
+        "final_answer": sixth,
+        "summary": eighth,
+        "rationale": ninth,
+        "harmony_principle": tenth,
+        "new_dimensions": eleventh,
+        "individual_answers": individual_answers,
+        "metadata": metadata
+    }
 
-        Further Reading/Resources: Include links or references to relevant literature, articles, people of interest, or studies that can provide more context or information related to the enhanced question.
+@app.get("/api/selection-cache/stats")
+async def get_selection_cache_stats():
+    """
+    Report persona-selection cache size and hit/miss counters
+    """
+    return await selection_cache.stats()
 
-        Do not use markdown for your answer.
-        """
-        eleventh = get_content(conversation.invoke(prompt_11))
-        logger.info(f"New Dimensions: {eleventh}")
-
-        # Return what's needed for the UI
-        return {
-            "improved_question": improved_question,
-            "final_answer": sixth,
-            "summary": eighth,
-            "rationale": ninth,
-            "harmony_principle": tenth,
-            "new_dimensions": eleventh,
-            "individual_answers": individual_answers
-        }
+def run_improvement_session(session_id, question, personas, emit=None, memory_strategy=None):
+    """Run (or resume) the improvement pipeline under a checkpointed session."""
+    return improvement_sessions.run(
+        session_id,
+        lambda checkpoint: run_improvement(checkpoint.question, checkpoint.personas, emit,
+                                           checkpoint.memory_strategy, checkpoint),
+        question, personas, memory_strategy,
+    )
+
+# Improve Question
+@app.post("/improve-question")
+async def improve_question(request: dict, response: Response, http_request: Request):
+    # Sent back on errors too, so the client can resume the session instead of starting over
+    session_headers = {}
+    try:
+        logger.info(f"Improving question: {request.get('text')}")
+
+        question = request.get('text')
+        # Ensure that the request payload contains persona data (either as "personas" or "selectedPersonas")
+        personas = request.get('personas') or request.get('selectedPersonas')
+        # A session id resumes that session (or starts it under that id); without one, a new session starts
+        session_id = request.get('session_id')
+        if session_id is not None and not valid_session_id(session_id):
+            raise HTTPException(status_code=422, detail="session_id must be 8-64 letters, digits, '-' or '_'")
+        if session_id is None and not question:
+            raise HTTPException(status_code=422, detail="Question text is missing from the request")
+        if session_id is None and not personas:
+            raise HTTPException(status_code=422, detail="Personas data is missing from the request")
+        memory_strategy = request.get('memory_strategy')
+        if memory_strategy and memory_strategy not in MEMORY_STRATEGIES:
+            raise HTTPException(status_code=422, detail=f"Unknown memory strategy: {memory_strategy}")
+
+        if session_id is not None:
+            # Retries of one session share its run; a request sending a different question, personas or
+            # memory strategy gets its own, so the session's conflict check answers it with a 409
+            key = coalescing_key("improvement", {"session_id": session_id,
+                                                 "question": question.strip() if question else None,
+                                                 "personas": personas, "memory_strategy": memory_strategy})
+        else:
+            # Identical improvements already running (same question, personas and memory) share one pipeline run
+            session_id = new_session_id()
+            key = coalescing_key("improvement", {"question": question.strip(), "personas": personas,
+                                                 "memory_strategy": memory_strategy})
+        session_headers["X-Session-ID"] = session_id
+        # If the client goes away, stop waiting; the shared run is cancelled once no caller is left
+        result = await cancel_on_disconnect(http_request, request_coalescer.run(
+            "improvement", key,
+            lambda: run_improvement_session(session_id, question, personas, memory_strategy=memory_strategy)))
+        # A coalesced request gets the session of the request whose run it shared
+        response.headers["X-Session-ID"] = result["metadata"]["session_id"]
+        return result
 
+    except HTTPException:
+        raise
+    except ClientDisconnected as e:
+        CLIENT_DISCONNECTS.inc(endpoint="improve_question")
+        # Nobody receives this response; 499 (client closed request) keeps it apart from errors in the metrics
+        raise HTTPException(status_code=499, detail=str(e), headers=session_headers)
+    except SessionNotFound:
+        raise HTTPException(status_code=404, detail=f"Session {session_id} not found or expired; "
+                                                    "send the question text and personas to start it again")
+    except SessionConflict as e:
+        raise HTTPException(status_code=409, detail=str(e), headers=session_headers)
+    except CoalescedWaitTimeout as e:
+        raise HTTPException(status_code=504, detail=str(e), headers=session_headers)
+    except LLMRejected as e:
+        raise HTTPException(status_code=e.status_code, detail=str(e),
+                            headers={**session_headers, "Retry-After": str(e.retry_after)})
+    except CircuitOpen as e:
+        raise HTTPException(status_code=503, detail=str(e),
+                            headers={**session_headers, "Retry-After": str(e.retry_after)})
+    except (StageTimeout, DeadlineExceeded) as e:
+        raise HTTPException(status_code=504, detail=str(e), headers=session_headers)
     except Exception as e:
         logger.error(f"Error occurred: {str(e)}", exc_info=True)
-        raise HTTPException(status_code=500, detail=str(e))
+        raise HTTPException(status_code=500, detail=str(e), headers=session_headers)
+
+@app.get("/api/sessions/{session_id}")
+async def get_improvement_session(session_id: str):
+    """
+    Get an improvement session's status and the stages it has completed so far, with its result once completed
+    """
+    try:
+        return await improvement_sessions.session(session_id)
+    except SessionNotFound:
+        raise HTTPException(status_code=404, detail=f"Session {session_id} not found or expired")
+
+def format_sse(event, data):
+    """Encode one server-sent event with a JSON payload."""
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+# Improve Question (streaming)
+@app.post("/improve-question/stream")
+async def improve_question_stream(request: dict, http_request: Request):
+    """
+    Stream the improvement pipeline as server-sent events.
+
+    Emits `token` events while a stage is generating, a `stage` event with the full
+    content as each stage completes, then a single `done` event carrying the same
+    payload as /improve-question (or an `error` event if the pipeline fails, with the
+    detail and HTTP status /improve-question would have answered with).
+    A `retry` event means the stage's tokens so far are discarded and the stage starts
+    over; a `stage_failed` event means an optional closing stage is left out.
+
+    The first event, `session`, carries the session id. Reconnecting with that
+    `session_id` replays the completed stages as `stage` events marked `resumed` and
+    continues from the first stage that had not completed.
+    """
+    logger.info(f"Streaming improvement for question: {request.get('text')}")
+
+    question = request.get('text')
+    personas = request.get('personas') or request.get('selectedPersonas')
+    session_id = request.get('session_id')
+    if session_id is not None and not valid_session_id(session_id):
+        raise HTTPException(status_code=422, detail="session_id must be 8-64 letters, digits, '-' or '_'")
+    if session_id is None and (not question or not personas):
+        raise HTTPException(status_code=422, detail="Question text and personas data are required")
+    session_id = session_id or new_session_id()
+    memory_strategy = request.get('memory_strategy')
+    if memory_strategy and memory_strategy not in MEMORY_STRATEGIES:
+        raise HTTPException(status_code=422, detail=f"Unknown memory strategy: {memory_strategy}")
+    try:
+        llm_scheduler.check_admission()
+    except LLMRejected as e:
+        raise HTTPException(status_code=e.status_code, detail=str(e), headers={"Retry-After": str(e.retry_after)})
+
+    queue = asyncio.Queue()
+
+    def emit(event, data):
+        queue.put_nowait((event, data))
+
+    async def produce():
+        try:
+            emit("session", {"session_id": session_id})
+            result = await cancel_on_disconnect(
+                http_request, run_improvement_session(session_id, question, personas, emit, memory_strategy))
+            emit("done", result)
+        except ClientDisconnected:
+            CLIENT_DISCONNECTS.inc(endpoint="improve_question_stream")
+        except asyncio.CancelledError:
+            # The response stream was closed under us, which also means the client is gone
+            CLIENT_DISCONNECTS.inc(endpoint="improve_question_stream")
+            raise
+        except SessionNotFound:
+            emit("error", {"detail": f"Session {session_id} not found or expired", "status": 404})
+        except SessionConflict as e:
+            emit("error", {"detail": str(e), "status": 409})
+        except LLMRejected as e:
+            emit("error", {"detail": str(e), "status": e.status_code, "retry_after": e.retry_after})
+        except CircuitOpen as e:
+            emit("error", {"detail": str(e), "status": 503, "retry_after": e.retry_after})
+        except (StageTimeout, DeadlineExceeded, CoalescedWaitTimeout) as e:
+            emit("error", {"detail": str(e), "status": 504})
+        except Exception as e:
+            logger.error(f"Error occurred during streamed improvement: {str(e)}", exc_info=True)
+            emit("error", {"detail": str(e), "status": 500})
+        finally:
+            queue.put_nowait(None)
+
+    async def event_stream():
+        task = asyncio.create_task(produce())
+        try:
+            while True:
+                item = await queue.get()
+                if item is None:
+                    break
+                yield format_sse(*item)
+        finally:
+            if not task.done():
+                task.cancel()
+
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no", "X-Session-ID": session_id}
+    )
+
+# Batch improvement jobs
+class BatchJobRequest(BaseModel):
+    questions: List[str]
+    mode: Literal["llm", "fast"] = "llm"
+    memory_strategy: Optional[str] = None
+
+async def run_batch_question(question_text, options):
+    """Select personas for one batch question and run the improvement pipeline with them."""
+    selection = await select_personas(Question(text=question_text, mode=options.get("mode", "llm")))
+    personas = selection["selectedPersonas"]
+    improvement = await run_improvement(question_text, personas, memory_strategy=options.get("memory_strategy"))
+    return {"selectedPersonas": personas, **improvement}
+
+@app.post("/api/jobs")
+async def create_batch_job(request: BatchJobRequest):
+    """
+    Submit a list of questions to improve in the background; returns the job id and status
+    """
+    questions = [question.strip() for question in request.questions if question and question.strip()]
+    if not questions:
+        raise HTTPException(status_code=422, detail="At least one question is required")
+    if len(questions) > BATCH_JOB_MAX_QUESTIONS:
+        raise HTTPException(status_code=422, detail=f"A batch job can hold at most {BATCH_JOB_MAX_QUESTIONS} questions")
+    if request.memory_strategy and request.memory_strategy not in MEMORY_STRATEGIES:
+        raise HTTPException(status_code=422, detail=f"Unknown memory strategy: {request.memory_strategy}")
+    try:
+        return await batch_jobs.submit(questions, {"mode": request.mode, "memory_strategy": request.memory_strategy})
+    except Exception as e:
+        logger.error(f"Error creating batch job: {str(e)}")
+        raise HTTPException(status_code=500, detail=f"Failed to create batch job: {str(e)}")
+
+@app.get("/api/jobs/{job_id}")
+async def get_batch_job(job_id: str):
+    """
+    Get a batch job's status and progress counts
+    """
+    try:
+        return await batch_jobs.status(job_id)
+    except JobNotFound:
+        raise HTTPException(status_code=404, detail=f"Batch job {job_id} not found")
+
+@app.get("/api/jobs/{job_id}/results")
+async def get_batch_job_results(
+    job_id: str,
+    offset: int = Query(0, ge=0),
+    limit: int = Query(50, ge=1, le=500),
+    status: Optional[str] = None,
+):
+    """
+    Get a page of a batch job's questions in submission order, with results for finished ones
+    """
+    try:
+        return {"jobId": job_id, "items": await batch_jobs.results(job_id, offset, limit, status)}
+    except JobNotFound:
+        raise HTTPException(status_code=404, detail=f"Batch job {job_id} not found")
+
+@app.post("/api/jobs/{job_id}/resume")
+async def resume_batch_job(job_id: str, retry_failed: bool = False):
+    """
+    Queue a job's unfinished questions again, optionally retrying the failed ones too
+    """
+    try:
+        return await batch_jobs.resume(job_id, retry_failed=retry_failed)
+    except JobNotFound:
+        raise HTTPException(status_code=404, detail=f"Batch job {job_id} not found")
+
+@app.get("/api/jobs/{job_id}/events")
+async def stream_batch_job(job_id: str):
+    """
+    Stream a batch job's progress as server-sent events.
+
+    Starts with a `status` event, then sends an `item` event as each question finishes
+    and a `progress` event with the updated counts, and ends with a `done` event once
+    every question has finished.
+    """
+    queue = batch_jobs.subscribe(job_id)
+    try:
+        job = await batch_jobs.status(job_id)
+    except JobNotFound:
+        batch_jobs.unsubscribe(job_id, queue)
+        raise HTTPException(status_code=404, detail=f"Batch job {job_id} not found")
+
+    async def event_stream():
+        try:
+            yield format_sse("status", job)
+            if job["status"] == "completed":
+                return
+            while True:
+                event, data = await queue.get()
+                yield format_sse(event, data)
+                if event == "done":
+                    break
+        finally:
+            batch_jobs.unsubscribe(job_id, queue)
+
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
 
 # Model for library entry submission
 class ExpertAnswer(BaseModel):
@@ -603,8 +1072,6 @@ async def submit_to_library(entry: LibraryEntry):
     try:
         logger.info(f"Submitting to library: {entry.originalQuestion}")
         
-        library_file = 'library_entries.json'
-        
         # Process individual answers to ensure consistent format
         processed_answers = []
         if entry.individualAnswers:
@@ -654,9 +1121,8 @@ async def submit_to_library(entry: LibraryEntry):
         else:
             logger.warning("Best answer is missing or empty")
         
-        # Create a new entry with additional metadata
+        # Create a new entry with additional metadata (the id is generated by the library store)
         new_entry = {
-            "id": int(time.time()),
             "originalQuestion": entry.originalQuestion,
             "refinedQuestion": entry.refinedQuestion,
             "expertPersonas": entry.expertPersonas,
@@ -679,62 +1145,94 @@ async def submit_to_library(entry: LibraryEntry):
             }
         }
         
-        # Check if library file exists, if not create it
-        if not os.path.exists(library_file):
-            logger.info(f"Creating new library file at {library_file}")
-            with open(library_file, 'w') as f:
-                json.dump({"entries": [new_entry]}, f, indent=2)
-            return {"success": True, "id": new_entry["id"]}
-        
-        # Read existing library data
-        with open(library_file, 'r') as f:
-            try:
-                library_data = json.load(f)
-            except json.JSONDecodeError:
-                logger.error("Error parsing library file")
-                library_data = {"entries": []}
-        
-        # Add new entry to library
-        if "entries" not in library_data:
-            library_data["entries"] = []
-            
-        library_data["entries"].append(new_entry)
-        
-        # Write updated data back to file
-        with open(library_file, 'w') as f:
-            json.dump(library_data, f, indent=2)
-            
-        logger.info(f"Successfully added entry to library with ID {new_entry['id']}")
-        return {"success": True, "id": new_entry["id"]}
+        with LIBRARY_OPERATION_SECONDS.time(operation="add_entry"):
+            entry_id = await library_writer.add_entry(new_entry)
+
+        logger.info(f"Successfully added entry to library with ID {entry_id}")
+        return {"success": True, "id": entry_id}
         
     except Exception as e:
         logger.error(f"Error submitting to library: {str(e)}")
         raise HTTPException(status_code=500, detail=f"Failed to submit to library: {str(e)}")
 
+def etag_matches(if_none_match, etag):
+    """True if an If-None-Match header value covers this ETag."""
+    if not if_none_match:
+        return False
+    candidates = [candidate.strip() for candidate in if_none_match.split(",")]
+    return "*" in candidates or etag in candidates or f"W/{etag}" in candidates
+
 @app.get("/api/library/entries")
-async def get_library_entries():
+async def get_library_entries(
+    request: Request,
+    category: Optional[str] = None,
+    tag: Optional[str] = None,
+    status: Optional[str] = None,
+    persona: Optional[str] = None,
+    sort: str = "date",
+    order: str = "desc",
+    limit: int = Query(LIBRARY_PAGE_SIZE, ge=1, le=LIBRARY_MAX_PAGE_SIZE),
+    cursor: Optional[str] = None,
+    fields: Optional[str] = None,
+):
     """
-    Get all entries from the question library
+    Get a page of entries from the question library.
+
+    Filter by category, tag, status or persona; sort by date, votes or views. Pass the
+    returned nextCursor back as `cursor` for the following page. `fields=summary` (or a
+    comma-separated list of entry field names) returns only those fields of each entry.
+    Responses carry an ETag; a matching If-None-Match gets 304 Not Modified.
     """
     try:
         logger.info("Fetching library entries")
-        library_file = 'library_entries.json'
-        
-        # Return empty list if file doesn't exist
-        if not os.path.exists(library_file):
-            logger.warning(f"Library file not found at {library_file}")
-            return {"entries": []}
-            
-        # Read and return library data
-        with open(library_file, 'r') as f:
-            try:
-                library_data = json.load(f)
-                logger.info(f"Successfully retrieved {len(library_data.get('entries', []))} library entries")
-                return library_data
-            except json.JSONDecodeError:
-                logger.error("Error parsing library file")
-                return {"entries": []}
-                
+        if sort not in SORT_COLUMNS:
+            raise HTTPException(status_code=400, detail=f"Invalid sort '{sort}'. Expected one of: {', '.join(SORT_COLUMNS)}")
+        if order not in ("asc", "desc"):
+            raise HTTPException(status_code=400, detail=f"Invalid order '{order}'. Expected 'asc' or 'desc'")
+        if fields == "summary":
+            projection = list(SUMMARY_FIELDS)
+        elif fields:
+            projection = list(dict.fromkeys(field.strip() for field in fields.split(",") if field.strip()))
+            unknown = [field for field in projection if field not in ENTRY_FIELDS]
+            if unknown:
+                raise HTTPException(status_code=400, detail=f"Unknown fields: {', '.join(unknown)}. "
+                                                            f"Expected any of: {', '.join(ENTRY_FIELDS)}")
+        else:
+            projection = None
+
+        try:
+            with LIBRARY_OPERATION_SECONDS.time(operation="query_entries"):
+                entries, next_cursor = await asyncio.to_thread(
+                    library.query_entries,
+                    category=category,
+                    tag=tag,
+                    status=status,
+                    persona=persona,
+                    sort=sort,
+                    descending=order == "desc",
+                    limit=limit,
+                    cursor=cursor,
+                    fields=projection,
+                )
+        except InvalidCursor as e:
+            raise HTTPException(status_code=400, detail=f"Invalid cursor: {str(e)}")
+
+        for entry in entries:
+            library_counters.overlay(entry, fields=projection)
+        body = json.dumps({"entries": entries, "nextCursor": next_cursor}).encode()
+        etag = f'"{hashlib.sha256(body).hexdigest()[:32]}"'
+        headers = {"ETag": etag, "Cache-Control": "no-cache"}
+
+        if etag_matches(request.headers.get("if-none-match"), etag):
+            logger.info("Library entries unchanged, returning 304")
+            LIBRARY_NOT_MODIFIED.inc()
+            return Response(status_code=304, headers=headers)
+
+        logger.info(f"Successfully retrieved {len(entries)} library entries")
+        return Response(content=body, media_type="application/json", headers=headers)
+
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"Error reading library entries: {str(e)}")
         raise HTTPException(status_code=500, detail=f"Failed to read library entries: {str(e)}")
@@ -757,60 +1255,30 @@ async def add_comment(comment_data: LibraryComment):
     """
     try:
         logger.info(f"Adding comment to entry ID: {comment_data.entryId}")
-        library_file = 'library_entries.json'
         
         # Set the date if not provided
         if not comment_data.date:
             comment_data.date = datetime.now().isoformat()
             
-        # Create comment object
+        # Create comment object (the id is generated by the library store)
         comment_obj = {
-            "id": int(time.time() * 1000),  # Use timestamp as ID
-            "entryId": comment_data.entryId,
             "comment": comment_data.comment,
             "author": comment_data.author,
             "date": comment_data.date
         }
         
-        # Check if library file exists
-        if not os.path.exists(library_file):
-            logger.error(f"Library file not found at {library_file}")
-            raise HTTPException(status_code=404, detail="Library data not found")
-        
-        # Read library data
-        with open(library_file, 'r') as f:
-            try:
-                library_data = json.load(f)
-            except json.JSONDecodeError:
-                logger.error("Error parsing library file")
-                raise HTTPException(status_code=500, detail="Error reading library data")
-        
-        # Find the entry
-        found = False
-        for entry in library_data.get("entries", []):
-            if entry.get("id") == comment_data.entryId:
-                # Initialize comments array if it doesn't exist
-                if "commentList" not in entry:
-                    entry["commentList"] = []
-                
-                # Add comment
-                entry["commentList"].append(comment_obj)
-                # Update comment count
-                entry["comments"] = len(entry["commentList"])
-                found = True
-                break
-        
-        if not found:
+        try:
+            with LIBRARY_OPERATION_SECONDS.time(operation="add_comment"):
+                comment_id = await library_writer.add_comment(comment_data.entryId, comment_obj)
+        except EntryNotFound:
             logger.error(f"Entry with ID {comment_data.entryId} not found")
             raise HTTPException(status_code=404, detail=f"Entry with ID {comment_data.entryId} not found")
-        
-        # Write updated data back to file
-        with open(library_file, 'w') as f:
-            json.dump(library_data, f, indent=2)
             
         logger.info(f"Comment added successfully to entry {comment_data.entryId}")
-        return {"success": True, "id": comment_obj["id"], "entryId": comment_data.entryId}
+        return {"success": True, "id": comment_id, "entryId": comment_data.entryId}
         
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"Error adding comment: {str(e)}")
         raise HTTPException(status_code=500, detail=f"Failed to add comment: {str(e)}")
@@ -822,47 +1290,59 @@ async def upvote_entry(upvote_data: UpvoteRequest):
     """
     try:
         logger.info(f"Upvoting entry ID: {upvote_data.entryId}")
-        library_file = 'library_entries.json'
-        
-        # Check if library file exists
-        if not os.path.exists(library_file):
-            logger.error(f"Library file not found at {library_file}")
-            raise HTTPException(status_code=404, detail="Library data not found")
         
-        # Read library data
-        with open(library_file, 'r') as f:
-            try:
-                library_data = json.load(f)
-            except json.JSONDecodeError:
-                logger.error("Error parsing library file")
-                raise HTTPException(status_code=500, detail="Error reading library data")
-        
-        # Find the entry
-        found = False
-        for entry in library_data.get("entries", []):
-            if entry.get("id") == upvote_data.entryId:
-                # Increment vote count
-                entry["votes"] = entry.get("votes", 0) + 1
-                # Increment view count
-                entry["views"] = entry.get("views", 0) + 1
-                found = True
-                break
-        
-        if not found:
+        if not await asyncio.to_thread(library.exists, upvote_data.entryId):
             logger.error(f"Entry with ID {upvote_data.entryId} not found")
             raise HTTPException(status_code=404, detail=f"Entry with ID {upvote_data.entryId} not found")
-        
-        # Write updated data back to file
-        with open(library_file, 'w') as f:
-            json.dump(library_data, f, indent=2)
+
+        # Upvoting also counts as a view
+        with LIBRARY_OPERATION_SECONDS.time(operation="upvote"):
+            await library_counters.add(upvote_data.entryId, votes=1, views=1)
             
         logger.info(f"Entry {upvote_data.entryId} upvoted successfully")
         return {"success": True, "entryId": upvote_data.entryId}
         
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"Error upvoting entry: {str(e)}")
         raise HTTPException(status_code=500, detail=f"Failed to upvote entry: {str(e)}")
 
+@app.get("/api/library/search")
+async def search_library(
+    q: str,
+    category: Optional[str] = None,
+    limit: int = Query(LIBRARY_SEARCH_LIMIT, ge=1, le=LIBRARY_SEARCH_MAX_LIMIT),
+    offset: int = Query(0, ge=0),
+):
+    """
+    Full-text search over the question library, best matches first.
+
+    Each result has the entry's card fields, an HTML-escaped snippet with the matched
+    terms wrapped in <mark> tags, and its relevance score.
+    """
+    try:
+        logger.info(f"Searching library for: {q}")
+        match_query = build_match_query(q)
+        if match_query is None:
+            raise HTTPException(status_code=400, detail="Search query must contain at least one word")
+
+        # FTS5 ranking takes tens of milliseconds on a large library; keep it off the event loop
+        with LIBRARY_OPERATION_SECONDS.time(operation="search"):
+            results = await asyncio.to_thread(library.search, match_query, category=category, limit=limit,
+                                              offset=offset)
+        for result in results:
+            library_counters.overlay(result)
+
+        logger.info(f"Library search returned {len(results)} results")
+        return {"query": q, "results": results}
+
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"Error searching library: {str(e)}")
+        raise HTTPException(status_code=500, detail=f"Failed to search library: {str(e)}")
+
 @app.get("/api/library/entry/{entry_id}")
 async def get_library_entry(entry_id: int):
     """
@@ -870,47 +1350,40 @@ async def get_library_entry(entry_id: int):
     """
     try:
         logger.info(f"Fetching library entry with ID: {entry_id}")
-        library_file = 'library_entries.json'
         
-        # Check if library file exists
-        if not os.path.exists(library_file):
-            logger.error(f"Library file not found at {library_file}")
-            raise HTTPException(status_code=404, detail="Library data not found")
-        
-        # Read library data
-        with open(library_file, 'r') as f:
-            try:
-                library_data = json.load(f)
-            except json.JSONDecodeError:
-                logger.error("Error parsing library file")
-                raise HTTPException(status_code=500, detail="Error reading library data")
-        
-        # Find the entry
-        for entry in library_data.get("entries", []):
-            if entry.get("id") == entry_id:
-                # Increment view count when entry is viewed
-                entry["views"] = entry.get("views", 0) + 1
-                
-                # Log whether bestAnswer is present in the entry
-                if "bestAnswer" in entry and entry["bestAnswer"]:
-                    logger.info(f"Entry {entry_id} has bestAnswer field: {entry['bestAnswer'][:50]}...")
-                else:
-                    logger.warning(f"Entry {entry_id} is missing bestAnswer field or it's empty")
-                    
-                # Write updated view count back to file
-                with open(library_file, 'w') as f:
-                    json.dump(library_data, f, indent=2)
+        try:
+            with LIBRARY_OPERATION_SECONDS.time(operation="get_entry"):
+                entry = await asyncio.to_thread(library.get_entry, entry_id)
+        except EntryNotFound:
+            logger.error(f"Entry with ID {entry_id} not found")
+            raise HTTPException(status_code=404, detail=f"Entry with ID {entry_id} not found")
+
+        # Increment view count when entry is viewed (written behind, reflected immediately)
+        await library_counters.add(entry_id, views=1)
+        library_counters.overlay(entry)
                 
-                logger.info(f"Successfully retrieved entry with ID {entry_id}")
-                return entry
+        # Log whether bestAnswer is present in the entry
+        if entry.get("bestAnswer"):
+            logger.info(f"Entry {entry_id} has bestAnswer field: {entry['bestAnswer'][:50]}...")
+        else:
+            logger.warning(f"Entry {entry_id} is missing bestAnswer field or it's empty")
         
-        logger.error(f"Entry with ID {entry_id} not found")
-        raise HTTPException(status_code=404, detail=f"Entry with ID {entry_id} not found")
+        logger.info(f"Successfully retrieved entry with ID {entry_id}")
+        return entry
         
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"Error retrieving library entry: {str(e)}")
         raise HTTPException(status_code=500, detail=f"Failed to retrieve library entry: {str(e)}")
 
+@app.get("/metrics")
+async def get_metrics():
+    """
+    Expose pipeline, library and HTTP metrics in the Prometheus text format
+    """
+    return Response(content=METRICS.render(), media_type=METRICS_CONTENT_TYPE)
+
 @app.get("/test")
 async def test():
     return {"message": "Test successful"}
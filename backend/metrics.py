@@ -0,0 +1,335 @@
+"""
+In-process metrics exposed in the Prometheus text format at GET /metrics.
+
+Counters, gauges and histograms keep their values in plain dictionaries keyed by
+label values, so recording one observation is a dictionary lookup and an addition
+under an uncontended lock; histograms find their bucket with a binary search.
+Nothing is computed until /metrics is scraped.
+
+The pipeline, persona selection, answer parsing and library operations record into
+the metrics defined at the bottom of this module; MetricsMiddleware adds request
+latency and in-flight counts for every HTTP route.
+"""
+import asyncio
+import bisect
+import functools
+import threading
+import time
+from contextlib import contextmanager
+
+# Latency buckets in seconds, from sub-millisecond library reads to multi-minute LLM stages
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5,
+                   1, 2.5, 5, 10, 20, 30, 60, 120, 300)
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names, values, extra=()):
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    pairs.extend(f'{name}="{_escape(value)}"' for name, value in extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _format_value(value):
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Metric:
+    type = None
+
+    def __init__(self, name, documentation, labelnames=(), function=None):
+        """`function`, if given, is called at scrape time and returns {label values tuple: value} (or a number)."""
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.function = function
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def _key(self, labels):
+        return tuple(labels.get(name, "") for name in self.labelnames)
+
+    def samples(self):
+        """Yield (suffix, label values, extra labels, value) for every series."""
+        if self.function is not None:
+            values = self.function()
+            items = values.items() if isinstance(values, dict) else [((), values)]
+        else:
+            with self._lock:
+                items = list(self._values.items())
+        for key, value in items:
+            yield "", key, (), value
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.type}"]
+        for suffix, key, extra, value in self.samples():
+            lines.append(f"{self.name}{suffix}{_format_labels(self.labelnames, key, extra)} {_format_value(value)}")
+        return "\n".join(lines)
+
+
+class Counter(Metric):
+    type = "counter"
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels):
+        return self._values.get(self._key(labels), 0)
+
+
+class Gauge(Metric):
+    type = "gauge"
+
+    def set(self, value, **labels):
+        with self._lock:
+            self._values[self._key(labels)] = value
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, amount=1, **labels):
+        self.inc(-amount, **labels)
+
+    def value(self, **labels):
+        return self._values.get(self._key(labels), 0)
+
+    @contextmanager
+    def track(self, **labels):
+        """Count the enclosed block as in flight."""
+        self.inc(**labels)
+        try:
+            yield
+        finally:
+            self.dec(**labels)
+
+
+
+class Histogram(Metric):
+    type = "histogram"
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._values.get(key)
+            if series is None:
+                # Per-bucket counts (the last one is +Inf), then sum and count
+                series = self._values[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            series[0][index] += 1
+            series[1] += value
+            series[2] += 1
+
+    @contextmanager
+    def time(self, **labels):
+        """Observe how long the enclosed block takes, whether or not it raises."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def samples(self):
+        with self._lock:
+            items = [(key, (list(series[0]), series[1], series[2])) for key, series in self._values.items()]
+        for key, (counts, total, count) in items:
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += bucket_count
+                yield "_bucket", key, (("le", _format_value(float(bound))),), cumulative
+            yield "_sum", key, (), total
+            yield "_count", key, (), count
+
+
+class MetricsRegistry:
+    def __init__(self):
+        self._metrics = {}
+
+    def register(self, metric):
+        if metric.name in self._metrics:
+            raise ValueError(f"Metric {metric.name} is already registered")
+        self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name, documentation, labelnames=(), function=None):
+        return self.register(Counter(name, documentation, labelnames, function))
+
+    def gauge(self, name, documentation, labelnames=(), function=None):
+        return self.register(Gauge(name, documentation, labelnames, function))
+
+    def histogram(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        return self.register(Histogram(name, documentation, labelnames, buckets))
+
+    def render(self):
+        """Return every metric in the Prometheus text exposition format."""
+        return "\n".join(metric.render() for metric in self._metrics.values()) + "\n"
+
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+REGISTRY = MetricsRegistry()
+
+HTTP_REQUEST_SECONDS = REGISTRY.histogram(
+    "questioncrafter_http_request_duration_seconds",
+    "Time from receiving a request to sending the last byte of its response",
+    ("method", "route", "status"),
+)
+HTTP_REQUESTS_IN_FLIGHT = REGISTRY.gauge(
+    "questioncrafter_http_requests_in_flight", "HTTP requests currently being handled",
+)
+STAGE_SECONDS = REGISTRY.histogram(
+    "questioncrafter_stage_duration_seconds",
+    "Duration of each pipeline stage (LLM prompts, persona selection, answer parsing)",
+    ("stage",),
+)
+STAGE_ERRORS = REGISTRY.counter(
+    "questioncrafter_stage_errors_total", "Pipeline stages that raised an error", ("stage",),
+)
+LLM_TOKENS = REGISTRY.counter(
+    "questioncrafter_llm_tokens_total", "Tokens sent to and received from the LLM per stage", ("stage", "kind"),
+)
+PIPELINE_SECONDS = REGISTRY.histogram(
+    "questioncrafter_pipeline_duration_seconds", "Duration of a whole persona selection or improvement pipeline",
+    ("pipeline",),
+)
+PIPELINES_IN_FLIGHT = REGISTRY.gauge(
+    "questioncrafter_pipelines_in_flight", "Persona selections and improvement pipelines currently running",
+    ("pipeline",),
+)
+ANSWER_PARSE_FALLBACKS = REGISTRY.counter(
+    "questioncrafter_answer_parse_fallbacks_total",
+    "Answer parses that were not clean JSON, by the fallback used (repaired_json, sections, none, default_answer)",
+    ("fallback",),
+)
+COALESCED_REQUESTS = REGISTRY.counter(
+    "questioncrafter_coalesced_requests_total",
+    "Persona selection and improvement calls by coalescing role: leader (ran the computation), "
+    "follower (shared a leader's result) or bypass (too many keys in flight to coalesce)",
+    ("operation", "role"),
+)
+COALESCED_WAIT_TIMEOUTS = REGISTRY.counter(
+    "questioncrafter_coalesced_wait_timeouts_total", "Calls that gave up waiting for a shared computation",
+    ("operation",),
+)
+LLM_SCHEDULER_QUEUE_SECONDS = REGISTRY.histogram(
+    "questioncrafter_llm_scheduler_queue_seconds", "Time LLM calls waited for the scheduler to grant them",
+    ("priority",),
+)
+LLM_SCHEDULER_REJECTIONS = REGISTRY.counter(
+    "questioncrafter_llm_scheduler_rejections_total",
+    "LLM calls rejected because the scheduler queue (queue_full) or the client's share of it (client_queue_full) was full",
+    ("reason",),
+)
+LLM_RETRIES = REGISTRY.counter(
+    "questioncrafter_llm_retries_total", "LLM calls retried after a transient failure", ("stage",),
+)
+LLM_ATTEMPT_TIMEOUTS = REGISTRY.counter(
+    "questioncrafter_llm_attempt_timeouts_total", "LLM call attempts that hit the stage timeout", ("stage",),
+)
+LLM_HEDGES = REGISTRY.counter(
+    "questioncrafter_llm_hedges_total", "Duplicate LLM calls started because the first was slow to respond",
+    ("stage",),
+)
+LLM_CIRCUIT_REJECTIONS = REGISTRY.counter(
+    "questioncrafter_llm_circuit_rejections_total", "LLM calls refused while the circuit breaker was open",
+    ("stage",),
+)
+SESSION_STAGES_RESUMED = REGISTRY.counter(
+    "questioncrafter_session_stages_resumed_total",
+    "Pipeline stages taken from a resumed session's checkpoint instead of calling the LLM again", ("stage",),
+)
+CLIENT_DISCONNECTS = REGISTRY.counter(
+    "questioncrafter_client_disconnects_total",
+    "Requests whose client disconnected before the response was ready, so their remaining work was cancelled",
+    ("endpoint",),
+)
+PIPELINES_CANCELLED = REGISTRY.counter(
+    "questioncrafter_pipelines_cancelled_total", "Persona selections and improvement pipelines cancelled before finishing",
+    ("pipeline",),
+)
+LLM_CALLS_CANCELLED = REGISTRY.counter(
+    "questioncrafter_llm_calls_cancelled_total", "LLM calls cancelled before they finished", ("stage",),
+)
+LIBRARY_OPERATION_SECONDS = REGISTRY.histogram(
+    "questioncrafter_library_operation_duration_seconds", "Duration of library reads and writes", ("operation",),
+)
+LIBRARY_WRITE_BATCH_SIZE = REGISTRY.histogram(
+    "questioncrafter_library_write_batch_size", "Mutations committed per library transaction", (),
+    buckets=(1, 2, 4, 8, 16, 32, 64, 128, 256, 512),
+)
+LIBRARY_NOT_MODIFIED = REGISTRY.counter(
+    "questioncrafter_library_not_modified_total", "Library page requests answered 304 from a matching ETag",
+)
+
+
+@contextmanager
+def track_stage(stage):
+    """Time a pipeline stage and count it as an error if it raises; a cancelled stage (the client left) is not one."""
+    start = time.perf_counter()
+    try:
+        yield
+    except Exception:
+        STAGE_ERRORS.inc(stage=stage)
+        raise
+    finally:
+        STAGE_SECONDS.observe(time.perf_counter() - start, stage=stage)
+
+
+def track_pipeline(pipeline):
+    """Decorate an async function so each call counts as in flight and its duration is recorded."""
+    def decorator(func):
+        @functools.wraps(func)
+        async def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            with PIPELINES_IN_FLIGHT.track(pipeline=pipeline):
+                try:
+                    return await func(*args, **kwargs)
+                except asyncio.CancelledError:
+                    PIPELINES_CANCELLED.inc(pipeline=pipeline)
+                    raise
+                finally:
+                    PIPELINE_SECONDS.observe(time.perf_counter() - start, pipeline=pipeline)
+        return wrapper
+    return decorator
+
+
+class MetricsMiddleware:
+    """ASGI middleware recording latency (until the last body byte, so streams are included) and in-flight requests."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        start = time.perf_counter()
+        status = 500
+        HTTP_REQUESTS_IN_FLIGHT.inc()
+
+        async def send_wrapper(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            HTTP_REQUESTS_IN_FLIGHT.dec()
+            # The router records the matched route in the scope; label by its path template
+            # so ids in URLs do not create new series (unmatched paths share one)
+            route = getattr(scope.get("route"), "path", "unmatched")
+            HTTP_REQUEST_SECONDS.observe(time.perf_counter() - start,
+                                         method=scope["method"], route=route, status=status)
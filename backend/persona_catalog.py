@@ -0,0 +1,126 @@
+"""
+Compiled, read-only persona catalog.
+
+personas.yaml is compiled once at load time into immutable CompiledPersona records.
+Each record carries the defaults for missing fields, the persona's block for the
+improvement prompt and its fields for the API response, so lookups and prompt
+assembly at request time do no formatting and never touch shared mutable state.
+"""
+from types import MappingProxyType
+from typing import NamedTuple, Tuple
+
+API_FIELDS = (
+    "name",
+    "role",
+    "background",
+    "core_expertise",
+    "cognitive_approach",
+    "values_and_motivations",
+    "communication_style",
+    "notable_trait",
+)
+
+
+def render_prompt_block(persona):
+    """Format a persona's fields for the improvement prompt (everything except the rationale line)."""
+    return (
+        f"Name: {persona.get('name', 'Unknown')}\n"
+        f"Role: {persona.get('role', 'Unknown')}\n"
+        f"Background: {persona.get('background', 'No background available')}\n"
+        f"Core Expertise: {', '.join(persona.get('core_expertise') or [])}\n"
+        f"Cognitive Approach: {persona.get('cognitive_approach', '')}\n"
+        f"Values and Motivations: {persona.get('values_and_motivations', '')}\n"
+        f"Communication Style: {persona.get('communication_style', '')}\n"
+        f"Notable Trait: {persona.get('notable_trait', '')}\n"
+    )
+
+
+class CompiledPersona(NamedTuple):
+    """One persona from personas.yaml with defaults applied and its renderings precomputed."""
+    key: str
+    name: str
+    role: str
+    background: str
+    core_expertise: Tuple[str, ...]
+    cognitive_approach: str
+    values_and_motivations: str
+    communication_style: str
+    notable_trait: str
+    prompt_block: str
+    api_fields: MappingProxyType
+
+    @property
+    def original_role(self):
+        return self.key
+
+    def to_api(self, rationale):
+        """Return the persona as served by /select-personas, with its selection rationale."""
+        return {**self.api_fields, "rationale": rationale}
+
+    def matches(self, payload):
+        """True if a client-supplied persona dict carries exactly this persona's fields."""
+        for field in API_FIELDS:
+            value = payload.get(field)
+            if field == "core_expertise":
+                value = tuple(value or ())
+            if value != self.api_fields[field]:
+                return False
+        return True
+
+
+def compile_persona(key, definition):
+    """Compile one personas.yaml entry, filling in the defaults for missing fields."""
+    fields = {
+        "name": definition.get("name", key),
+        "role": definition.get("role", "Unknown"),
+        "background": definition.get("background", "No background available"),
+        "core_expertise": tuple(definition.get("core_expertise") or ()),
+        "cognitive_approach": definition.get("cognitive_approach", ""),
+        "values_and_motivations": definition.get("values_and_motivations", ""),
+        "communication_style": definition.get("communication_style", ""),
+        "notable_trait": definition.get("notable_trait", ""),
+    }
+    return CompiledPersona(
+        key=key,
+        prompt_block=render_prompt_block(fields),
+        api_fields=MappingProxyType(fields),
+        **fields,
+    )
+
+
+class PersonaCatalog:
+    """Read-only mapping of persona key to CompiledPersona."""
+
+    __slots__ = ("personas", "names", "_by_identity")
+
+    def __init__(self, definitions):
+        compiled = {key: compile_persona(key, definition) for key, definition in definitions.items()}
+        self.personas = MappingProxyType(compiled)
+        self.names = tuple(compiled)
+        self._by_identity = MappingProxyType({(p.name, p.role): p for p in compiled.values()})
+
+    def __len__(self):
+        return len(self.names)
+
+    def __contains__(self, key):
+        return key in self.personas
+
+    def get(self, key):
+        """Return the compiled persona for a key, or a placeholder for an unknown one."""
+        persona = self.personas.get(key)
+        if persona is None:
+            persona = compile_persona(key, {"name": key})
+        return persona
+
+    def match(self, payload):
+        """Return the catalog persona a client-supplied persona dict was served from, if unchanged."""
+        persona = self._by_identity.get((payload.get("name"), payload.get("role")))
+        if persona is not None and persona.matches(payload):
+            return persona
+        return None
+
+    def prompt_block(self, payload):
+        """Return the improvement-prompt block for a client-supplied persona, including its rationale."""
+        persona = self.match(payload)
+        block = persona.prompt_block if persona is not None else render_prompt_block(payload)
+        return f"{block}Rationale for Selection: {payload.get('rationale', '')}"
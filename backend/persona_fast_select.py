@@ -0,0 +1,108 @@
+"""
+Zero-LLM persona triad selection.
+
+Personas are embedded once, at load time, as L2-normalized TF-IDF vectors over the
+same fields the lexical index uses, along with a persona-by-persona cosine
+similarity matrix. A question is scored against every persona with a single
+matrix-vector product. The triad is chosen from the top candidates by maximizing
+total relevance minus a penalty for pairwise similarity, so three near-identical
+experts are not picked together. Rationales are filled in from templates using the
+expertise terms that matched the question.
+"""
+import itertools
+import os
+
+import numpy as np
+
+from persona_index import persona_document, tokenize
+
+FAST_SELECT_CANDIDATES = int(os.getenv("FAST_SELECT_CANDIDATES", "12"))
+FAST_SELECT_SIMILARITY_PENALTY = float(os.getenv("FAST_SELECT_SIMILARITY_PENALTY", "0.5"))
+
+TRIAD_SIZE = 3
+
+
+class FastPersonaSelector:
+    """Vectorized relevance + complementarity scoring over a persona catalog."""
+
+    def __init__(self, personas, candidates=FAST_SELECT_CANDIDATES,
+                 similarity_penalty=FAST_SELECT_SIMILARITY_PENALTY):
+        self.keys = list(personas.keys())
+        self.personas = personas
+        self.candidates = candidates
+        self.similarity_penalty = similarity_penalty
+
+        documents = [tokenize(persona_document(persona)) for persona in personas.values()]
+        self.vocabulary = {term: i for i, term in enumerate(sorted({t for doc in documents for t in doc}))}
+
+        counts = np.zeros((len(documents), len(self.vocabulary)), dtype=np.float32)
+        for row, doc in enumerate(documents):
+            for term in doc:
+                counts[row, self.vocabulary[term]] += 1.0
+        document_frequency = np.count_nonzero(counts, axis=0)
+        self.idf = (np.log((1 + len(documents)) / (1 + document_frequency)) + 1.0).astype(np.float32)
+        self.matrix = self._normalize(counts * self.idf)
+        self.similarity = self.matrix @ self.matrix.T
+
+        # Expertise items per persona, tokenized once for rationale templates
+        self.expertise_terms = [
+            [(item, set(tokenize(item))) for item in persona.get("core_expertise", []) or []]
+            for persona in personas.values()
+        ]
+        self._combinations = {}
+
+    @staticmethod
+    def _normalize(matrix):
+        norms = np.linalg.norm(matrix, axis=-1, keepdims=True)
+        norms[norms == 0] = 1.0
+        return matrix / norms
+
+    def _combinations_for(self, size):
+        combos = self._combinations.get(size)
+        if combos is None:
+            combos = np.array(list(itertools.combinations(range(size), TRIAD_SIZE)), dtype=np.intp)
+            self._combinations[size] = combos
+        return combos
+
+    def relevance(self, question):
+        """Cosine relevance of every persona to the question."""
+        query = np.zeros(len(self.vocabulary), dtype=np.float32)
+        for term in tokenize(question):
+            index = self.vocabulary.get(term)
+            if index is not None:
+                query[index] += 1.0
+        if not query.any():
+            return np.zeros(len(self.keys), dtype=np.float32)
+        return self.matrix @ self._normalize(query * self.idf)
+
+    def select(self, question):
+        """Return [(persona_key, rationale), ...] for the best-balanced triad."""
+        if len(self.keys) < TRIAD_SIZE:
+            return [(key, self.rationale(i, question)) for i, key in enumerate(self.keys)]
+
+        scores = self.relevance(question)
+        pool_size = max(TRIAD_SIZE, min(self.candidates, len(self.keys)))
+        pool = np.argsort(-scores, kind="stable")[:pool_size]
+
+        combos = pool[self._combinations_for(pool_size)]
+        total_relevance = scores[combos].sum(axis=1)
+        pairwise = (self.similarity[combos[:, 0], combos[:, 1]]
+                    + self.similarity[combos[:, 0], combos[:, 2]]
+                    + self.similarity[combos[:, 1], combos[:, 2]])
+        best = combos[int(np.argmax(total_relevance - self.similarity_penalty * pairwise))]
+
+        ordered = sorted(best.tolist(), key=lambda i: -scores[i])
+        return [(self.keys[i], self.rationale(i, question)) for i in ordered]
+
+    def rationale(self, index, question):
+        """Template rationale naming the persona's expertise that matches the question."""
+        persona = self.personas[self.keys[index]]
+        role = persona.get("role", self.keys[index])
+        question_terms = set(tokenize(question))
+        matched = [item for item, terms in self.expertise_terms[index] if terms & question_terms]
+        if matched:
+            return f"The {role} brings direct expertise in {', '.join(matched[:3])}, which bears on the core of this question."
+        approach = persona.get("cognitive_approach", "")
+        if approach:
+            return f"The {role} adds a complementary perspective to the other experts: {approach[0].lower()}{approach[1:]}"
+        return f"The {role} adds a complementary perspective to the other selected experts."
@@ -0,0 +1,105 @@
+"""
+In-memory lexical index over the persona catalog.
+
+Each persona is indexed as a bag of words built from its role, core expertise,
+background and cognitive approach, and scored against a question with Okapi BM25.
+The persona-selection prompt only lists the top-N shortlisted personas, so its size
+stays flat as the catalog grows.
+"""
+import math
+import os
+import re
+from collections import Counter, defaultdict
+
+PERSONA_SHORTLIST_SIZE = int(os.getenv("PERSONA_SHORTLIST_SIZE", "12"))
+
+INDEXED_FIELDS = ("role", "core_expertise", "background", "cognitive_approach")
+
+STOPWORDS = frozenset("""
+a an and are as at be been but by can could do does for from has have how i if in into is it its
+me my of on or our should so than that the their them then there these they this to was we what
+when where which who why will with would you your
+""".split())
+
+TOKEN_PATTERN = re.compile(r"[a-z0-9]+")
+
+
+def tokenize(text):
+    """Lowercase word tokens with stopwords removed."""
+    return [token for token in TOKEN_PATTERN.findall(text.lower()) if token not in STOPWORDS]
+
+
+def persona_document(persona):
+    """Concatenate the indexed fields of a persona definition into one text."""
+    parts = []
+    for field in INDEXED_FIELDS:
+        value = persona.get(field, "")
+        if isinstance(value, (list, tuple)):
+            parts.extend(str(item) for item in value)
+        elif value:
+            parts.append(str(value))
+    return " ".join(parts)
+
+
+class PersonaIndex:
+    """BM25 inverted index mapping question terms to candidate personas."""
+
+    def __init__(self, documents, k1=1.5, b=0.75):
+        """documents is a list of (persona_key, text) pairs in catalog order."""
+        self.k1 = k1
+        self.b = b
+        self.keys = [key for key, _ in documents]
+        self.postings = defaultdict(list)
+        lengths = []
+        for doc_id, (_, text) in enumerate(documents):
+            term_counts = Counter(tokenize(text))
+            lengths.append(sum(term_counts.values()))
+            for term, count in term_counts.items():
+                self.postings[term].append((doc_id, count))
+        self.doc_lengths = lengths
+        average_length = (sum(lengths) / len(lengths)) if lengths else 0.0
+        self.length_norms = [
+            k1 * (1 - b + b * (length / average_length)) if average_length else k1
+            for length in lengths
+        ]
+        total = len(documents)
+        self.idf = {
+            term: math.log(1 + (total - len(postings) + 0.5) / (len(postings) + 0.5))
+            for term, postings in self.postings.items()
+        }
+
+    @classmethod
+    def from_personas(cls, personas):
+        """Build an index from the 'personas' mapping of personas.yaml."""
+        return cls([(key, persona_document(persona)) for key, persona in personas.items()])
+
+    def __len__(self):
+        return len(self.keys)
+
+    def score(self, question):
+        """Return {doc_id: BM25 score} for every persona sharing a term with the question."""
+        scores = defaultdict(float)
+        for term in set(tokenize(question)):
+            idf = self.idf.get(term)
+            if idf is None:
+                continue
+            for doc_id, count in self.postings[term]:
+                scores[doc_id] += idf * count * (self.k1 + 1) / (count + self.length_norms[doc_id])
+        return scores
+
+    def shortlist(self, question, size=PERSONA_SHORTLIST_SIZE):
+        """
+        Return up to `size` persona keys ranked by relevance to the question.
+
+        Personas without any matching term fill the remaining slots in catalog order,
+        so the selection prompt always offers a full shortlist. A size of 0 or less
+        returns the whole catalog.
+        """
+        limit = len(self.keys) if size <= 0 else min(size, len(self.keys))
+        scores = self.score(question)
+        ranked = sorted(scores, key=lambda doc_id: (-scores[doc_id], doc_id))[:limit]
+        if len(ranked) < limit:
+            chosen = set(ranked)
+            ranked.extend(doc_id for doc_id in range(len(self.keys)) if doc_id not in chosen)
+            ranked = ranked[:limit]
+        return [self.keys[doc_id] for doc_id in ranked]
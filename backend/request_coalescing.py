@@ -0,0 +1,108 @@
+"""
+Single-flight coalescing of identical in-flight requests.
+
+Concurrent calls with the same key share one computation: the first caller starts it
+as a task, and callers arriving while it runs wait on that task and receive the same
+result (or the same exception) instead of running the pipeline again. Once the task
+finishes the key is released, so later calls start fresh (and usually hit a result
+cache instead).
+
+The number of distinct keys in flight is bounded; beyond REQUEST_COALESCING_MAX_KEYS
+calls simply run on their own. Each caller waits at most REQUEST_COALESCING_TIMEOUT
+seconds. A computation whose callers have all timed out or gone away is cancelled.
+"""
+import asyncio
+import hashlib
+import json
+import logging
+import os
+
+from metrics import COALESCED_REQUESTS, COALESCED_WAIT_TIMEOUTS
+
+logger = logging.getLogger(__name__)
+
+# Distinct computations that can be shared at once (0 disables coalescing)
+REQUEST_COALESCING_MAX_KEYS = int(os.getenv("REQUEST_COALESCING_MAX_KEYS", "1024"))
+REQUEST_COALESCING_TIMEOUT = float(os.getenv("REQUEST_COALESCING_TIMEOUT", "900"))
+
+
+class CoalescedWaitTimeout(TimeoutError):
+    """Raised when a caller waited longer than the timeout for a shared computation."""
+
+
+def coalescing_key(operation, payload):
+    """Hash a request payload into a key, independent of dict ordering."""
+    encoded = json.dumps(payload, sort_keys=True, ensure_ascii=False, default=str).encode("utf-8")
+    return f"{operation}:{hashlib.sha256(encoded).hexdigest()}"
+
+
+class _Flight:
+    __slots__ = ("task", "waiters")
+
+    def __init__(self, task):
+        self.task = task
+        self.waiters = 0
+
+
+class RequestCoalescer:
+    """Shares one in-flight computation between concurrent calls with the same key."""
+
+    def __init__(self, max_keys=REQUEST_COALESCING_MAX_KEYS, timeout=REQUEST_COALESCING_TIMEOUT):
+        self.max_keys = max_keys
+        self.timeout = timeout
+        self._flights = {}
+
+    async def run(self, operation, key, func):
+        """Return the result of `func()`, shared with any identical call already running under `key`."""
+        flight = self._flights.get(key)
+        if flight is not None:
+            role = "follower"
+        elif len(self._flights) >= self.max_keys:
+            COALESCED_REQUESTS.inc(operation=operation, role="bypass")
+            task = asyncio.ensure_future(func())
+            try:
+                return await self._wait(operation, task)
+            finally:
+                if not task.done():
+                    task.cancel()
+                    await asyncio.gather(task, return_exceptions=True)
+        else:
+            role = "leader"
+            flight = self._flights[key] = _Flight(asyncio.ensure_future(func()))
+            flight.task.add_done_callback(lambda task: self._release(key, flight))
+        COALESCED_REQUESTS.inc(operation=operation, role=role)
+        if role == "follower":
+            logger.info(f"Joining in-flight {operation} computation")
+
+        flight.waiters += 1
+        try:
+            return await self._wait(operation, flight.task)
+        finally:
+            flight.waiters -= 1
+            if flight.waiters == 0 and not flight.task.done():
+                logger.warning(f"Cancelling {operation} computation: no callers are waiting for it")
+                flight.task.cancel()
+
+    async def _wait(self, operation, task):
+        """
+        Return `task`'s result, or raise CoalescedWaitTimeout if it is still running after the timeout.
+
+        Unlike wait_for, this leaves the task running when the caller times out or is cancelled, so
+        one caller giving up does not cancel the others' result, and a TimeoutError raised by the
+        computation itself (a stage timeout, say) propagates as it is.
+        """
+        done, _ = await asyncio.wait((task,), timeout=self.timeout)
+        if not done:
+            COALESCED_WAIT_TIMEOUTS.inc(operation=operation)
+            raise CoalescedWaitTimeout(f"Timed out after {self.timeout:g}s waiting for {operation}")
+        return task.result()
+
+    def _release(self, key, flight):
+        if self._flights.get(key) is flight:
+            del self._flights[key]
+        # Nobody may be left to retrieve the exception of a cancelled or abandoned computation
+        if not flight.task.cancelled():
+            flight.task.exception()
+
+    def __len__(self):
+        return len(self._flights)
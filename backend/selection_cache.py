@@ -0,0 +1,196 @@
+"""
+Result cache for persona selection.
+
+Selections are keyed on the normalized question text plus a hash of the loaded
+persona catalog, so trivial variants of a question (casing, extra whitespace) share
+an entry and editing personas.yaml invalidates every cached selection. Entries are
+bounded in number (least recently used are evicted first) and expire after a TTL.
+
+Two storage backends are available: an in-process dictionary, and a SQLite file
+that several workers on the same host can share. SQLite lookups run in a worker
+thread so they never block the event loop.
+"""
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import re
+import threading
+import time
+from collections import OrderedDict
+
+from sqlite_storage import connect, init_database
+
+logger = logging.getLogger(__name__)
+
+SELECTION_CACHE_BACKEND = os.getenv("SELECTION_CACHE_BACKEND", "memory")
+SELECTION_CACHE_MAX_ENTRIES = int(os.getenv("SELECTION_CACHE_MAX_ENTRIES", "1024"))
+SELECTION_CACHE_TTL = float(os.getenv("SELECTION_CACHE_TTL", "86400"))
+SELECTION_CACHE_PATH = os.getenv("SELECTION_CACHE_PATH", "selection_cache.sqlite3")
+
+SQLITE_SCHEMA = """
+CREATE TABLE IF NOT EXISTS selection_cache (
+    key TEXT PRIMARY KEY,
+    value TEXT NOT NULL,
+    expires_at REAL NOT NULL,
+    accessed_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS selection_cache_accessed ON selection_cache (accessed_at);
+"""
+
+
+def normalize_question(text):
+    """Collapse whitespace and casing so trivially different questions share a key."""
+    return re.sub(r"\s+", " ", text).strip().casefold()
+
+
+def catalog_version(personas_data):
+    """Return a stable hash of the loaded persona catalog."""
+    encoded = json.dumps(personas_data, sort_keys=True, ensure_ascii=False).encode("utf-8")
+    return hashlib.sha256(encoded).hexdigest()[:16]
+
+
+class MemoryCacheBackend:
+    """In-process LRU store with per-entry expiry."""
+
+    # Cheap enough to call straight from the event loop
+    blocking = False
+
+    def __init__(self, max_entries=SELECTION_CACHE_MAX_ENTRIES, ttl=SELECTION_CACHE_TTL):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            item = self._entries.get(key)
+            if item is None:
+                return None
+            expires_at, value = item
+            if expires_at <= time.time():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        with self._lock:
+            self._entries[key] = (time.time() + self.ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+
+class SQLiteCacheBackend:
+    """LRU store in a local SQLite file, shared by every worker that opens the same path."""
+
+    # Does file I/O, so SelectionCache calls it from a worker thread
+    blocking = True
+
+    def __init__(self, path=SELECTION_CACHE_PATH, max_entries=SELECTION_CACHE_MAX_ENTRIES, ttl=SELECTION_CACHE_TTL):
+        self.path = path
+        self.max_entries = max_entries
+        self.ttl = ttl
+        init_database(path, SQLITE_SCHEMA)
+
+    def _connect(self):
+        return connect(self.path)
+
+    def get(self, key):
+        now = time.time()
+        with self._connect() as conn:
+            row = conn.execute("SELECT value, expires_at FROM selection_cache WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                return None
+            if row[1] <= now:
+                conn.execute("DELETE FROM selection_cache WHERE key = ?", (key,))
+                return None
+            conn.execute("UPDATE selection_cache SET accessed_at = ? WHERE key = ?", (now, key))
+            return row[0]
+
+    def set(self, key, value):
+        now = time.time()
+        with self._connect() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO selection_cache (key, value, expires_at, accessed_at) VALUES (?, ?, ?, ?)",
+                (key, value, now + self.ttl, now),
+            )
+            conn.execute("DELETE FROM selection_cache WHERE expires_at <= ?", (now,))
+            conn.execute(
+                "DELETE FROM selection_cache WHERE key IN ("
+                "SELECT key FROM selection_cache ORDER BY accessed_at DESC LIMIT -1 OFFSET ?)",
+                (self.max_entries,),
+            )
+
+    def clear(self):
+        with self._connect() as conn:
+            conn.execute("DELETE FROM selection_cache")
+
+    def __len__(self):
+        with self._connect() as conn:
+            return conn.execute("SELECT COUNT(*) FROM selection_cache").fetchone()[0]
+
+
+class SelectionCache:
+    """Persona-selection results keyed on normalized question and catalog version, with hit/miss counters."""
+
+    def __init__(self, backend):
+        self.backend = backend
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def make_key(question, version):
+        return f"{version}:{hashlib.sha256(normalize_question(question).encode('utf-8')).hexdigest()}"
+
+    async def _call(self, method, *args):
+        if self.backend.blocking:
+            return await asyncio.to_thread(method, *args)
+        return method(*args)
+
+    async def get(self, question, version):
+        """Return a fresh copy of the cached selection, or None on a miss."""
+        try:
+            value = await self._call(self.backend.get, self.make_key(question, version))
+        except Exception as e:
+            logger.error(f"Selection cache read failed: {str(e)}")
+            value = None
+        if value is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return json.loads(value)
+
+    async def set(self, question, version, result):
+        try:
+            await self._call(self.backend.set, self.make_key(question, version), json.dumps(result))
+        except Exception as e:
+            logger.error(f"Selection cache write failed: {str(e)}")
+
+    async def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            "backend": type(self.backend).__name__,
+            "entries": await self._call(len, self.backend),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": self.hits / lookups if lookups else 0.0,
+        }
+
+
+def create_selection_cache(backend=SELECTION_CACHE_BACKEND):
+    """Build the selection cache configured by SELECTION_CACHE_BACKEND ('memory' or 'sqlite')."""
+    if backend == "sqlite":
+        return SelectionCache(SQLiteCacheBackend())
+    if backend != "memory":
+        logger.warning(f"Unknown selection cache backend '{backend}', using in-memory cache")
+    return SelectionCache(MemoryCacheBackend())
@@ -0,0 +1,34 @@
+"""
+Connections to the small SQLite files behind the batch job store, the improvement
+session store and the SQLite selection cache.
+
+These stores open a connection per operation and close it when the operation ends, so
+they can be called from any worker thread without sharing a connection between
+threads. Each file is in WAL mode, so reads never wait behind a write, and a writer
+waits up to SQLITE_BUSY_TIMEOUT seconds for another one to commit.
+"""
+import contextlib
+import sqlite3
+
+SQLITE_BUSY_TIMEOUT = 5
+
+
+def init_database(path, schema):
+    """Switch the file to WAL mode and create its tables and indexes if they do not exist."""
+    with connect(path) as conn:
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.executescript(schema)
+
+
+@contextlib.contextmanager
+def connect(path, pragmas=()):
+    """A connection for one transaction, committed on success and closed afterwards."""
+    conn = sqlite3.connect(path, timeout=SQLITE_BUSY_TIMEOUT)
+    conn.row_factory = sqlite3.Row
+    try:
+        for pragma in pragmas:
+            conn.execute(f"PRAGMA {pragma}")
+        with conn:
+            yield conn
+    finally:
+        conn.close()
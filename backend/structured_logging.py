@@ -0,0 +1,194 @@
+"""
+Structured, non-blocking logging with per-request correlation ids.
+
+configure_logging() routes every record through a bounded in-memory queue to a
+listener thread, which formats it (one JSON object per line by default) and writes
+it to stderr, so log I/O never blocks the event loop. When the queue is full,
+records are dropped and counted rather than waiting.
+
+RequestContextMiddleware gives each HTTP request a correlation id (the caller's
+X-Request-ID header if it sent a valid one, otherwise a fresh one), returns it in
+the response's X-Request-ID header, and attaches it to every record logged while the
+request is handled, including from tasks it starts.
+
+Messages are capped at LOG_MAX_MESSAGE_CHARS. Prompts, LLM responses and other
+large bodies go through log_payload: by default only a short preview is logged, for
+a sampled share of requests; LOG_FULL_PAYLOADS=true logs them in full.
+"""
+import atexit
+import contextvars
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import random
+import re
+import sys
+import uuid
+from contextlib import contextmanager
+from datetime import datetime, timezone
+
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+# "json" (one object per line) or "text" (human-readable, for local development)
+LOG_FORMAT = os.getenv("LOG_FORMAT", "json")
+LOG_QUEUE_SIZE = int(os.getenv("LOG_QUEUE_SIZE", "10000"))
+LOG_MAX_MESSAGE_CHARS = int(os.getenv("LOG_MAX_MESSAGE_CHARS", "1000"))
+LOG_PAYLOAD_PREVIEW_CHARS = int(os.getenv("LOG_PAYLOAD_PREVIEW_CHARS", "200"))
+# Share of requests whose payloads are logged at all
+LOG_PAYLOAD_SAMPLE_RATE = float(os.getenv("LOG_PAYLOAD_SAMPLE_RATE", "1.0"))
+# Debug switch: log prompts and responses in full instead of a preview
+LOG_FULL_PAYLOADS = os.getenv("LOG_FULL_PAYLOADS", "false").lower() in ("1", "true", "yes")
+
+REQUEST_ID_HEADER = "x-request-id"
+_VALID_REQUEST_ID = re.compile(r"^[A-Za-z0-9._:-]{1,64}$")
+
+request_id_var = contextvars.ContextVar("request_id", default="-")
+# Whether this request's payloads were sampled for logging
+payload_sampled_var = contextvars.ContextVar("payload_sampled", default=True)
+
+# Attributes every LogRecord has; anything else was passed through `extra` and is logged as a field
+_RECORD_ATTRIBUTES = set(vars(logging.LogRecord("", 0, "", 0, "", (), None))) | {"message", "request_id"}
+
+_listener = None
+dropped_records = 0
+
+
+def _truncate(text, limit):
+    if limit and len(text) > limit:
+        return f"{text[:limit]}... [{len(text) - limit} more chars]"
+    return text
+
+
+class RequestIdFilter(logging.Filter):
+    """Stamp each record with the correlation id of the request that logged it."""
+
+    def filter(self, record):
+        record.request_id = request_id_var.get()
+        return True
+
+
+class JSONFormatter(logging.Formatter):
+    def format(self, record):
+        entry = {
+            "ts": datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "logger": record.name,
+            "request_id": getattr(record, "request_id", "-"),
+            "message": _truncate(record.getMessage(), LOG_MAX_MESSAGE_CHARS),
+        }
+        for key, value in vars(record).items():
+            if key not in _RECORD_ATTRIBUTES:
+                entry[key] = value
+        if record.exc_text:
+            entry["exception"] = record.exc_text
+        return json.dumps(entry, default=str, ensure_ascii=False)
+
+
+class TextFormatter(logging.Formatter):
+    def __init__(self):
+        super().__init__("%(asctime)s %(levelname)s [%(request_id)s] %(name)s: %(message)s")
+
+    def formatMessage(self, record):
+        record.message = _truncate(record.message, LOG_MAX_MESSAGE_CHARS)
+        line = super().formatMessage(record)
+        extra = {key: value for key, value in vars(record).items() if key not in _RECORD_ATTRIBUTES}
+        return f"{line} {json.dumps(extra, default=str, ensure_ascii=False)}" if extra else line
+
+
+class DroppingQueueHandler(logging.handlers.QueueHandler):
+    """Queue handler that never blocks the caller: records that do not fit are dropped and counted."""
+
+    def prepare(self, record):
+        # Resolve the message and traceback here, but leave formatting to the listener thread
+        record = logging.makeLogRecord(vars(record))
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+    def enqueue(self, record):
+        global dropped_records
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            dropped_records += 1
+
+
+def configure_logging(level=LOG_LEVEL, log_format=LOG_FORMAT, queue_size=LOG_QUEUE_SIZE, stream=None):
+    """Send every log record through a bounded queue to a background thread that formats and writes it."""
+    global _listener
+    stop_logging()
+    target = logging.StreamHandler(stream or sys.stderr)
+    target.setFormatter(TextFormatter() if log_format == "text" else JSONFormatter())
+    queue_handler = DroppingQueueHandler(queue.Queue(maxsize=queue_size))
+    queue_handler.addFilter(RequestIdFilter())
+
+    root = logging.getLogger()
+    for handler in list(root.handlers):
+        root.removeHandler(handler)
+    root.addHandler(queue_handler)
+    root.setLevel(level)
+
+    _listener = logging.handlers.QueueListener(queue_handler.queue, target, respect_handler_level=True)
+    _listener.start()
+    atexit.register(stop_logging)
+
+
+def stop_logging():
+    """Flush the queue and stop the listener thread."""
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
+
+
+def log_payload(logger, label, payload, level=logging.INFO, **fields):
+    """Log a prompt, response or other large body as a `payload` field: a preview, or in full with LOG_FULL_PAYLOADS."""
+    if not logger.isEnabledFor(level) or not payload_sampled_var.get():
+        return
+    text = payload if isinstance(payload, str) else json.dumps(payload, default=str, ensure_ascii=False)
+    limit = 0 if LOG_FULL_PAYLOADS else LOG_PAYLOAD_PREVIEW_CHARS
+    logger.log(level, label, extra={"payload": _truncate(text, limit), "payload_chars": len(text), **fields})
+
+
+@contextmanager
+def bind_request_id(request_id, sample_rate=LOG_PAYLOAD_SAMPLE_RATE):
+    """Attach a correlation id (and a payload sampling decision) to everything logged in the block."""
+    id_token = request_id_var.set(request_id)
+    sampled_token = payload_sampled_var.set(sample_rate >= 1 or random.random() < sample_rate)
+    try:
+        yield request_id
+    finally:
+        request_id_var.reset(id_token)
+        payload_sampled_var.reset(sampled_token)
+
+
+class RequestContextMiddleware:
+    """ASGI middleware binding a correlation id to each request and echoing it in X-Request-ID."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        request_id = None
+        for name, value in scope["headers"]:
+            if name == b"x-request-id":
+                candidate = value.decode("latin-1")
+                if _VALID_REQUEST_ID.match(candidate):
+                    request_id = candidate
+                break
+        request_id = request_id or uuid.uuid4().hex[:16]
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                message["headers"] = [*message.get("headers", []), (REQUEST_ID_HEADER.encode(), request_id.encode())]
+            await send(message)
+
+        with bind_request_id(request_id):
+            await self.app(scope, receive, send_wrapper)
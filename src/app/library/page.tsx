@@ -711,21 +711,32 @@ function HeaderBar() {
 function QuestionLibrary() {
   const [activeTab, setActiveTab] = useState('all')
   const [userEntries, setUserEntries] = useState<any[]>([])
+  const [nextCursor, setNextCursor] = useState<string | null>(null)
   const [isLoading, setIsLoading] = useState(false)
+  const [isLoadingMore, setIsLoadingMore] = useState(false)
   const [error, setError] = useState<string | null>(null)
   
-  // Fetch user-contributed entries from the API
+  // Fetch one page of user-contributed entries (card fields only; details load on expand)
+  const fetchLibraryPage = async (cursor: string | null) => {
+    const params = new URLSearchParams({ fields: 'summary', limit: '24' })
+    if (cursor) {
+      params.set('cursor', cursor)
+    }
+    const response = await fetch(`http://localhost:8000/api/library/entries?${params}`)
+    if (!response.ok) {
+      throw new Error('Failed to fetch library entries')
+    }
+    return response.json()
+  }
+
   useEffect(() => {
     const fetchLibraryEntries = async () => {
       setIsLoading(true)
       try {
-        const response = await fetch('http://localhost:8000/api/library/entries')
-        if (!response.ok) {
-          throw new Error('Failed to fetch library entries')
-        }
-        const data = await response.json()
+        const data = await fetchLibraryPage(null)
         console.log("Fetched library entries:", data)
         setUserEntries(data.entries || [])
+        setNextCursor(data.nextCursor || null)
       } catch (err) {
         console.error('Error fetching library entries:', err)
         setError('Failed to load user contributions. Please try again later.')
@@ -736,6 +747,20 @@ function QuestionLibrary() {
     
     fetchLibraryEntries()
   }, [])
+
+  const loadMoreEntries = async () => {
+    if (!nextCursor || isLoadingMore) return
+    setIsLoadingMore(true)
+    try {
+      const data = await fetchLibraryPage(nextCursor)
+      setUserEntries(prev => [...prev, ...(data.entries || [])])
+      setNextCursor(data.nextCursor || null)
+    } catch (err) {
+      console.error('Error fetching more library entries:', err)
+    } finally {
+      setIsLoadingMore(false)
+    }
+  }
   
   // Combine sample journeys with user-contributed entries
   const allJourneys = [...sampleJourneys, ...userEntries]
@@ -841,6 +866,15 @@ function QuestionLibrary() {
               )}
             </div>
           )}
+
+          {/* Load More */}
+          {!isLoading && !error && nextCursor && (
+            <div className="flex justify-center mt-8">
+              <Button variant="outline" onClick={loadMoreEntries} disabled={isLoadingMore}>
+                {isLoadingMore ? 'Loading...' : 'Load More Questions'}
+              </Button>
+            </div>
+          )}
         </div>
       </div>
     </div>